@@ -19,6 +19,10 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'a_core.settings')
 # is populated before importing code that may import ORM models.
 django_asgi_app = get_asgi_application()
 
+# Tracing hooks and the sampling-profile signal handler, from the main thread
+from a_core import profiling
+profiling.install()
+
 # Import routing after Django is initialized
 from a_rtchat.routing import websocket_urlpatterns
 
@@ -0,0 +1,48 @@
+"""
+Database connection pool metrics.
+
+With CONN_MAX_AGE, every daphne thread that runs ORM code keeps its own
+persistent connection. That includes the view thread and each
+database_sync_to_async executor thread, so the connection count follows
+the thread count. With DATABASE_POOL on (PostgreSQL with psycopg 3),
+settings switch to Django's psycopg_pool instead: one bounded pool per
+alias per process, shared by all of those threads. A thread borrows a
+connection for one request or one database_sync_to_async call and returns
+it afterwards. When the pool is exhausted, callers wait in a queue for up
+to ``timeout`` seconds, and connections are health-checked before they
+are handed out.
+"""
+from django.contrib.auth.decorators import login_required
+from django.db import connections
+from django.http import HttpResponseForbidden, JsonResponse
+
+
+def pool_stats(alias):
+    """Counters of one alias's pool, or how it connects when it has none"""
+    connection = connections[alias]
+    # Only the PostgreSQL backend has a pool, and only with OPTIONS['pool']
+    pool = getattr(connection, 'pool', None)
+    if pool is None:
+        return {
+            'pooled': False,
+            'vendor': connection.vendor,
+            'conn_max_age': connection.settings_dict.get('CONN_MAX_AGE'),
+        }
+    return {
+        'pooled': True,
+        'name': pool.name,
+        'min_size': pool.min_size,
+        'max_size': pool.max_size,
+        'timeout': pool.timeout,
+        # pool_size, pool_available, requests_waiting, requests_wait_ms,
+        # requests_errors, connections_num, ...; counters since process start
+        **pool.get_stats(),
+    }
+
+
+@login_required
+def pool_metrics(request):
+    """Staff-only JSON of every database alias's pool in this process"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse({alias: pool_stats(alias) for alias in connections.settings})
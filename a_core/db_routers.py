@@ -0,0 +1,106 @@
+"""
+Primary/replica database routing.
+
+When REPLICA_DATABASE_URL is set, settings add a ``replica`` alias. Views
+that only display history or presence read from it through
+``.using(read_alias(request.user))``. Everything else reads from
+``default``, and every write goes to ``default``, including writes to
+objects that were loaded from the replica.
+
+A user who has just written something is pinned to the primary for
+DATABASE_REPLICA_PIN_SECONDS. That covers a message sent over the socket
+and any successful non-GET request, so replica lag never hides their own
+message from them. Pins live in the cache so every worker sees them. A
+pin written to one process's memory is invisible to the others, so the
+replica is only used when CACHES is a shared backend such as Redis, or
+when REPLICA_ALLOW_LOCAL_PINS says there is a single process (local
+testing); otherwise every read goes to the primary.
+"""
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA = 'replica'
+PIN_KEY = 'db-pin:{}'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Backends whose entries other processes cannot see
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+_warned = False
+
+
+def shared_cache():
+    return not isinstance(caches['default'], PROCESS_LOCAL_CACHES)
+
+
+def replica_enabled():
+    global _warned
+    if REPLICA not in settings.DATABASES:
+        return False
+    if not shared_cache() and not getattr(settings, 'REPLICA_ALLOW_LOCAL_PINS', False):
+        if not _warned:
+            print("[WARNING] Replica configured without a shared cache; reading from the primary")
+            _warned = True
+        return False
+    return True
+
+
+def pin_seconds():
+    return getattr(settings, 'DATABASE_REPLICA_PIN_SECONDS', 5)
+
+
+def pin_to_primary(user_id):
+    """Send this user's reads to the primary until the replica has caught up"""
+    if replica_enabled():
+        cache.set(PIN_KEY.format(user_id), True, pin_seconds())
+
+
+async def apin_to_primary(user_id):
+    if replica_enabled():
+        await cache.aset(PIN_KEY.format(user_id), True, pin_seconds())
+
+
+def read_alias(user):
+    """Database alias for a read-only query made on behalf of ``user``"""
+    if not replica_enabled():
+        return DEFAULT_DB_ALIAS
+    if user.is_authenticated and cache.get(PIN_KEY.format(user.id)):
+        return DEFAULT_DB_ALIAS
+    return REPLICA
+
+
+class PrimaryReplicaRouter:
+    """Writes always go to the primary; reads go wherever the query says"""
+
+    def db_for_read(self, model, **hints):
+        # Default behaviour: the instance's database, else the primary
+        return None
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replica holds the same rows as the primary
+        return {obj1._state.db, obj2._state.db} <= {DEFAULT_DB_ALIAS, REPLICA}
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return None
+
+
+class ReplicaPinMiddleware:
+    """Pin users to the primary after a request that changed something"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and request.user.is_authenticated
+        ):
+            pin_to_primary(request.user.id)
+        return response
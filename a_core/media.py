@@ -0,0 +1,232 @@
+"""
+Media (uploaded files) serving for production.
+
+Replaces django.views.static.serve with a view that answers conditional
+requests (ETag / If-None-Match, If-Modified-Since) with 304, serves single
+byte ranges with 206, and marks content-hashed file names as immutable so
+browsers never ask for them again. When MEDIA_ACCEL_REDIRECT is set the
+view only checks the request and hands the transfer to the front proxy
+(nginx ``X-Accel-Redirect``), which sends the file with sendfile().
+Otherwise the file is read in BLOCK_SIZE blocks through an async iterator
+(a_core.streaming), so a download never sits in memory whole.
+
+Chat attachments under ``attachments/`` are served only to members of the
+room they were posted in. They always go out as downloads under their
+original name, with nosniff, and as application/octet-stream unless they
+are a raster image. A page or SVG a user uploaded never runs on our origin.
+"""
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.deconstruct import deconstructible
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+
+from .streaming import stream_body
+
+# Names produced by HashedUploadTo: <stem>.<16 hex chars>.<ext>
+HASHED_NAME = re.compile(r'\.[0-9a-f]{16}\.[^./]+$')
+RANGE_HEADER = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024
+ATTACHMENT_DIR = 'attachments/'
+# What an attachment may be served as; anything else is an opaque download
+SAFE_IMAGE_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+
+def cache_max_age():
+    return getattr(settings, 'MEDIA_CACHE_MAX_AGE', 3600)
+
+
+def accel_redirect_prefix():
+    return getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+
+
+@deconstructible
+class HashedUploadTo:
+    """upload_to that names files after their content, so a name never changes meaning"""
+
+    def __init__(self, directory, field_name):
+        self.directory = directory
+        self.field_name = field_name
+
+    def __call__(self, instance, filename):
+        digest = hashlib.sha256()
+        upload = getattr(instance, self.field_name)
+        for chunk in upload.chunks():
+            digest.update(chunk)
+        upload.seek(0)
+        return hashed_name(self.directory, filename, digest.hexdigest())
+
+
+def hashed_name(directory, filename, hexdigest):
+    """<directory>/<stem>.<16 hex chars>.<ext> for a file with the given sha256"""
+    stem, ext = os.path.splitext(os.path.basename(filename))
+    return posixpath.join(directory, f'{stem[:40]}.{hexdigest[:16]}{ext.lower()}')
+
+
+def safe_extension(filename):
+    """The file's extension if it names a safe image type, '.bin' otherwise"""
+    ext = os.path.splitext(filename)[1].lower()
+    return ext if mimetypes.guess_type(f'file{ext}')[0] in SAFE_IMAGE_TYPES else '.bin'
+
+
+def attachment_filename(request, path):
+    """Original name of the attachment stored at ``path``, if the user is in a room it was posted to"""
+    if not request.user.is_authenticated:
+        return None
+    # a_rtchat.models imports this module for HashedUploadTo
+    from a_rtchat.models import Attachment
+    return (
+        Attachment.objects.filter(file=path, is_complete=True, group__members=request.user)
+        .values_list('filename', flat=True).first()
+    )
+
+
+def etag_for(stat):
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def etag_matches(header, etag):
+    if header is None:
+        return False
+    if header.strip() == '*':
+        return True
+    # Weak comparison: W/"x" matches "x"
+    return etag in (tag.strip().removeprefix('W/') for tag in header.split(','))
+
+
+def parse_range(header, size):
+    """(start, end) inclusive for a single satisfiable byte range, None for no range, False if unsatisfiable"""
+    match = RANGE_HEADER.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if first == '' and last == '':
+        return None
+    if first == '':
+        length = int(last)
+        if length == 0:
+            return False
+        return max(0, size - length), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+class RangeFile:
+    """Iterates over bytes start..end of an open file"""
+
+    def __init__(self, f, start, end):
+        self.f = f
+        self.remaining = end - start + 1
+        f.seek(start)
+
+    def __iter__(self):
+        try:
+            while self.remaining > 0:
+                data = self.f.read(min(BLOCK_SIZE, self.remaining))
+                if not data:
+                    break
+                self.remaining -= len(data)
+                yield data
+        finally:
+            self.f.close()
+
+    def close(self):
+        self.f.close()
+
+
+def serve_media(request, path):
+    """Serve a file from MEDIA_ROOT with validators, ranges and cache headers"""
+    # Normalized first, so "x/../attachments/..." can't skip the membership check
+    path = posixpath.normpath(path).lstrip('/')
+    if path.startswith('..'):
+        raise Http404('File not found')
+    download_name = None
+    if path.startswith(ATTACHMENT_DIR):
+        download_name = attachment_filename(request, path)
+        if download_name is None:
+            # Same answer as a missing file: don't confirm it exists
+            raise Http404('File not found')
+
+    try:
+        full_path = safe_join(settings.MEDIA_ROOT, path)
+        stat = os.stat(full_path)
+    except (OSError, ValueError, SuspiciousFileOperation):
+        raise Http404('File not found')
+    if not os.path.isfile(full_path):
+        raise Http404('File not found')
+
+    etag = etag_for(stat)
+    last_modified = http_date(stat.st_mtime)
+    # Attachments depend on who asks, so shared caches must not keep them
+    visibility = 'private' if download_name is not None else 'public'
+    if HASHED_NAME.search(path):
+        cache_control = f'{visibility}, max-age=31536000, immutable'
+    else:
+        cache_control = f'{visibility}, max-age={cache_max_age()}'
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    if download_name is not None and content_type not in SAFE_IMAGE_TYPES:
+        content_type = 'application/octet-stream'
+
+    def with_validators(response):
+        response['ETag'] = etag
+        response['Last-Modified'] = last_modified
+        response['Cache-Control'] = cache_control
+        response['Accept-Ranges'] = 'bytes'
+        if download_name is not None:
+            response['Content-Disposition'] = content_disposition_header(True, download_name)
+            response['X-Content-Type-Options'] = 'nosniff'
+        return response
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        if etag_matches(if_none_match, etag):
+            return with_validators(HttpResponseNotModified())
+    else:
+        since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+        if since is not None and int(stat.st_mtime) <= since:
+            return with_validators(HttpResponseNotModified())
+
+    accel = accel_redirect_prefix()
+    if accel:
+        # The proxy does ranges and the transfer itself; we only vouch for the path
+        response = HttpResponse()
+        response['X-Accel-Redirect'] = posixpath.join(accel, path)
+        response['Content-Type'] = content_type
+        return with_validators(response)
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if if_range is None or if_range.strip() in (etag, last_modified):
+        byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{stat.st_size}'
+        return with_validators(response)
+
+    # Both go out a block at a time: stream_body keeps ASGI from reading the file whole
+    if byte_range is None:
+        start, end = 0, stat.st_size - 1
+        response = StreamingHttpResponse(
+            stream_body(request, RangeFile(open(full_path, 'rb'), start, end)),
+            content_type=content_type,
+        )
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            stream_body(request, RangeFile(open(full_path, 'rb'), start, end)),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{stat.st_size}'
+    response['Content-Length'] = str(end - start + 1)
+    return with_validators(response)
@@ -0,0 +1,343 @@
+"""
+Opt-in instrumentation of socket handlers and HTTP views.
+
+With PROFILING on, each consumer event (connect, receive, chat_message,
+user_online_status, ...) and each HTTP request is timed as a trace. A trace
+is split into phases:
+
+- db: ORM queries, with their count (an execute_wrapper on every connection)
+- render: template rendering
+- layer: channel layer broadcasts
+- send: frames written to the socket
+
+Each phase is timed on its own, so phases can overlap: a query run from a
+template counts in both db and render. A trace that takes PROFILING_SLOW_MS
+or longer is printed as a [SLOW] line. With PROFILING_SLOW_LOG set, it is
+also appended to that file as JSON. Per-handler totals for the process are
+served to staff at ops/profiling/.
+
+Sampling profiles are on demand. ``manage.py profile_worker`` writes a
+request file into PROFILING_DIR and sends SIGUSR2 to a running worker. The
+worker then samples every thread's stack for a while and writes the counts
+as collapsed stacks (flamegraph.pl / speedscope input). This hook costs
+nothing until it is triggered, and it is installed only when
+PROFILING_SAMPLING is on (off by default), even when tracing is off.
+"""
+import atexit
+import collections
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.db.backends.signals import connection_created
+from django.http import HttpResponseForbidden, JsonResponse
+from django.template.backends.django import Template
+from django.utils import timezone
+
+_current = contextvars.ContextVar('profiling_trace', default=None)
+
+
+def enabled():
+    return getattr(settings, 'PROFILING', False)
+
+
+def slow_ms():
+    return getattr(settings, 'PROFILING_SLOW_MS', 100)
+
+
+def slow_log():
+    return getattr(settings, 'PROFILING_SLOW_LOG', None)
+
+
+def sampling_enabled():
+    return getattr(settings, 'PROFILING_SAMPLING', False)
+
+
+def profiling_dir():
+    return str(getattr(settings, 'PROFILING_DIR', os.path.join(settings.BASE_DIR, 'profiles')))
+
+
+def worker_file(pid):
+    return os.path.join(profiling_dir(), f'worker-{pid}.json')
+
+
+def request_file(pid):
+    return os.path.join(profiling_dir(), f'request-{pid}.json')
+
+
+class Trace:
+    """Timings of one handler call or request"""
+
+    def __init__(self, name, tags):
+        self.name = name
+        self.tags = tags
+        self.phases = {}
+        self.queries = 0
+        self.started = time.perf_counter()
+
+    def add(self, phase_name, seconds):
+        self.phases[phase_name] = self.phases.get(phase_name, 0) + seconds
+
+
+# name -> [count, total seconds, max seconds, slow count], for this process
+_stats = {}
+
+
+@contextlib.contextmanager
+def trace(name, **tags):
+    """Time the block as one trace; nothing happens unless PROFILING is on"""
+    if not enabled():
+        yield None
+        return
+    current = Trace(name, tags)
+    token = _current.set(current)
+    try:
+        yield current
+    finally:
+        _current.reset(token)
+        finish(current)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Add the block's time to a phase of the current trace, if there is one"""
+    current = _current.get()
+    if current is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.add(name, time.perf_counter() - started)
+
+
+def finish(current):
+    elapsed = time.perf_counter() - current.started
+    stats = _stats.setdefault(current.name, [0, 0.0, 0.0, 0])
+    stats[0] += 1
+    stats[1] += elapsed
+    stats[2] = max(stats[2], elapsed)
+    if elapsed * 1000 >= slow_ms():
+        stats[3] += 1
+        log_slow(current, elapsed)
+
+
+def log_slow(current, elapsed):
+    phases = ', '.join(f'{name} {seconds * 1000:.1f} ms' for name, seconds in sorted(current.phases.items()))
+    tags = ' '.join(f'{key}={value}' for key, value in current.tags.items() if value is not None)
+    print(f"[SLOW] {current.name} {elapsed * 1000:.1f} ms, {current.queries} queries"
+          f"{' | ' + phases if phases else ''}{' | ' + tags if tags else ''}")
+
+    path = slow_log()
+    if not path:
+        return
+    entry = {
+        'at': timezone.now().isoformat(),
+        'pid': os.getpid(),
+        'name': current.name,
+        'ms': round(elapsed * 1000, 2),
+        'queries': current.queries,
+        'phases': {name: round(seconds * 1000, 2) for name, seconds in current.phases.items()},
+        'tags': current.tags,
+    }
+    try:
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, default=str) + '\n')
+    except OSError as e:
+        print(f"[ERROR] Cannot write slow log {path}: {e}")
+
+
+def count_query(execute, sql, params, many, context):
+    current = _current.get()
+    if current is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        current.queries += 1
+        current.add('db', time.perf_counter() - started)
+
+
+def on_connection_created(sender, connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+_installed = False
+
+
+def install():
+    """Hook into the ORM, template rendering and SIGUSR2 as configured; safe to call twice"""
+    global _installed
+    if _installed:
+        return
+    _installed = True
+
+    if enabled():
+        connection_created.connect(on_connection_created)
+        # Every template render, render_to_string and render() alike, goes through here
+        original_render = Template.render
+
+        @functools.wraps(original_render)
+        def render(self, context=None, request=None):
+            with phase('render'):
+                return original_render(self, context, request)
+
+        Template.render = render
+        print(f"[PROFILING] Tracing on, slow threshold {slow_ms()} ms")
+
+    if sampling_enabled() and hasattr(signal, 'SIGUSR2'):
+        try:
+            signal.signal(signal.SIGUSR2, on_sample_request)
+        except ValueError:
+            # Not the main thread: this process can't take sampling requests
+            return
+        register_worker()
+
+
+def register_worker():
+    os.makedirs(profiling_dir(), exist_ok=True)
+    path = worker_file(os.getpid())
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'started': timezone.now().isoformat(), 'argv': sys.argv}, f)
+    atexit.register(_remove_quietly, path)
+
+
+def _remove_quietly(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def registered_workers():
+    """{pid: registration} of the workers that can take sampling requests and are still alive"""
+    workers = {}
+    try:
+        names = os.listdir(profiling_dir())
+    except OSError:
+        return workers
+    for name in names:
+        if not (name.startswith('worker-') and name.endswith('.json')):
+            continue
+        path = os.path.join(profiling_dir(), name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                info = json.load(f)
+            os.kill(info['pid'], 0)
+        except (OSError, ValueError, KeyError):
+            # A worker that died without cleaning up
+            _remove_quietly(path)
+            continue
+        workers[info['pid']] = info
+    return workers
+
+
+_sampler = None
+
+
+def on_sample_request(signum, frame):
+    global _sampler
+    path = request_file(os.getpid())
+    try:
+        with open(path, encoding='utf-8') as f:
+            request = json.load(f)
+        os.remove(path)
+    except (OSError, ValueError) as e:
+        print(f"[ERROR] Bad sampling request {path}: {e}")
+        return
+    if _sampler is not None and _sampler.is_alive():
+        print("[WARNING] Sampling request ignored: a profile is already being taken")
+        return
+    _sampler = Sampler(request['seconds'], request['interval'], request['output'])
+    _sampler.start()
+
+
+class Sampler(threading.Thread):
+    """Samples every other thread's stack at an interval and writes collapsed stacks"""
+
+    def __init__(self, seconds, interval, output):
+        super().__init__(name='profiling-sampler', daemon=True)
+        self.seconds = seconds
+        self.interval = interval
+        self.output = output
+
+    def run(self):
+        print(f"[PROFILING] Sampling for {self.seconds} s into {self.output}")
+        counts = collections.Counter()
+        samples = 0
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.ident:
+                    continue
+                counts[collapse(names.get(thread_id, str(thread_id)), frame)] += 1
+            samples += 1
+            time.sleep(self.interval)
+
+        # Written aside and renamed, so the command never reads half a file
+        partial = self.output + '.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            for stack, count in counts.most_common():
+                f.write(f'{stack} {count}\n')
+        os.replace(partial, self.output)
+        print(f"[PROFILING] {samples} samples, {len(counts)} distinct stacks written to {self.output}")
+
+
+def collapse(thread_name, frame):
+    """One stack as 'thread;outermost;...;innermost', the collapsed format"""
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    stack.append(thread_name.replace(';', ':').replace(' ', '_'))
+    return ';'.join(part.replace(' ', '_') for part in reversed(stack))
+
+
+class ProfilingMiddleware:
+    """Time each request as a trace named after its view"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        install()
+
+    def __call__(self, request):
+        with trace(f'http {request.method}', path=request.path) as current:
+            response = self.get_response(request)
+            match = getattr(request, 'resolver_match', None)
+            if current is not None and match is not None:
+                current.name = f'http {request.method} {match.view_name}'
+        return response
+
+
+@login_required
+def profiling_stats(request):
+    """Staff-only JSON of this process's per-handler timings"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+    return JsonResponse({
+        'pid': os.getpid(),
+        'enabled': enabled(),
+        'slow_ms': slow_ms(),
+        'handlers': {
+            name: {
+                'count': count,
+                'mean_ms': round(total / count * 1000, 2),
+                'max_ms': round(longest * 1000, 2),
+                'slow': slow,
+            }
+            for name, (count, total, longest, slow) in sorted(_stats.items())
+        },
+    })
@@ -46,6 +46,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'a_core.db_routers.ReplicaPinMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
     'allauth.account.middleware.AccountMiddleware',
@@ -75,17 +76,43 @@ TEMPLATES = [
 WSGI_APPLICATION = None
 ASGI_APPLICATION = 'a_core.asgi.application'
 
+# Connection pooling for PostgreSQL (psycopg 3, see a_core/db_pool.py): one
+# bounded pool per process shared by views and consumers, instead of one
+# persistent connection per thread. Keep workers * max_size under the
+# server's max_connections.
+DATABASE_POOL = os.environ.get('DATABASE_POOL', 'False') == 'True'
+DATABASE_POOL_OPTIONS = {
+    'min_size': int(os.environ.get('DATABASE_POOL_MIN_SIZE', 2)),
+    'max_size': int(os.environ.get('DATABASE_POOL_MAX_SIZE', 10)),
+    # Seconds a caller waits for a free connection before an OperationalError
+    'timeout': float(os.environ.get('DATABASE_POOL_TIMEOUT', 10)),
+    # Callers allowed to queue before new ones fail immediately (0: unbounded)
+    'max_waiting': int(os.environ.get('DATABASE_POOL_MAX_WAITING', 500)),
+    'max_idle': 300,
+    'max_lifetime': 1800,
+}
+
+
+def database_from_url(url):
+    # Pooled connections are health-checked on checkout (CONN_HEALTH_CHECKS)
+    # and must not also be persistent
+    database = dj_database_url.parse(
+        url,
+        conn_max_age=0 if DATABASE_POOL else 600,
+        conn_health_checks=True,
+    )
+    if DATABASE_POOL and database['ENGINE'] == 'django.db.backends.postgresql':
+        database.setdefault('OPTIONS', {})['pool'] = dict(DATABASE_POOL_OPTIONS)
+    return database
+
+
 # Database configuration
 if os.environ.get('DATABASE_URL'):
     # Production - PostgreSQL
     DATABASES = {
-        'default': dj_database_url.config(
-            default=os.environ.get('DATABASE_URL'),
-            conn_max_age=600,
-            conn_health_checks=True,
-        )
+        'default': database_from_url(os.environ['DATABASE_URL'])
     }
-    print("[DATABASE] Using Railway PostgreSQL")
+    print(f"[DATABASE] Using Railway PostgreSQL{' with a connection pool' if DATABASE_POOL else ''}")
 else:
     # Local Development - SQLite
     DATABASES = {
@@ -96,6 +123,43 @@ else:
     }
     print("[DATABASE] Using local SQLite")
 
+# Cache shared by every worker process. Without REDIS_URL it is per-process
+# memory, which is only safe for state no other worker needs to see.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Optional read replica for history and presence views (see a_core/db_routers.py).
+# Read-your-writes pins live in the cache, so several workers need REDIS_URL.
+# Locally, a single process can keep them in memory: point the replica at a
+# second SQLite file (sqlite:///replica.sqlite3) and set REPLICA_ALLOW_LOCAL_PINS=True
+REPLICA_ALLOW_LOCAL_PINS = os.environ.get('REPLICA_ALLOW_LOCAL_PINS', 'False') == 'True'
+if os.environ.get('REPLICA_DATABASE_URL'):
+    # `manage.py runworkers` starts several workers on the ipc channel layer
+    several_workers = os.environ.get('CHANNEL_LAYER_BACKEND') == 'ipc'
+    if os.environ.get('REDIS_URL') or (REPLICA_ALLOW_LOCAL_PINS and not several_workers):
+        DATABASES['replica'] = database_from_url(os.environ['REPLICA_DATABASE_URL'])
+        DATABASES['replica']['TEST'] = {'MIRROR': 'default'}
+        print("[DATABASE] Reading history and presence from replica")
+    elif several_workers:
+        print("[WARNING] REPLICA_DATABASE_URL ignored: workers cannot share in-memory pins, set REDIS_URL")
+    else:
+        print("[WARNING] REPLICA_DATABASE_URL ignored: set REDIS_URL, or REPLICA_ALLOW_LOCAL_PINS=True for one process")
+
+DATABASE_ROUTERS = ['a_core.db_routers.PrimaryReplicaRouter']
+# How long a user reads from the primary after writing
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DATABASE_REPLICA_PIN_SECONDS', 5))
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -130,6 +194,11 @@ STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# Browser cache lifetime for media without a content hash in the name
+MEDIA_CACHE_MAX_AGE = int(os.environ.get('MEDIA_CACHE_MAX_AGE', 3600))
+# Internal nginx location for MEDIA_ROOT (e.g. /protected-media/); when set,
+# the media view only validates and nginx sends the file
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT')
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
@@ -141,6 +210,86 @@ CHANNEL_LAYERS = {
     },
 }
 
+if os.environ.get('CHANNEL_LAYER_BACKEND') == 'ipc':
+    # Several daphne workers on one host (see `manage.py runworkers`)
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'a_rtchat.layers.UnixSocketChannelLayer',
+            'CONFIG': {
+                'socket_dir': os.environ.get('CHAT_IPC_DIR', '/tmp/chat-ipc'),
+            },
+        },
+    }
+
+# Room fan-out: rooms with at least this many members are split into
+# CHAT_FANOUT_SHARDS channel-layer groups that are sent to concurrently
+CHAT_FANOUT_SHARD_THRESHOLD = int(os.environ.get('CHAT_FANOUT_SHARD_THRESHOLD', 500))
+CHAT_FANOUT_SHARDS = int(os.environ.get('CHAT_FANOUT_SHARDS', 16))
+# Let one relay per worker subscribe to a sharded room on behalf of its sockets
+CHAT_FANOUT_LOCAL_RELAY = os.environ.get('CHAT_FANOUT_LOCAL_RELAY', 'False') == 'True'
+
+# Typing/seen frames are debounced per user and coalesced into one
+# room_state broadcast per interval; read markers are flushed in batches
+CHAT_ROOM_STATE_INTERVAL = 0.3
+CHAT_TYPING_DEBOUNCE_SECONDS = 2
+CHAT_READ_MARKER_FLUSH_SECONDS = 10
+
+# New-message alerts to members outside the room go through per-user groups,
+# at most one per room per interval; bigger audiences are not notified
+CHAT_NOTIFY_INTERVAL = 1.0
+CHAT_NOTIFY_MAX_RECIPIENTS = 500
+# Users one message can @mention
+CHAT_MAX_MENTIONS = 20
+
+# Room analytics: per-worker minute buckets merged into RoomStat every
+# CHAT_ANALYTICS_FLUSH_SECONDS; compact_room_stats folds minute rows into
+# hours, and hours into days, once they are this old
+CHAT_ANALYTICS_FLUSH_SECONDS = 10
+CHAT_ANALYTICS_MINUTE_RETENTION_HOURS = 48
+CHAT_ANALYTICS_HOUR_RETENTION_DAYS = 30
+
+# Rooms one multiplexed socket (ws/chat/) may have open at once
+CHAT_MAX_SUBSCRIPTIONS = 20
+
+# History pages and presence snapshots over the socket. Frames this large
+# or larger go out zlib-compressed to clients that connect with ?compress=deflate
+CHAT_HISTORY_PAGE_SIZE = 50
+CHAT_HISTORY_MAX_PAGE_SIZE = 200
+CHAT_COMPRESS_MIN_BYTES = int(os.environ.get('CHAT_COMPRESS_MIN_BYTES', 4096))
+CHAT_COMPRESS_LEVEL = int(os.environ.get('CHAT_COMPRESS_LEVEL', 6))
+
+# Client message ids each worker remembers, so resent messages are acked
+# without a database round trip (the unique constraint catches the rest)
+CHAT_CLIENT_ID_TTL = 300
+CHAT_CLIENT_ID_MAX_ENTRIES = 100000
+
+# Moderation term list ('<block|mask|flag> <term>' per line), compiled into
+# one automaton and recompiled when the file changes; no file, no filtering
+CHAT_MODERATION_TERMS_FILE = os.environ.get('CHAT_MODERATION_TERMS_FILE', BASE_DIR / 'moderation_terms.txt')
+CHAT_MODERATION_RELOAD_SECONDS = 5
+
+# Attachments sent over the chat socket. Partial uploads live outside
+# MEDIA_ROOT until complete; the quota counts unfinished uploads too
+CHAT_ATTACHMENT_MAX_BYTES = int(os.environ.get('CHAT_ATTACHMENT_MAX_BYTES', 25 * 1024 * 1024))
+CHAT_ATTACHMENT_USER_QUOTA_BYTES = int(os.environ.get('CHAT_ATTACHMENT_USER_QUOTA_BYTES', 200 * 1024 * 1024))
+CHAT_ATTACHMENT_CHUNK_BYTES = 256 * 1024
+CHAT_ATTACHMENT_OPEN_UPLOADS = 3
+CHAT_ATTACHMENT_PARTIAL_DIR = os.environ.get('CHAT_ATTACHMENT_PARTIAL_DIR', BASE_DIR / 'uploads-partial')
+
+# Tracing of socket handlers and views (a_core.profiling): per-phase timings,
+# and a [SLOW] line for anything over the threshold, also appended as JSON to
+# PROFILING_SLOW_LOG when set. Off by default.
+PROFILING = os.environ.get('PROFILING', 'False') == 'True'
+PROFILING_SLOW_MS = float(os.environ.get('PROFILING_SLOW_MS', 100))
+PROFILING_SLOW_LOG = os.environ.get('PROFILING_SLOW_LOG')
+if PROFILING:
+    MIDDLEWARE.insert(0, 'a_core.profiling.ProfilingMiddleware')
+# Let `manage.py profile_worker` take sampling profiles of running workers;
+# workers register under PROFILING_DIR. Off by default: a worker with it on
+# writes profiles wherever a request file in PROFILING_DIR tells it to
+PROFILING_SAMPLING = os.environ.get('PROFILING_SAMPLING', 'False') == 'True'
+PROFILING_DIR = os.environ.get('PROFILING_DIR', BASE_DIR / 'profiles')
+
 # Django Allauth Settings
 SITE_ID = 2
 ACCOUNT_LOGIN_METHODS = {'username', 'email'}
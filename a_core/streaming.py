@@ -0,0 +1,37 @@
+"""
+Streaming response bodies that keep streaming under ASGI.
+
+Django's ASGI handler can only iterate a StreamingHttpResponse body
+asynchronously. A sync iterator is read whole with sync_to_async(list)
+before the first byte is sent, so a large export or download is built in
+memory. stream_body() instead gives it an async iterator that pulls one
+block at a time in the thread-sensitive executor, the thread the sync view
+ran in, so database cursors and open files stay on their thread. Under WSGI
+the sync iterator is passed through unchanged.
+"""
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+
+_DONE = object()
+
+
+async def aiter_blocks(blocks):
+    """Async iterator over a sync iterable, one block per executor hop"""
+    iterator = iter(blocks)
+    pull = sync_to_async(next, thread_sensitive=True)
+    try:
+        while (block := await pull(iterator, _DONE)) is not _DONE:
+            yield block
+    finally:
+        # Release cursors and files on their own thread, also when the client
+        # goes away. An iterable's iterator (a generator from __iter__) is a
+        # different object from the iterable holding the file: close both
+        for closeable in {id(iterator): iterator, id(blocks): blocks}.values():
+            close = getattr(closeable, 'close', None)
+            if close is not None:
+                await sync_to_async(close, thread_sensitive=True)()
+
+
+def stream_body(request, blocks):
+    """The body to give StreamingHttpResponse for ``blocks`` on this request's server"""
+    return aiter_blocks(blocks) if isinstance(request, ASGIRequest) else blocks
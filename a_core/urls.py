@@ -1,23 +1,21 @@
 from django.contrib import admin
 from django.urls import path, include, re_path
-from django.conf import settings
-from django.conf.urls.static import static
-from django.views.static import serve
+from .db_pool import pool_metrics
+from .media import serve_media
+from .profiling import profiling_stats
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('ops/db-pool/', pool_metrics, name='db-pool-metrics'),
+    path('ops/profiling/', profiling_stats, name='profiling-stats'),
     path('accounts/', include('allauth.urls')),
     path('', include('a_rtchat.urls')),
     path('profile/', include('a_users.urls')), 
     path("__reload__/", include("django_browser_reload.urls")),
 ]
 
-# Serve media files in production
-if not settings.DEBUG:
-    urlpatterns += [
-        re_path(r'^media/(?P<path>.*)$', serve, {
-            'document_root': settings.MEDIA_ROOT,
-        }),
-    ]
-else:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
+# Media always goes through serve_media, which also checks attachment access
+# (django.views.static.serve would hand attachments to anyone)
+urlpatterns += [
+    re_path(r'^media/(?P<path>.*)$', serve_media),
+]
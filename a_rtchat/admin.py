@@ -2,4 +2,11 @@ from django.contrib import admin
 from .models import *
 
 admin.site.register(ChatGroup)
-admin.site.register(GroupMessage)
+
+
+@admin.register(GroupMessage)
+class GroupMessageAdmin(admin.ModelAdmin):
+    list_display = ('__str__', 'group', 'created', 'flagged', 'is_deleted')
+    # Messages that matched a "flag" moderation term
+    list_filter = ('flagged',)
+    list_select_related = ('author', 'group')
@@ -0,0 +1,388 @@
+"""
+Per-room activity counters, rolled up by time instead of counted from messages.
+
+Each worker counts messages, active users (users who posted) and peak
+concurrency in minute buckets as its consumers store messages and see
+presence changes. Every CHAT_ANALYTICS_FLUSH_SECONDS the buckets are merged
+into RoomStat rows in one transaction. ``compact_room_stats`` later folds
+minute rows into hour rows after CHAT_ANALYTICS_MINUTE_RETENTION_HOURS, and
+hour rows into day rows after CHAT_ANALYTICS_HOUR_RETENTION_DAYS. The
+dashboard reads only RoomStat, never GroupMessage.
+
+All three measures merge, so partial rows can be combined in any order.
+Messages add up and peaks take the maximum. Active users can't simply add
+up: someone who posts in two minutes, or through two workers, is one user.
+So they are kept as a HyperLogLog sketch, which merges by register-wise
+maximum and estimates a distinct count to about 3%. Small sketches are
+stored sparse.
+
+Peaks come from the online count set_presence returns, which user_online_status
+events carry to every worker with the room open. While a room is open on a
+worker, each flush also records its current count in the minute's bucket.
+Quiet minutes then still have a peak.
+"""
+import asyncio
+import math
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import models, transaction
+from django.utils import timezone
+
+from .models import RoomStat
+
+MASK = (1 << 64) - 1
+# 2**10 one-byte registers: about 3% standard error, 1 KiB dense
+PRECISION = 10
+REGISTERS = 1 << PRECISION
+RANK_BITS = 64 - PRECISION
+
+
+def flush_interval():
+    return getattr(settings, 'CHAT_ANALYTICS_FLUSH_SECONDS', 10)
+
+
+def minute_retention():
+    return timedelta(hours=getattr(settings, 'CHAT_ANALYTICS_MINUTE_RETENTION_HOURS', 48))
+
+
+def hour_retention():
+    return timedelta(days=getattr(settings, 'CHAT_ANALYTICS_HOUR_RETENTION_DAYS', 30))
+
+
+def truncate(moment, resolution):
+    """Start of the minute, hour or (UTC) day ``moment`` falls in"""
+    moment = moment.replace(second=0, microsecond=0)
+    if resolution in (RoomStat.HOUR, RoomStat.DAY):
+        moment = moment.replace(minute=0)
+    if resolution == RoomStat.DAY:
+        moment = moment.replace(hour=0)
+    return moment
+
+
+# HyperLogLog over user ids
+
+def mix(value):
+    """splitmix64: user ids are sequential, the sketch needs well-spread bits"""
+    value = (value + 0x9E3779B97F4A7C15) & MASK
+    value = ((value ^ (value >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    value = ((value ^ (value >> 27)) * 0x94D049BB133111EB) & MASK
+    return value ^ (value >> 31)
+
+
+def sketch_add(registers, user_id):
+    hashed = mix(user_id)
+    index = hashed >> RANK_BITS
+    rank = RANK_BITS - (hashed & ((1 << RANK_BITS) - 1)).bit_length() + 1
+    if rank > registers[index]:
+        registers[index] = rank
+
+
+def sketch_merge(registers, other):
+    for index, rank in enumerate(other):
+        if rank > registers[index]:
+            registers[index] = rank
+
+
+def estimate(registers):
+    zeros = registers.count(0)
+    if zeros == REGISTERS:
+        return 0
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    raw = alpha * REGISTERS * REGISTERS / sum(2.0 ** -rank for rank in registers)
+    if raw <= 2.5 * REGISTERS and zeros:
+        # Linear counting: nearly exact for the small sets most buckets hold
+        return round(REGISTERS * math.log(REGISTERS / zeros))
+    return round(raw)
+
+
+def pack(registers):
+    """Sparse (index, rank) triples while that is smaller, the dense registers otherwise"""
+    used = [(index, rank) for index, rank in enumerate(registers) if rank]
+    if len(used) * 3 >= REGISTERS:
+        return bytes(registers)
+    return b''.join(index.to_bytes(2, 'big') + bytes((rank,)) for index, rank in used)
+
+
+def unpack(data):
+    data = bytes(data or b'')
+    if len(data) == REGISTERS:
+        return bytearray(data)
+    registers = bytearray(REGISTERS)
+    for offset in range(0, len(data), 3):
+        registers[int.from_bytes(data[offset:offset + 2], 'big')] = data[offset + 2]
+    return registers
+
+
+class Bucket:
+    """Counts of one room over one period, mergeable with any other for the same period"""
+    __slots__ = ('messages', 'registers', 'peak_online')
+
+    def __init__(self, messages=0, registers=None, peak_online=0):
+        self.messages = messages
+        self.registers = registers if registers is not None else bytearray(REGISTERS)
+        self.peak_online = peak_online
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(row.messages, unpack(row.active_sketch), row.peak_online)
+
+    def merge(self, other):
+        self.messages += other.messages
+        sketch_merge(self.registers, other.registers)
+        self.peak_online = max(self.peak_online, other.peak_online)
+
+    def save_to(self, row):
+        row.messages = self.messages
+        row.active_sketch = pack(self.registers)
+        row.active_users = estimate(self.registers)
+        row.peak_online = self.peak_online
+
+
+# (room id, minute) -> Bucket, not yet flushed
+_pending = {}
+# room id -> [sockets on this worker with the room open, its last known online count]
+_open_rooms = {}
+_flush_task = None
+
+
+def bucket(room_id):
+    key = (room_id, truncate(timezone.now(), RoomStat.MINUTE))
+    found = _pending.get(key)
+    if found is None:
+        found = _pending[key] = Bucket()
+        room = _open_rooms.get(room_id)
+        if room is not None:
+            found.peak_online = room[1]
+        _start_flusher()
+    return found
+
+
+def message_posted(session):
+    counts = bucket(session.chat_group.id)
+    counts.messages += 1
+    sketch_add(counts.registers, session.user.id)
+
+
+def online_changed(room_id, online_count):
+    room = _open_rooms.get(room_id)
+    if room is not None:
+        room[1] = online_count
+    counts = bucket(room_id)
+    counts.peak_online = max(counts.peak_online, online_count)
+
+
+def open_room(session, online_count):
+    room = _open_rooms.setdefault(session.chat_group.id, [0, 0])
+    room[0] += 1
+    online_changed(session.chat_group.id, online_count)
+
+
+def close_room(session, online_count):
+    room_id = session.chat_group.id
+    online_changed(room_id, online_count)
+    room = _open_rooms.get(room_id)
+    if room is not None:
+        room[0] -= 1
+        if room[0] <= 0:
+            del _open_rooms[room_id]
+
+
+def _start_flusher():
+    global _flush_task
+    if _flush_task is None or _flush_task.done():
+        _flush_task = asyncio.create_task(_flush_forever())
+
+
+async def _flush_forever():
+    while _pending or _open_rooms:
+        await asyncio.sleep(flush_interval())
+        await flush()
+
+
+async def flush():
+    """Merge every pending bucket into the minute rows"""
+    global _pending
+    # Rooms that stayed open with nobody joining or leaving still have a peak this minute
+    for room_id, (_, online_count) in list(_open_rooms.items()):
+        if online_count:
+            online_changed(room_id, online_count)
+    if not _pending:
+        return
+    pending, _pending = _pending, {}
+    try:
+        await database_sync_to_async(merge_rows)(RoomStat.MINUTE, pending)
+    except Exception as e:
+        print(f"[ERROR] Analytics flush failed: {e}")
+        for key, counts in pending.items():
+            _pending.setdefault(key, Bucket()).merge(counts)
+        return
+    print(f"[ANALYTICS] Flushed {len(pending)} minute buckets")
+
+
+def merge_rows(resolution, buckets):
+    """
+    Merge {(room id, start): Bucket} into RoomStat rows of one resolution.
+    A row another worker inserts meanwhile fails the whole merge with an
+    IntegrityError; callers keep the buckets and try again.
+    """
+    with transaction.atomic():
+        existing = {
+            (row.group_id, row.start): row
+            for row in RoomStat.objects.select_for_update().filter(
+                resolution=resolution,
+                group_id__in={room_id for room_id, _ in buckets},
+                start__in={start for _, start in buckets},
+            )
+        }
+        changed, created = [], []
+        for (room_id, start), counts in buckets.items():
+            row = existing.get((room_id, start))
+            if row is None:
+                row = RoomStat(group_id=room_id, resolution=resolution, start=start)
+                created.append(row)
+            else:
+                merged = Bucket.from_row(row)
+                merged.merge(counts)
+                counts = merged
+                changed.append(row)
+            counts.save_to(row)
+        RoomStat.objects.bulk_update(changed, ['messages', 'active_sketch', 'active_users', 'peak_online'])
+        RoomStat.objects.bulk_create(created)
+
+
+def compact(now=None, chunk_size=1000):
+    """
+    Fold minute rows past their retention into hour rows, and hour rows into
+    day rows. Each chunk is merged and deleted in one transaction, so an
+    interrupted run loses nothing. Returns the rows folded per resolution.
+    """
+    now = now or timezone.now()
+    folded = {}
+    for source, target, keep in (
+        (RoomStat.MINUTE, RoomStat.HOUR, minute_retention()),
+        (RoomStat.HOUR, RoomStat.DAY, hour_retention()),
+    ):
+        # Only whole periods: a target row never misses rows still to come
+        cutoff = truncate(now - keep, target)
+        folded[source] = 0
+        while True:
+            with transaction.atomic():
+                rows = list(
+                    RoomStat.objects.select_for_update()
+                    .filter(resolution=source, start__lt=cutoff)
+                    .order_by('pk')[:chunk_size]
+                )
+                if not rows:
+                    break
+                buckets = {}
+                for row in rows:
+                    key = (row.group_id, truncate(row.start, target))
+                    buckets.setdefault(key, Bucket()).merge(Bucket.from_row(row))
+                merge_rows(target, buckets)
+                RoomStat.objects.filter(pk__in=[row.pk for row in rows]).delete()
+            folded[source] += len(rows)
+    return folded
+
+
+def resolution_for(window):
+    """The finest resolution whose rows still cover the whole window"""
+    if window <= minute_retention():
+        return RoomStat.MINUTE
+    if window <= hour_retention():
+        return RoomStat.HOUR
+    return RoomStat.DAY
+
+
+def series(group_ids, since, resolution, using='default'):
+    """
+    {room id: {period start: Bucket}} from the rollups since ``since``, each
+    row at or below ``resolution`` folded into its period
+    """
+    levels = [level for level, _ in RoomStat.RESOLUTIONS]
+    rows = RoomStat.objects.using(using).filter(
+        start__gte=truncate(since, resolution),
+        resolution__in=levels[:levels.index(resolution) + 1],
+    )
+    if group_ids is not None:
+        rows = rows.filter(group_id__in=group_ids)
+    result = {}
+    for row in rows.only('group_id', 'start', 'messages', 'active_sketch', 'peak_online').iterator():
+        periods = result.setdefault(row.group_id, {})
+        periods.setdefault(truncate(row.start, resolution), Bucket()).merge(Bucket.from_row(row))
+    return result
+
+
+def totals(periods):
+    """One Bucket for a whole series, with active users distinct across it"""
+    total = Bucket()
+    for counts in periods.values():
+        total.merge(counts)
+    return total
+
+
+STEPS = {RoomStat.MINUTE: timedelta(minutes=1), RoomStat.HOUR: timedelta(hours=1), RoomStat.DAY: timedelta(days=1)}
+# Dashboard windows and the resolution each is shown at, at the finest
+WINDOWS = {
+    '1h': (timedelta(hours=1), RoomStat.MINUTE),
+    '24h': (timedelta(hours=24), RoomStat.HOUR),
+    '7d': (timedelta(days=7), RoomStat.HOUR),
+    '30d': (timedelta(days=30), RoomStat.DAY),
+    '365d': (timedelta(days=365), RoomStat.DAY),
+}
+
+
+def dashboard(window='24h', chat_group=None, top=20, using='default'):
+    """
+    The busiest rooms over a window and, for ``chat_group``, its series
+    period by period. Reads RoomStat only.
+    """
+    span, resolution = WINDOWS[window]
+    levels = [level for level, _ in RoomStat.RESOLUTIONS]
+    resolution = max(resolution, resolution_for(span), key=levels.index)
+    now = timezone.now()
+    since = truncate(now - span, resolution)
+
+    # Messages and peaks aggregate in SQL; only the top rooms' sketches are read
+    busiest = list(
+        RoomStat.objects.using(using).filter(start__gte=since)
+        .values('group_id', 'group__group_name', 'group__groupchat_name')
+        .annotate(messages=models.Sum('messages'), peak_online=models.Max('peak_online'))
+        .order_by('-messages')[:top]
+    )
+    sketches = series([row['group_id'] for row in busiest], since, levels[-1], using=using)
+    rooms = [
+        {
+            'group_name': row['group__group_name'],
+            'name': row['group__groupchat_name'] or row['group__group_name'],
+            'messages': row['messages'],
+            'active_users': estimate(totals(sketches.get(row['group_id'], {})).registers),
+            'peak_online': row['peak_online'],
+        }
+        for row in busiest
+    ]
+
+    room_series = None
+    if chat_group is not None:
+        periods = series([chat_group.id], since, resolution, using=using).get(chat_group.id, {})
+        room_series = []
+        start = since
+        while start <= now:
+            counts = periods.get(start, Bucket())
+            room_series.append({
+                'start': start,
+                'messages': counts.messages,
+                'active_users': estimate(counts.registers),
+                'peak_online': counts.peak_online,
+            })
+            start += STEPS[resolution]
+        total = totals(periods)
+        room_series = {
+            'periods': room_series,
+            'messages': total.messages,
+            'active_users': estimate(total.registers),
+            'peak_online': total.peak_online,
+        }
+
+    return {'window': window, 'resolution': resolution, 'since': since, 'rooms': rooms, 'room': room_series}
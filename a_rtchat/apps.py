@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ARtchatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'a_rtchat'
+
+    def ready(self):
+        # Membership changes keep the mention tries current
+        import a_rtchat.mentions
+        # Attachment files are deleted with the last attachment sharing them
+        import a_rtchat.attachments
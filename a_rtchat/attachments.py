@@ -0,0 +1,337 @@
+"""
+File attachments uploaded over the chat socket.
+
+A client announces a file with an ``upload_start`` frame and gets back an
+``upload_ready`` frame with the upload id and the offset to send from, which
+is past zero when resuming an upload that was cut off. The bytes then arrive
+as binary frames:
+
+    [1 byte id length][upload id][8 byte big-endian offset][chunk]
+
+Each chunk is appended to a partial file outside MEDIA_ROOT and acked with
+the new offset. Clients keep only a few chunks unacked, so a socket never
+has more than that window of file data in memory however large the file is.
+When the last byte lands the file is hashed and copied into storage under a
+content-hashed name, a message is created for it, and the room gets a small
+``attachment`` event with the name, size and URL, never the bytes. Identical
+uploads share the stored file, which is deleted with the last attachment
+that uses it.
+
+Uploads are started from a room session (see consumers.RoomSession) and
+remember it, so chunks on a multiplexed socket need no room field.
+"""
+import hashlib
+import json
+import os
+import struct
+import tempfile
+
+from asgiref.sync import sync_to_async
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from django.utils.text import get_valid_filename
+
+from a_core.db_routers import apin_to_primary
+from a_core.media import hashed_name, safe_extension
+
+from . import analytics, notifications
+from .inbox import record_last_message
+from .models import Attachment, GroupMessage
+
+OFFSET = struct.Struct('!Q')
+BLOCK_SIZE = 64 * 1024
+
+
+def max_file_bytes():
+    return getattr(settings, 'CHAT_ATTACHMENT_MAX_BYTES', 25 * 1024 * 1024)
+
+
+def user_quota_bytes():
+    return getattr(settings, 'CHAT_ATTACHMENT_USER_QUOTA_BYTES', 200 * 1024 * 1024)
+
+
+def max_chunk_bytes():
+    return getattr(settings, 'CHAT_ATTACHMENT_CHUNK_BYTES', 256 * 1024)
+
+
+def max_open_uploads():
+    return getattr(settings, 'CHAT_ATTACHMENT_OPEN_UPLOADS', 3)
+
+
+def partial_dir():
+    return str(getattr(settings, 'CHAT_ATTACHMENT_PARTIAL_DIR', os.path.join(tempfile.gettempdir(), 'chat-uploads')))
+
+
+def partial_path(upload_id):
+    return os.path.join(partial_dir(), f'{upload_id}.part')
+
+
+class Upload:
+    """An upload in progress on one socket"""
+
+    def __init__(self, session, attachment, received):
+        self.session = session
+        self.attachment = attachment
+        self.received = received
+        self.file = None
+
+    def write(self, chunk):
+        if self.file is None:
+            os.makedirs(partial_dir(), exist_ok=True)
+            self.file = open(partial_path(self.attachment.upload_id), 'ab')
+        self.file.write(chunk)
+        self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# channel_name -> {upload_id: Upload}
+_uploads = {}
+
+
+def parse_chunk(bytes_data):
+    """(upload_id, offset, chunk) from a binary frame, or None if it is malformed"""
+    if not bytes_data:
+        return None
+    id_length = bytes_data[0]
+    header_length = 1 + id_length + OFFSET.size
+    if len(bytes_data) < header_length:
+        return None
+    try:
+        upload_id = bytes_data[1:1 + id_length].decode('ascii')
+    except UnicodeDecodeError:
+        return None
+    (offset,) = OFFSET.unpack_from(bytes_data, 1 + id_length)
+    return upload_id, offset, memoryview(bytes_data)[header_length:]
+
+
+async def reply(consumer, frame_type, **fields):
+    await consumer.send(text_data=json.dumps({'type': frame_type, **fields}))
+
+
+async def start(session, data):
+    """Register a new upload or resume an unfinished one in the session's room"""
+    uploads = _uploads.setdefault(session.channel_name, {})
+    upload_id = str(data.get('upload_id') or '')
+
+    if upload_id in uploads and uploads[upload_id].session is session:
+        upload = uploads[upload_id]
+    elif len(uploads) >= max_open_uploads():
+        await reply(session, 'upload_error', upload_id=upload_id or None, error='Too many uploads at once')
+        return
+    elif upload_id:
+        upload = await resume_upload(session, upload_id)
+        if upload is None:
+            await reply(session, 'upload_error', upload_id=upload_id, error='Unknown upload')
+            return
+    else:
+        try:
+            size = int(data['size'])
+        except (KeyError, TypeError, ValueError):
+            print("[WARNING] Malformed upload_start frame")
+            return
+        filename = os.path.basename(str(data.get('filename') or '')).strip()[:255]
+        content_type = str(data.get('content_type') or '')[:100]
+        error = None
+        if not filename:
+            error = 'Missing file name'
+        elif size <= 0 or size > max_file_bytes():
+            error = f'Files must be between 1 byte and {max_file_bytes()} bytes'
+        if error is None:
+            upload, error = await create_upload(session, filename, content_type, size)
+        if error:
+            print(f"[WARNING] Upload from '{session.user.username}' refused: {error}")
+            await reply(session, 'upload_error', upload_id=None, error=error)
+            return
+
+    uploads[upload.attachment.upload_id] = upload
+    print(f"[UPLOAD] '{upload.attachment.filename}' ({upload.attachment.size} bytes) from "
+          f"'{session.user.username}' ready at offset {upload.received}")
+    await reply(
+        session, 'upload_ready',
+        upload_id=upload.attachment.upload_id,
+        offset=upload.received,
+        chunk_size=max_chunk_bytes(),
+    )
+
+
+async def receive_chunk(consumer, bytes_data):
+    """Append one binary frame to its upload; finish the upload on the last byte"""
+    parsed = parse_chunk(bytes_data)
+    if parsed is None:
+        print("[WARNING] Malformed upload chunk")
+        return
+    upload_id, offset, chunk = parsed
+    upload = _uploads.get(consumer.channel_name, {}).get(upload_id)
+    if upload is None:
+        await reply(consumer, 'upload_error', upload_id=upload_id, error='Unknown upload')
+        return
+
+    attachment = upload.attachment
+    if len(chunk) > max_chunk_bytes() or upload.received + len(chunk) > attachment.size:
+        await abort(upload, 'Chunk too large')
+        return
+    if offset != upload.received:
+        # Out of order or a resend: tell the client where we really are
+        await reply(consumer, 'upload_ack', upload_id=upload_id, offset=upload.received)
+        return
+
+    try:
+        await sync_to_async(upload.write, thread_sensitive=False)(chunk)
+    except OSError as e:
+        print(f"[ERROR] Writing upload {upload_id} failed: {e}")
+        await abort(upload, 'Could not store the file')
+        return
+    upload.received += len(chunk)
+    await reply(consumer, 'upload_ack', upload_id=upload_id, offset=upload.received)
+
+    if upload.received == attachment.size:
+        await complete(upload)
+
+
+async def complete(upload):
+    session = upload.session
+    _uploads.get(session.channel_name, {}).pop(upload.attachment.upload_id, None)
+    upload.close()
+    try:
+        attachment = await finish_upload(session, upload.attachment)
+    except OSError as e:
+        print(f"[ERROR] Storing upload {upload.attachment.upload_id} failed: {e}")
+        await reply(session, 'upload_error', upload_id=upload.attachment.upload_id, error='Could not store the file')
+        return
+    print(f"[DATABASE] Attachment '{attachment.filename}' saved as message {attachment.message_id}")
+    await apin_to_primary(session.user.id)
+    notifications.message_posted(session, attachment.message)
+    analytics.message_posted(session)
+
+    await session.broadcast(
+        {
+            'type': 'attachment',
+            'message_id': attachment.message_id,
+            'upload_id': attachment.upload_id,
+            'filename': attachment.filename,
+            'content_type': attachment.content_type,
+            'size': attachment.size,
+            'url': attachment.file.url,
+            'username': session.user.username,
+            'author_id': session.user.id,
+        }
+    )
+
+
+async def abort(upload, error):
+    """Give up on an upload: close it and delete what was received"""
+    session = upload.session
+    print(f"[WARNING] Upload {upload.attachment.upload_id} aborted: {error}")
+    _uploads.get(session.channel_name, {}).pop(upload.attachment.upload_id, None)
+    upload.close()
+    await discard_upload(upload.attachment)
+    await reply(session, 'upload_error', upload_id=upload.attachment.upload_id, error=error)
+
+
+def forget(session):
+    """Close the session's partial files; the uploads stay resumable"""
+    uploads = _uploads.get(session.channel_name, {})
+    for upload_id, upload in list(uploads.items()):
+        if upload.session is session:
+            del uploads[upload_id]
+            upload.close()
+    if not uploads:
+        _uploads.pop(session.channel_name, None)
+
+
+@database_sync_to_async
+def create_upload(session, filename, content_type, size):
+    """(Upload, None) when the user's quota has room for it, else (None, error)"""
+    with transaction.atomic():
+        used = Attachment.objects.filter(uploader=session.user).aggregate(total=Sum('size'))['total'] or 0
+        if used + size > user_quota_bytes():
+            return None, f'Upload quota exceeded ({used} of {user_quota_bytes()} bytes used)'
+        attachment = Attachment.objects.create(
+            uploader=session.user,
+            group=session.chat_group,
+            filename=filename,
+            content_type=content_type,
+            size=size,
+        )
+    return Upload(session, attachment, 0), None
+
+
+@database_sync_to_async
+def resume_upload(session, upload_id):
+    attachment = Attachment.objects.filter(
+        upload_id=upload_id, uploader=session.user, group=session.chat_group, is_complete=False
+    ).first()
+    if attachment is None:
+        return None
+    try:
+        # The partial file is the truth; whatever the client thinks it sent
+        received = min(os.path.getsize(partial_path(upload_id)), attachment.size)
+    except OSError:
+        received = 0
+    return Upload(session, attachment, received)
+
+
+@database_sync_to_async
+def finish_upload(session, attachment):
+    """Move the partial file into storage and post the message for it"""
+    path = partial_path(attachment.upload_id)
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while block := f.read(BLOCK_SIZE):
+            digest.update(block)
+    sha256 = digest.hexdigest()
+
+    # Stored without the client's extension unless it is a safe image: the
+    # original name is only used for Content-Disposition when served
+    stem = os.path.splitext(get_valid_filename(attachment.filename))[0] or 'file'
+    name = hashed_name('attachments', stem + safe_extension(attachment.filename), sha256)
+    # The name comes from the content, so an existing file is the same file
+    if not default_storage.exists(name):
+        with open(path, 'rb') as f:
+            name = default_storage.save(name, File(f))
+
+    with transaction.atomic():
+        message = GroupMessage.objects.create(
+            group=session.chat_group, author=session.user, body=attachment.filename[:300]
+        )
+        attachment.message = message
+        attachment.file.name = name
+        attachment.sha256 = sha256
+        attachment.is_complete = True
+        attachment.save(update_fields=['message', 'file', 'sha256', 'is_complete'])
+        record_last_message(message)
+    os.remove(path)
+    return attachment
+
+
+@database_sync_to_async
+def discard_upload(attachment):
+    attachment.delete()
+    try:
+        os.remove(partial_path(attachment.upload_id))
+    except OSError:
+        pass
+
+
+@receiver(post_delete, sender=Attachment)
+def release_file(sender, instance, **kwargs):
+    """Delete a stored file once no attachment refers to it any more"""
+    name = instance.file.name
+    if not name:
+        return
+
+    def release():
+        if not Attachment.objects.filter(file=name).exists():
+            default_storage.delete(name)
+
+    transaction.on_commit(release)
@@ -0,0 +1,49 @@
+"""
+Compressed frames for large socket payloads.
+
+daphne does not negotiate permessage-deflate, so compression is done one
+level up, per frame. A client opts in by connecting with
+``?compress=deflate``. From then on, any frame whose JSON is at least
+CHAT_COMPRESS_MIN_BYTES long is sent as a binary frame holding the
+zlib-compressed JSON. Browsers inflate it with
+``DecompressionStream('deflate')``. Smaller frames stay plain text, because
+chat messages and presence events are too short to be worth the CPU, and
+clients that did not opt in always get text. Server-to-client binary frames
+are used for nothing else.
+
+The big frames are history pages and presence snapshots. They are encoded
+in the database thread that builds them, so compressing never blocks the
+event loop.
+"""
+import json
+import zlib
+from urllib.parse import parse_qs
+
+from django.conf import settings
+
+
+def min_bytes():
+    return getattr(settings, 'CHAT_COMPRESS_MIN_BYTES', 4096)
+
+
+def level():
+    return getattr(settings, 'CHAT_COMPRESS_LEVEL', 6)
+
+
+def accepts(scope):
+    """Whether the client asked for compressed frames when it connected"""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    return 'deflate' in query.get('compress', [])
+
+
+def compress(text):
+    return zlib.compress(text.encode(), level())
+
+
+def encode(frame, compressed):
+    """send() keyword arguments for a frame: text, or deflated bytes when large enough"""
+    text = json.dumps(frame)
+    # Characters, not bytes, but close enough for a threshold and free to count
+    if compressed and len(text) >= min_bytes():
+        return {'bytes_data': compress(text)}
+    return {'text_data': text}
@@ -1,235 +1,646 @@
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
 from django.template.loader import render_to_string
+from django.utils import timezone
+from a_core import profiling
+from a_core.db_routers import apin_to_primary, read_alias
 from .models import ChatGroup, GroupMessage, UserOnlineStatus
+from . import analytics, attachments, compression, dedup, ephemeral, fanout, history, mentions, moderation, notifications
+from .inbox import record_last_message, refresh_preview
+
+
+def max_subscriptions():
+    return getattr(settings, 'CHAT_MAX_SUBSCRIPTIONS', 20)
+
+
+class RoomSession:
+    """
+    One room open on a socket. The per-room helpers (ephemeral, attachments,
+    notifications, fanout) take a session where they used to take the
+    consumer: it has the same user, channel layer, channel name and room
+    attributes, and forwards sends and relayed events to its socket.
+    """
+
+    def __init__(self, consumer, chat_group):
+        self.consumer = consumer
+        self.user = consumer.user
+        self.channel_layer = consumer.channel_layer
+        self.channel_name = consumer.channel_name
+        self.chat_group = chat_group
+        self.chatroom_name = chat_group.group_name
+        self.fanout_shards = chat_group.fanout_shards
+
+    async def send(self, text_data=None, bytes_data=None):
+        await self.consumer.send(text_data=text_data, bytes_data=bytes_data)
+
+    async def dispatch(self, message):
+        # Events handed over by a fanout LocalRelay
+        await self.consumer.dispatch(message)
+
+    async def broadcast(self, event):
+        """Send an event to everyone in this room"""
+        with profiling.phase('layer'):
+            await fanout.broadcast(self.channel_layer, self.chatroom_name, self.fanout_shards, event)
+
+    async def post_message(self, data):
+        """Persist a typed message and broadcast it to the room"""
+        print(f"[RECEIVE] Message from '{self.user.username}' in '{self.chatroom_name}': {data}")
+
+        try:
+            message_body = str(data.get('message', '')).strip()
+
+            if not message_body:
+                print("[WARNING] Empty message")
+                return
+
+            # A resend of a message this worker stored recently: just ack it again
+            client_id = dedup.clean(data.get('client_id'))
+            if client_id is not None:
+                message_id = dedup.seen(self.user.id, client_id)
+                if message_id is not None:
+                    print(f"[DEDUP] Resent message {message_id} from '{self.user.username}'")
+                    await self.ack(client_id, message_id, duplicate=True)
+                    return
+
+            # Screened before anything is stored
+            action, message_body = await moderation.ascreen(message_body)
+            if action == 'block':
+                print(f"[MODERATION] Blocked a message from '{self.user.username}'")
+                await self.blocked(client_id=client_id)
+                return
+
+            # Save message to database
+            message, created = await self.save_message(message_body, client_id, flagged=action == 'flag')
+            if client_id is not None:
+                dedup.remember(self.user.id, client_id, message.id)
+                await self.ack(client_id, message.id, duplicate=not created)
+            if not created:
+                print(f"[DEDUP] Resent message {message.id} from '{self.user.username}' (database)")
+                return
+            print(f"[DATABASE] Message saved with ID: {message.id}")
+            # Read our own writes until the replica has this message
+            await apin_to_primary(self.user.id)
+            notifications.message_posted(self, message)
+            analytics.message_posted(self)
+
+            # Render once for the author and once for everyone else, instead
+            # of every recipient fetching and rendering the message itself
+            author_html, message_html = self.render_message(message)
+
+            # Broadcast to ALL users in group
+            await self.broadcast(
+                {
+                    'type': 'chat_message',
+                    'message_html': message_html,
+                    'author_html': author_html,
+                    'message_id': message.id,
+                    'username': self.user.username,
+                    'author_id': self.user.id,
+                }
+            )
+            print(f"[BROADCAST] Message sent to group!")
+
+            # Resolved from this worker's member trie, no queries
+            mentioned = [
+                user_id for user_id in mentions.find_mentions(self.chat_group.id, message.body)
+                if user_id != self.user.id
+            ]
+            if mentioned:
+                await mentions.deliver(self, message, mentioned)
+
+        except Exception as e:
+            print(f"[ERROR] Failed to process message: {e}")
+
+    async def blocked(self, **fields):
+        """Tell the sender moderation refused its message or edit"""
+        await self.consumer.send_frame({'type': 'message_blocked', 'room': self.chatroom_name, **fields})
+
+    async def ack(self, client_id, message_id, duplicate):
+        """Tell the sender which message its client id became"""
+        await self.consumer.send_frame({
+            'type': 'ack',
+            'room': self.chatroom_name,
+            'client_id': client_id,
+            'message_id': message_id,
+            'duplicate': duplicate,
+        })
+
+    async def patch_message(self, op, data):
+        """Edit or delete a message and broadcast a patch instead of new HTML"""
+        try:
+            message_id = int(data['message_id'])
+            expected_version = int(data['version']) if 'version' in data else None
+        except (KeyError, TypeError, ValueError):
+            print("[WARNING] Malformed patch frame")
+            return
+
+        body = action = None
+        if op == 'edit':
+            body = str(data.get('body', '')).strip()[:300]
+            if not body:
+                print("[WARNING] Empty edit")
+                return
+            action, body = await moderation.ascreen(body)
+            if action == 'block':
+                print(f"[MODERATION] Blocked an edit from '{self.user.username}'")
+                await self.blocked(message_id=message_id)
+                return
+
+        message = await self.apply_patch(message_id, op, body, expected_version, flagged=action == 'flag')
+        if message is None:
+            print(f"[WARNING] User '{self.user.username}' cannot {op} message {message_id}")
+            return
+        print(f"[DATABASE] Message {message.id} {'edited' if op == 'edit' else 'deleted'}, now version {message.version}")
+        await apin_to_primary(self.user.id)
+
+        await self.broadcast(
+            {
+                'type': 'message_patch',
+                'op': op,
+                'message_id': message.id,
+                'version': message.version,
+                'body': None if message.is_deleted else message.body,
+                'edited_at': message.edited_at.isoformat() if message.edited_at else None,
+            }
+        )
+
+    async def send_history(self, data):
+        """Reply to a history request with one page, compressed if the socket allows"""
+        try:
+            before, after, limit = (
+                int(data[key]) if data.get(key) is not None else None for key in ('before', 'after', 'limit')
+            )
+        except (TypeError, ValueError):
+            print("[WARNING] Malformed history frame")
+            return
+        await self.send(**await self.encoded_history(before, after, limit))
+
+    async def send_snapshot(self):
+        await self.send(**await self.encoded_snapshot())
+
+    def render_message(self, message):
+        """Render message HTML as seen by its author and by everyone else"""
+        template = 'a_rtchat/partials/chat_message_p.html'
+        # Typed messages never have an attachment; cache that so the
+        # template doesn't look one up
+        GroupMessage.attachment.related.set_cached_value(message, None)
+        author_html = render_to_string(template, {'message': message, 'user': message.author})
+        message_html = render_to_string(template, {'message': message, 'user': None})
+        return author_html, message_html
+
+    # Database operations
+
+    @database_sync_to_async
+    def encoded_history(self, before, after, limit):
+        # Rendered and compressed here in the database thread, off the event loop
+        frame = history.history_frame(self.chat_group, self.user, before, after, limit, using=read_alias(self.user))
+        return compression.encode(frame, self.consumer.compress)
+
+    @database_sync_to_async
+    def encoded_snapshot(self):
+        frame = history.snapshot_frame(self.chat_group, using=read_alias(self.user))
+        return compression.encode(frame, self.consumer.compress)
+
+    @database_sync_to_async
+    def set_presence(self, is_online, current_chatroom):
+        """
+        Update the status row and this room's online list in one transaction.
+        current_chatroom is the room the status row should point at: this one
+        when joining, another room still open on the socket (or None) when leaving.
+        """
+        with transaction.atomic():
+            UserOnlineStatus.objects.update_or_create(
+                user=self.user,
+                defaults={
+                    'is_online': current_chatroom is not None,
+                    'current_chatroom': current_chatroom,
+                    'last_activity': timezone.now(),
+                }
+            )
+            if is_online:
+                self.chat_group.users_online.add(self.user)
+            else:
+                self.chat_group.users_online.remove(self.user)
+            online_count = self.chat_group.users_online.count()
+
+        print(f"[TRACKER] User '{self.user.username}' status: {'Online' if is_online else 'Offline'} in '{self.chatroom_name}'")
+        return online_count
+
+    @database_sync_to_async
+    def save_message(self, body, client_id=None, flagged=False):
+        """
+        Store a message, make it the room's last message and bump the author's
+        activity. Returns (message, created): when the author already sent
+        this client id, the stored message and False.
+        """
+        with transaction.atomic():
+            try:
+                with transaction.atomic():
+                    message = GroupMessage.objects.create(
+                        group=self.chat_group, author=self.user, body=body, client_id=client_id, flagged=flagged
+                    )
+            except IntegrityError:
+                if client_id is None:
+                    raise
+                return GroupMessage.objects.get(author=self.user, client_id=client_id), False
+            record_last_message(message)
+            UserOnlineStatus.objects.filter(user=self.user).update(last_activity=timezone.now())
+        return message, True
+
+    @database_sync_to_async
+    def apply_patch(self, message_id, op, body, expected_version, flagged=False):
+        """
+        Locked read-check-write of one message. Returns the updated message, or
+        None when it doesn't exist, the user may not change it, or the client
+        edited a stale version.
+        """
+        with transaction.atomic():
+            message = (
+                GroupMessage.objects.select_for_update()
+                .filter(pk=message_id, group=self.chat_group)
+                .first()
+            )
+            if message is None:
+                return None
+            message.group = self.chat_group
+
+            allowed = message.can_edit(self.user) if op == 'edit' else message.can_delete(self.user)
+            if not allowed or expected_version not in (None, message.version):
+                return None
+
+            if op == 'edit':
+                message.body = body
+                message.edited_at = timezone.now()
+                # A clean edit doesn't clear an earlier flag
+                message.flagged = message.flagged or flagged
+            else:
+                message.is_deleted = True
+            message.version += 1
+            message.save(update_fields=['body', 'edited_at', 'is_deleted', 'version', 'flagged'])
+            refresh_preview(message)
+            return message
+
+
+class MultiplexChatConsumer(AsyncWebsocketConsumer):
+    """
+    One socket for any number of rooms. The client sends
+    {"type": "subscribe", "room": ...} and {"type": "unsubscribe", "room": ...};
+    every other frame names its room, and every room event sent back carries
+    a "room" field. A frame without a room goes to the only open room.
+    """
+    # Fan-out handlers only format and forward an event, so they skip the
+    # close_old_connections() thread hop channels runs before every handler.
+    db_free_handlers = (
+        'chat_message', 'message_patch', 'user_online_status', 'fanout_changed', 'room_state', 'attachment',
+        'members_changed', 'notify', 'mention',
+    )
+    # Events broadcast to a room, as opposed to this user's notify and mention events
+    room_events = (
+        'chat_message', 'message_patch', 'user_online_status', 'fanout_changed', 'room_state', 'attachment',
+        'members_changed',
+    )
+
+    async def dispatch(self, message):
+        if message['type'] in self.room_events and message.get('room') not in self.sessions:
+            # Still in flight when the room was unsubscribed
+            return
+        if profiling.enabled():
+            name = 'ws ' + message['type'].removeprefix('websocket.')
+            with profiling.trace(name, user=getattr(self, 'user', None), room=message.get('room')):
+                await self.dispatch_event(message)
+        else:
+            await self.dispatch_event(message)
+
+    async def dispatch_event(self, message):
+        if message['type'] in self.db_free_handlers:
+            await getattr(self, message['type'])(message)
+        else:
+            await super().dispatch(message)
 
-class ChatConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         """Called when WebSocket connects"""
         self.user = self.scope['user']
-        self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
-        self.chatroom_group_name = f'chat_{self.chatroom_name}'
-        
-        print(f"[CONNECT] User '{self.user.username}' connecting to '{self.chatroom_name}'")
-        
-        # Join room group
-        await self.channel_layer.group_add(
-            self.chatroom_group_name,
-            self.channel_name
-        )
-        
+        self.sessions = {}
+        # Large frames go out deflated when the client connected with ?compress=deflate
+        self.compress = compression.accepts(self.scope)
+
+        if not self.user.is_authenticated:
+            print("[WARNING] Anonymous socket rejected")
+            await self.close()
+            return
+
+        # Load the profile up front so rendering messages never touches the DB
+        self.user = await User.objects.select_related('profile').aget(pk=self.user.pk)
+        # Alerts from the user's rooms that are not open on this socket
+        await notifications.join(self)
         await self.accept()
-        print(f"[SUCCESS] User '{self.user.username}' connected!")
-        
-        # Update online status
-        await self.update_online_status(is_online=True)
-        
-        # Add user to online list
-        await self.remove_user_from_online()
-        await self.add_user_to_online()
-        
-        # Get online count
-        online_count = await self.get_online_count()
-        print(f"[INFO] Online users: {online_count}")
-        
+        print(f"[CONNECT] User '{self.user.username}' connected (multiplexed)")
+
+    async def disconnect(self, close_code):
+        """Called when WebSocket disconnects"""
+        if not self.user.is_authenticated:
+            return
+
+        print(f"[DISCONNECT] User '{self.user.username}' disconnecting")
+        for room_name in list(self.sessions):
+            await self.unsubscribe(room_name)
+        await notifications.leave(self)
+        print(f"[SUCCESS] User '{self.user.username}' disconnected")
+
+    async def subscribe(self, room_name):
+        """Open a room on this socket: join its group, go online there. Returns an error or None."""
+        if room_name in self.sessions:
+            return None
+        if len(self.sessions) >= max_subscriptions():
+            return 'Too many rooms on one connection'
+
+        chat_group = await self.get_room(room_name)
+        if chat_group is None:
+            print(f"[WARNING] Chatroom '{room_name}' does not exist or is private")
+            return 'No such room'
+        await self.open_room(chat_group)
+        return None
+
+    async def open_room(self, chat_group):
+        room_name = chat_group.group_name
+        session = self.sessions[room_name] = RoomSession(self, chat_group)
+        # Join room group (or one of its shards for very large rooms)
+        await fanout.join(session, room_name, session.fanout_shards)
+        await mentions.open_room(session)
+
+        # Update online status and online list
+        online_count = await session.set_presence(True, chat_group)
+        print(f"[INFO] Online users in '{room_name}': {online_count}")
+        analytics.open_room(session, online_count)
+
         # Broadcast that user came online
-        await self.channel_layer.group_send(
-            self.chatroom_group_name,
+        await session.broadcast(
             {
                 'type': 'user_online_status',
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'status': 'online',
+                'online_count': online_count,
             }
         )
 
-    async def disconnect(self, close_code):
-        """Called when WebSocket disconnects"""
-        print(f"[DISCONNECT] User '{self.user.username}' disconnecting")
-        
-        # Update online status
-        await self.update_online_status(is_online=False)
-        
-        # Remove user from online list
-        await self.remove_user_from_online()
-        
+    async def unsubscribe(self, room_name):
+        """Close a room on this socket"""
+        session = self.sessions.pop(room_name, None)
+        if session is None:
+            return
+
+        ephemeral.forget(session)
+        attachments.forget(session)
+
+        # The status row moves to the most recently opened room still open
+        remaining = list(self.sessions.values())
+        online_count = await session.set_presence(False, remaining[-1].chat_group if remaining else None)
+        analytics.close_room(session, online_count)
+
         # Broadcast that user went offline
-        await self.channel_layer.group_send(
-            self.chatroom_group_name,
+        await session.broadcast(
             {
                 'type': 'user_online_status',
                 'user_id': self.user.id,
                 'username': self.user.username,
                 'status': 'offline',
+                'online_count': online_count,
             }
         )
-        
+
         # Leave room group
-        await self.channel_layer.group_discard(
-            self.chatroom_group_name,
-            self.channel_name
-        )
-        print(f"[SUCCESS] User '{self.user.username}' disconnected")
+        await fanout.leave(session, room_name, session.fanout_shards)
+        mentions.close_room(session)
 
-    async def receive(self, text_data):
+    def session_for(self, data):
+        room_name = data.get('room')
+        if room_name is None and len(self.sessions) == 1:
+            return next(iter(self.sessions.values()))
+        return self.sessions.get(room_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
         """Called when message received from WebSocket"""
-        print(f"[RECEIVE] Message from '{self.user.username}': {text_data}")
-        
+        if bytes_data is not None:
+            # Binary frames are only ever attachment chunks
+            await attachments.receive_chunk(self, bytes_data)
+            return
+        if text_data is None:
+            return
+
         try:
             data = json.loads(text_data)
-            message_body = data.get('message', '').strip()
-            
-            if not message_body:
-                print("[WARNING] Empty message")
-                return
-            
-            print(f"[PROCESSING] Message: {message_body}")
-            
-            # Update last activity
-            await self.update_last_activity()
-            
-            # Save message to database
-            message = await self.save_message(message_body)
-            print(f"[DATABASE] Message saved with ID: {message.id}")
-            
-            # Render message HTML for this user
-            message_html = await self.render_message_for_user(message, self.user)
-            
-            # Broadcast to ALL users in group
-            await self.channel_layer.group_send(
-                self.chatroom_group_name,
-                {
-                    'type': 'chat_message',
-                    'message_html': message_html,
-                    'message_id': message.id,
-                    'username': self.user.username,
-                    'author_id': self.user.id,
-                }
-            )
-            print(f"[BROADCAST] Message sent to group!")
-            
-        except Exception as e:
-            print(f"[ERROR] Failed to process message: {e}")
+        except ValueError:
+            print("[WARNING] Malformed frame")
+            return
+        if not isinstance(data, dict):
+            print("[WARNING] Malformed frame")
+            return
+
+        frame_type = data.get('type')
+        if frame_type == 'subscribe':
+            room_name = str(data.get('room', ''))
+            error = await self.subscribe(room_name)
+            if error:
+                await self.send_frame({'type': 'subscribe_error', 'room': room_name, 'error': error})
+            else:
+                await self.send_frame({'type': 'subscribed', 'room': room_name})
+            return
+        if frame_type == 'unsubscribe':
+            room_name = str(data.get('room', ''))
+            await self.unsubscribe(room_name)
+            await self.send_frame({'type': 'unsubscribed', 'room': room_name})
+            return
+
+        session = self.session_for(data)
+        if session is None:
+            print(f"[WARNING] Frame for a room that is not open: {data.get('room')!r}")
+            return
+
+        # Typing indicators and read receipts never touch the message path
+        if frame_type in ('typing', 'seen'):
+            ephemeral.handle(session, frame_type, data)
+        elif frame_type in ('edit', 'delete'):
+            await session.patch_message(frame_type, data)
+        elif frame_type == 'upload_start':
+            await attachments.start(session, data)
+        elif frame_type == 'history':
+            await session.send_history(data)
+        elif frame_type == 'snapshot':
+            await session.send_snapshot()
+        else:
+            await session.post_message(data)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        with profiling.phase('send'):
+            await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def send_frame(self, frame):
+        await self.send(**compression.encode(frame, self.compress))
 
     async def chat_message(self, event):
         """Handle chat_message events from channel layer"""
-        print(f"[HANDLER] Broadcasting to '{self.user.username}'")
-        
-        try:
-            # Get message and re-render for this specific user
-            message = await self.get_message(event['message_id'])
-            message_html = await self.render_message_for_user(message, self.user)
-            
-            await self.send(text_data=json.dumps({
-                'type': 'chat_message',
-                'message_html': message_html,
-                'message_id': event['message_id'],
-                'username': event['username'],
-            }))
-            print(f"[SUCCESS] Message sent to '{self.user.username}'")
-            
-        except Exception as e:
-            print(f"[ERROR] Failed to send message: {e}")
-    
+        if event['author_id'] == self.user.id:
+            message_html = event['author_html']
+        else:
+            message_html = event['message_html']
+
+        await self.send_frame({
+            'type': 'chat_message',
+            'room': event['room'],
+            'message_html': message_html,
+            'message_id': event['message_id'],
+            'username': event['username'],
+            'author_id': event['author_id'],
+        })
+
+    async def message_patch(self, event):
+        """Handle message_patch events from channel layer"""
+        await self.send_frame({
+            'type': 'message_patch',
+            'room': event['room'],
+            'op': event['op'],
+            'message_id': event['message_id'],
+            'version': event['version'],
+            'body': event['body'],
+            'edited_at': event['edited_at'],
+        })
+
+    async def attachment(self, event):
+        """Handle a finished attachment: metadata and URL only"""
+        await self.send_frame({
+            'type': 'attachment',
+            'room': event['room'],
+            'message_id': event['message_id'],
+            'upload_id': event['upload_id'],
+            'filename': event['filename'],
+            'content_type': event['content_type'],
+            'size': event['size'],
+            'url': event['url'],
+            'username': event['username'],
+            'author_id': event['author_id'],
+        })
+
+    async def notify(self, event):
+        """Handle a new-message alert for another room"""
+        await self.send_frame(event)
+
+    async def mention(self, event):
+        """Handle this user being mentioned in any room"""
+        await self.send_frame(event)
+
+    async def members_changed(self, event):
+        """Keep this worker's member trie of the room current"""
+        mentions.apply(self.sessions[event['room']].chat_group.id, event)
+
     async def user_online_status(self, event):
         """Handle user online/offline status changes"""
-        print(f"[STATUS] User {event['username']} is now {event['status']}")
-        
-        await self.send(text_data=json.dumps({
+        if 'online_count' in event:
+            # Peaks for this worker's analytics, whichever worker the change happened on
+            analytics.online_changed(self.sessions[event['room']].chat_group.id, event['online_count'])
+        await self.send_frame({
             'type': 'user_status',
+            'room': event['room'],
             'user_id': event['user_id'],
             'username': event['username'],
             'status': event['status'],
-        }))
+        })
+
+    async def room_state(self, event):
+        """Handle coalesced typing/seen updates"""
+        await self.send_frame({
+            'type': 'room_state',
+            'room': event['room'],
+            'typing': event['typing'],
+            'idle': event['idle'],
+            'seen': event['seen'],
+        })
+
+    async def fanout_changed(self, event):
+        """Room switched between plain and sharded fan-out; move this socket"""
+        session = self.sessions[event['room']]
+        await fanout.leave(session, session.chatroom_name, session.fanout_shards)
+        session.fanout_shards = event['shards']
+        await fanout.join(session, session.chatroom_name, session.fanout_shards)
 
-    # Database operations
-    
-    @database_sync_to_async
-    def update_online_status(self, is_online):
-        """Update user's online status and current chatroom"""
-        from django.utils import timezone
-        
-        chat_group = ChatGroup.objects.get(group_name=self.chatroom_name)
-        
-        status, created = UserOnlineStatus.objects.get_or_create(
-            user=self.user,
-            defaults={
-                'is_online': is_online,
-                'current_chatroom': chat_group if is_online else None,
-                'last_activity': timezone.now()
-            }
-        )
-        
-        if not created:
-            status.is_online = is_online
-            status.current_chatroom = chat_group if is_online else None
-            status.last_activity = timezone.now()
-            status.save()
-        
-        print(f"[TRACKER] User '{self.user.username}' status: {'Online' if is_online else 'Offline'} in '{self.chatroom_name}'")
-    
-    @database_sync_to_async
-    def update_last_activity(self):
-        """Update user's last activity timestamp"""
-        from django.utils import timezone
-        
-        try:
-            status = UserOnlineStatus.objects.get(user=self.user)
-            status.last_activity = timezone.now()
-            status.save(update_fields=['last_activity'])
-        except UserOnlineStatus.DoesNotExist:
-            pass
-    
-    @database_sync_to_async
-    def add_user_to_online(self):
-        """Add user to online list"""
-        chat_group = ChatGroup.objects.get(group_name=self.chatroom_name)
-        if self.user not in chat_group.users_online.all():
-            chat_group.users_online.add(self.user)
-            print(f"[DATABASE] Added '{self.user.username}' to online list")
-    
-    @database_sync_to_async
-    def remove_user_from_online(self):
-        """Remove user from online list"""
-        try:
-            chat_group = ChatGroup.objects.get(group_name=self.chatroom_name)
-            if self.user in chat_group.users_online.all():
-                chat_group.users_online.remove(self.user)
-                print(f"[DATABASE] Removed '{self.user.username}' from online list")
-        except Exception as e:
-            print(f"[ERROR] Remove user failed: {e}")
-    
-    @database_sync_to_async
-    def get_online_count(self):
-        """Get online count"""
-        chat_group = ChatGroup.objects.get(group_name=self.chatroom_name)
-        count = chat_group.users_online.count()
-        users = list(chat_group.users_online.values_list('username', flat=True))
-        print(f"[INFO] Online: {count}, Users: {users}")
-        return count
-    
-    @database_sync_to_async
-    def save_message(self, message_body):
-        """Save message to database"""
-        chat_group = ChatGroup.objects.get(group_name=self.chatroom_name)
-        message = GroupMessage.objects.create(
-            group=chat_group,
-            author=self.user,
-            body=message_body
-        )
-        print(f"[DATABASE] Message saved: ID={message.id}, Author={self.user.username}")
-        return message
-    
-    @database_sync_to_async
-    def get_message(self, message_id):
-        """Get message by ID"""
-        return GroupMessage.objects.get(id=message_id)
-    
     @database_sync_to_async
-    def render_message_for_user(self, message, viewing_user):
-        """Render message HTML for specific user"""
-        return render_to_string('a_rtchat/partials/chat_message_p.html', {
-            'message': message,
-            'user': viewing_user
-        })
\ No newline at end of file
+    def get_room(self, room_name):
+        """The room, if it exists and this user may open it"""
+        chat_group = ChatGroup.objects.filter(group_name=room_name).first()
+        if chat_group is None:
+            return None
+        if chat_group.is_private and not chat_group.members.filter(pk=self.user.pk).exists():
+            return None
+        return chat_group
+
+
+class ChatConsumer(MultiplexChatConsumer):
+    """Compatibility endpoint: one socket bound to the room in its URL"""
+
+    async def connect(self):
+        """Called when WebSocket connects"""
+        self.user = self.scope['user']
+        self.chatroom_name = self.scope['url_route']['kwargs']['chatroom_name']
+        self.sessions = {}
+        self.compress = compression.accepts(self.scope)
+
+        print(f"[CONNECT] User '{self.user.username}' connecting to '{self.chatroom_name}'")
+
+        if not self.user.is_authenticated:
+            print("[WARNING] Anonymous socket rejected")
+            await self.close()
+            return
+
+        chat_group = await self.get_room(self.chatroom_name)
+        if chat_group is None:
+            print(f"[WARNING] Chatroom '{self.chatroom_name}' does not exist or is private")
+            await self.close()
+            return
+
+        self.user = await User.objects.select_related('profile').aget(pk=self.user.pk)
+        await notifications.join(self)
+        await self.accept()
+        print(f"[SUCCESS] User '{self.user.username}' connected!")
+
+        # Accepted first: a local relay delivers our own online status right away
+        await self.open_room(chat_group)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if text_data is not None:
+            try:
+                data = json.loads(text_data)
+            except ValueError:
+                data = None
+            if isinstance(data, dict) and data.get('type') in ('subscribe', 'unsubscribe'):
+                print("[WARNING] Subscriptions need the multiplexed endpoint")
+                return
+        await super().receive(text_data, bytes_data)
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    """Socket for pages without a chat room: only receives notify events"""
+
+    async def connect(self):
+        self.user = self.scope['user']
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        await notifications.join(self)
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.user.is_authenticated:
+            await notifications.leave(self)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        pass
+
+    async def notify(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def mention(self, event):
+        await self.send(text_data=json.dumps(event))
@@ -0,0 +1,63 @@
+"""
+Idempotent message submission.
+
+Clients tag each message with a ``client_id`` they generate, and resend
+unacknowledged messages after a reconnect. GroupMessage has a unique
+constraint on (author, client_id), so a resend never creates a second row,
+whichever worker it lands on. In front of that, each worker remembers the
+ids it stored in the last CHAT_CLIENT_ID_TTL seconds. The common retry
+(same worker, seconds later) is then answered from memory without a
+database round trip. Either way the client gets an ``ack`` with the
+canonical message id.
+"""
+import time
+
+from django.conf import settings
+
+MAX_LENGTH = 64
+
+# (author_id, client_id) -> (expires, message_id). Every entry lives for the
+# same TTL, so insertion order is expiry order and expiring is popping from
+# the front.
+_seen = {}
+
+
+def ttl():
+    return getattr(settings, 'CHAT_CLIENT_ID_TTL', 300)
+
+
+def max_entries():
+    return getattr(settings, 'CHAT_CLIENT_ID_MAX_ENTRIES', 100000)
+
+
+def clean(client_id):
+    """The client id from a frame, or None if it is missing or unusable"""
+    if not isinstance(client_id, str):
+        return None
+    client_id = client_id.strip()
+    if not client_id or len(client_id) > MAX_LENGTH:
+        return None
+    return client_id
+
+
+def seen(author_id, client_id):
+    """Message id stored for this client id recently, if this worker remembers it"""
+    entry = _seen.get((author_id, client_id))
+    if entry is None or entry[0] <= time.monotonic():
+        return None
+    return entry[1]
+
+
+def remember(author_id, client_id, message_id):
+    now = time.monotonic()
+    key = (author_id, client_id)
+    # Re-inserted at the end so the dict stays in expiry order
+    _seen.pop(key, None)
+    _seen[key] = (now + ttl(), message_id)
+
+    limit = max_entries()
+    while _seen:
+        oldest = next(iter(_seen))
+        if _seen[oldest][0] > now and len(_seen) <= limit:
+            break
+        del _seen[oldest]
@@ -0,0 +1,173 @@
+"""
+Typing indicators and read receipts.
+
+These frames skip the message path entirely: nothing is written or rendered
+when they arrive. Each user's frames are debounced per room, folded into
+that room's pending state and sent as one compact ``room_state`` broadcast
+per CHAT_ROOM_STATE_INTERVAL. Read positions are kept in memory and written
+to ReadMarker in one batch every CHAT_READ_MARKER_FLUSH_SECONDS; stored
+markers only ever move forward.
+"""
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db.models import BigIntegerField, Case, F, Q, Value, When
+from django.utils import timezone
+
+from . import fanout
+from .models import ReadMarker
+
+
+def state_interval():
+    return getattr(settings, 'CHAT_ROOM_STATE_INTERVAL', 0.3)
+
+
+def typing_debounce():
+    return getattr(settings, 'CHAT_TYPING_DEBOUNCE_SECONDS', 2)
+
+
+def marker_flush_interval():
+    return getattr(settings, 'CHAT_READ_MARKER_FLUSH_SECONDS', 10)
+
+
+class RoomState:
+    """Typing/seen changes for one room waiting for the next broadcast"""
+
+    def __init__(self, room_name):
+        self.room_name = room_name
+        self.typing = {}
+        self.idle = set()
+        self.seen = {}
+        self.channel_layer = None
+        self.shards = 0
+        self.flush_task = None
+
+    def schedule(self, consumer):
+        self.channel_layer = consumer.channel_layer
+        self.shards = consumer.fanout_shards
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self.flush())
+
+    async def flush(self):
+        await asyncio.sleep(state_interval())
+        event = {
+            'type': 'room_state',
+            'typing': [[user_id, username] for user_id, username in self.typing.items()],
+            'idle': list(self.idle),
+            'seen': [[user_id, message_id] for user_id, message_id in self.seen.items()],
+        }
+        self.typing, self.idle, self.seen = {}, set(), {}
+        self.flush_task = None
+        await fanout.broadcast(self.channel_layer, self.room_name, self.shards, event)
+
+
+_rooms = {}
+_last_typing = {}
+_last_seen = {}
+_pending_markers = {}
+_marker_task = None
+
+
+def handle(consumer, frame_type, data):
+    """Fold a typing/seen frame into its room's pending state"""
+    if frame_type == 'typing':
+        note_typing(consumer, bool(data.get('typing', True)))
+    elif frame_type == 'seen':
+        try:
+            note_seen(consumer, int(data['message_id']))
+        except (KeyError, TypeError, ValueError):
+            pass
+
+
+def note_typing(consumer, is_typing):
+    key = (consumer.chatroom_name, consumer.user.id)
+    now = time.monotonic()
+    state = _rooms.setdefault(consumer.chatroom_name, RoomState(consumer.chatroom_name))
+
+    if is_typing:
+        # Clients send on every keystroke; forward one per debounce window
+        if now - _last_typing.get(key, 0) < typing_debounce():
+            return
+        _last_typing[key] = now
+        state.idle.discard(consumer.user.id)
+        state.typing[consumer.user.id] = consumer.user.username
+    else:
+        if _last_typing.pop(key, None) is None:
+            return
+        state.typing.pop(consumer.user.id, None)
+        state.idle.add(consumer.user.id)
+    state.schedule(consumer)
+
+
+def note_seen(consumer, message_id):
+    key = (consumer.chatroom_name, consumer.user.id)
+    if message_id <= _last_seen.get(key, 0):
+        return
+    _last_seen[key] = message_id
+
+    state = _rooms.setdefault(consumer.chatroom_name, RoomState(consumer.chatroom_name))
+    state.seen[consumer.user.id] = message_id
+    state.schedule(consumer)
+
+    _pending_markers[(consumer.user.id, consumer.chat_group.id)] = message_id
+    _start_marker_flusher()
+
+
+def forget(consumer):
+    """Clear per-socket state on disconnect, broadcasting that typing stopped"""
+    note_typing(consumer, False)
+    _last_seen.pop((consumer.chatroom_name, consumer.user.id), None)
+
+
+def _start_marker_flusher():
+    global _marker_task
+    if _marker_task is None or _marker_task.done():
+        _marker_task = asyncio.create_task(_flush_markers_forever())
+
+
+async def _flush_markers_forever():
+    while _pending_markers:
+        await asyncio.sleep(marker_flush_interval())
+        await flush_read_markers()
+
+
+async def flush_read_markers():
+    """Write every pending read position in one batch"""
+    global _pending_markers
+    if not _pending_markers:
+        return
+    pending, _pending_markers = _pending_markers, {}
+    try:
+        await _upsert_markers(pending)
+    except Exception as e:
+        print(f"[ERROR] Read marker flush failed: {e}")
+        for key, message_id in pending.items():
+            _pending_markers.setdefault(key, message_id)
+
+
+@database_sync_to_async
+def _upsert_markers(pending):
+    # Create the missing rows, then only move markers forward: another tab on
+    # another worker, or a restarted worker, may hold an older position
+    ReadMarker.objects.bulk_create(
+        [
+            ReadMarker(user_id=user_id, group_id=group_id, last_read_message=message_id)
+            for (user_id, group_id), message_id in pending.items()
+        ],
+        ignore_conflicts=True,
+    )
+    behind = Q()
+    for (user_id, group_id), message_id in pending.items():
+        behind |= Q(user_id=user_id, group_id=group_id, last_read_message__lt=message_id)
+    ReadMarker.objects.filter(behind).update(
+        last_read_message=Case(
+            *(When(user_id=user_id, group_id=group_id, then=Value(message_id))
+              for (user_id, group_id), message_id in pending.items()),
+            default=F('last_read_message'),
+            output_field=BigIntegerField(),
+        ),
+        updated=timezone.now(),
+    )
+    print(f"[DATABASE] Flushed {len(pending)} read markers")
@@ -0,0 +1,176 @@
+"""
+Room fan-out over the channel layer.
+
+Small rooms use a single group per room (``chat_<room>``). Once a room's
+membership crosses CHAT_FANOUT_SHARD_THRESHOLD it is switched to sharded
+mode: every socket joins one of CHAT_FANOUT_SHARDS sub-groups picked by
+hashing its channel name, and broadcasts go to all sub-groups concurrently.
+
+With CHAT_FANOUT_LOCAL_RELAY enabled, sockets of a sharded room register
+with a per-worker LocalRelay instead of joining a group themselves. The
+relay is the worker's only group member for that room, so a broadcast
+crosses the channel layer once per worker and is then dispatched to the
+local consumers in-process.
+"""
+import asyncio
+import zlib
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .models import ChatGroup
+
+
+def shard_threshold():
+    return getattr(settings, 'CHAT_FANOUT_SHARD_THRESHOLD', 500)
+
+
+def shard_count():
+    return getattr(settings, 'CHAT_FANOUT_SHARDS', 16)
+
+
+def local_relay_enabled():
+    return getattr(settings, 'CHAT_FANOUT_LOCAL_RELAY', False)
+
+
+def room_group(room_name):
+    return f'chat_{room_name}'
+
+
+def shard_groups(room_name, shards):
+    """All channel-layer groups a broadcast to this room must reach"""
+    if not shards:
+        return [room_group(room_name)]
+    return [f'{room_group(room_name)}.{i}' for i in range(shards)]
+
+
+def member_group(room_name, shards, channel_name):
+    """The single group a given channel joins for this room"""
+    if not shards:
+        return room_group(room_name)
+    return f'{room_group(room_name)}.{zlib.crc32(channel_name.encode()) % shards}'
+
+
+def desired_shards(member_count, current):
+    """Shard count for a room of this size, with hysteresis around the threshold"""
+    threshold = shard_threshold()
+    if current:
+        return current if member_count >= threshold // 2 else 0
+    return shard_count() if member_count >= threshold else 0
+
+
+class LocalRelay:
+    """Per-worker subscriber that forwards one room's events to local consumers"""
+
+    def __init__(self, channel_layer, room_name, shards):
+        self.key = (id(channel_layer), room_name, shards)
+        self.channel_layer = channel_layer
+        self.room_name = room_name
+        self.shards = shards
+        self.consumers = set()
+        self.channel_name = None
+        self.group = None
+        self.task = None
+
+    async def add(self, consumer):
+        if self.channel_name is None:
+            self.channel_name = await self.channel_layer.new_channel('relay')
+            self.group = member_group(self.room_name, self.shards, self.channel_name)
+        self.consumers.add(consumer)
+        # Re-adding also refreshes the membership's group expiry
+        await self.channel_layer.group_add(self.group, self.channel_name)
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def remove(self, consumer):
+        self.consumers.discard(consumer)
+        if not self.consumers:
+            self.close()
+
+    def close(self):
+        if _relays.get(self.key) is self:
+            del _relays[self.key]
+        # A consumer may leave from inside run() itself; the loop exits on its own then
+        if self.task is not None and self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    async def run(self):
+        try:
+            while self.consumers:
+                event = await self.channel_layer.receive(self.channel_name)
+                consumers = list(self.consumers)
+                results = await asyncio.gather(
+                    *(consumer.dispatch(event) for consumer in consumers),
+                    return_exceptions=True,
+                )
+                # One broken handler must not stop the others, but must not go unnoticed
+                for consumer, result in zip(consumers, results):
+                    if isinstance(result, Exception):
+                        print(f"[ERROR] Relay of '{self.room_name}' failed to deliver "
+                              f"{event.get('type')} to {consumer.channel_name}: {result!r}")
+        finally:
+            self.close()
+            await self.channel_layer.group_discard(self.group, self.channel_name)
+
+
+_relays = {}
+
+
+def get_relay(channel_layer, room_name, shards):
+    key = (id(channel_layer), room_name, shards)
+    if key not in _relays:
+        _relays[key] = LocalRelay(channel_layer, room_name, shards)
+    return _relays[key]
+
+
+async def join(consumer, room_name, shards):
+    """Subscribe a consumer to a room's broadcasts"""
+    if shards and local_relay_enabled():
+        await get_relay(consumer.channel_layer, room_name, shards).add(consumer)
+    else:
+        group = member_group(room_name, shards, consumer.channel_name)
+        await consumer.channel_layer.group_add(group, consumer.channel_name)
+
+
+async def leave(consumer, room_name, shards):
+    """Unsubscribe a consumer from a room's broadcasts"""
+    relay = _relays.get((id(consumer.channel_layer), room_name, shards))
+    if relay is not None and consumer in relay.consumers:
+        await relay.remove(consumer)
+    else:
+        group = member_group(room_name, shards, consumer.channel_name)
+        await consumer.channel_layer.group_discard(group, consumer.channel_name)
+
+
+async def broadcast(channel_layer, room_name, shards, event):
+    """Send an event to every socket in a room, shards in parallel"""
+    # Tagged with the room, so a socket with several rooms open knows which
+    event = dict(event, room=room_name)
+    groups = shard_groups(room_name, shards)
+    if len(groups) == 1:
+        await channel_layer.group_send(groups[0], event)
+    else:
+        await asyncio.gather(*(channel_layer.group_send(group, event) for group in groups))
+
+
+def update_room_fanout(chat_group):
+    """
+    Re-evaluate a room's fan-out mode after its membership changed. When the
+    mode flips, connected sockets are told over the old topology to move.
+    """
+    old_shards = chat_group.fanout_shards
+    shards = desired_shards(chat_group.members.count(), old_shards)
+    if shards == old_shards:
+        return
+
+    ChatGroup.objects.filter(pk=chat_group.pk).update(fanout_shards=shards)
+    chat_group.fanout_shards = shards
+    print(f"[FANOUT] Room '{chat_group.group_name}' now uses {shards or 'no'} shards")
+
+    async_to_sync(broadcast)(
+        get_channel_layer(),
+        chat_group.group_name,
+        old_shards,
+        {'type': 'fanout_changed', 'shards': shards},
+    )
@@ -45,7 +45,7 @@ class GroupChatCreateForm(forms.ModelForm):
 class GroupChatEditForm(forms.ModelForm):
     class Meta:
         model = ChatGroup
-        fields = ['groupchat_name', 'description', 'group_icon']
+        fields = ['groupchat_name', 'description', 'group_icon', 'retention_days']
         widgets = {
             'groupchat_name': forms.TextInput(attrs={
                 'placeholder': 'Enter group name...',
@@ -59,5 +59,10 @@ class GroupChatEditForm(forms.ModelForm):
             'group_icon': forms.FileInput(attrs={
                 'class': 'hidden',
                 'accept': 'image/*'
+            }),
+            'retention_days': forms.NumberInput(attrs={
+                'placeholder': 'Keep forever',
+                'min': 1,
+                'class': 'w-full p-3 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500 focus:border-transparent'
             })
         }
\ No newline at end of file
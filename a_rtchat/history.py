@@ -0,0 +1,95 @@
+"""
+History pages and presence snapshots served over the chat socket.
+
+A client asks for ``{"type": "history"}`` to get the latest page of a room,
+for ``"before": <message id>`` to page back, or for ``"after": <message id>``
+to replay what it missed while reconnecting. ``{"type": "snapshot"}`` gets
+who is online. Both replies are large and repetitive: rendered message HTML
+and long user lists. They are the frames compression.encode deflates.
+"""
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db.models import Q
+from django.template.loader import get_template
+
+from .models import ChatGroup, GroupMessage
+
+MESSAGE_TEMPLATE = 'a_rtchat/partials/chat_message_p.html'
+Membership = ChatGroup.members.through
+
+
+def page_size():
+    return getattr(settings, 'CHAT_HISTORY_PAGE_SIZE', 50)
+
+
+def max_page_size():
+    return getattr(settings, 'CHAT_HISTORY_MAX_PAGE_SIZE', 200)
+
+
+def history_frame(chat_group, user, before=None, after=None, limit=None, using=None):
+    """
+    One page of a room's messages, oldest first, rendered as ``user`` sees
+    them. A cursor message that no longer exists (deleted or pruned) gives
+    the latest page with ``reset`` set, so the client redraws rather than
+    leaving a gap.
+    """
+    limit = max(1, min(limit or page_size(), max_page_size()))
+    messages = GroupMessage.objects.using(using).filter(group=chat_group)
+    cursor = after if after is not None else before
+    reset = False
+    if cursor is not None:
+        anchor = messages.filter(pk=cursor).values_list('created', flat=True).first()
+        if anchor is None:
+            reset = True
+            before = after = None
+        elif after is not None:
+            messages = messages.filter(Q(created__gt=anchor) | Q(created=anchor, pk__gt=cursor))
+        else:
+            messages = messages.filter(Q(created__lt=anchor) | Q(created=anchor, pk__lt=cursor))
+
+    # Walk the (group, created) index from the cursor and fetch one extra row
+    # to know whether there is more
+    ascending = after is not None
+    order = ('created', 'pk') if ascending else ('-created', '-pk')
+    rows = list(messages.select_related('author__profile', 'attachment').order_by(*order)[:limit + 1])
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if not ascending:
+        rows.reverse()
+
+    template = get_template(MESSAGE_TEMPLATE)
+    return {
+        'type': 'history',
+        'room': chat_group.group_name,
+        'messages': [
+            {
+                'id': message.id,
+                'version': message.version,
+                'html': template.render({'message': message, 'user': user}),
+            }
+            for message in rows
+        ],
+        'has_more': has_more,
+        'reset': reset,
+    }
+
+
+def snapshot_frame(chat_group, using=None):
+    """Everyone online in a room, with what the member list shows for them"""
+    online = (
+        User.objects.using(using)
+        .filter(online_in_groups=chat_group)
+        .select_related('profile')
+        .order_by('username')
+    )
+    users = [
+        {'id': user.id, 'username': user.username, 'name': user.profile.name, 'avatar': user.profile.avatar}
+        for user in online
+    ]
+    return {
+        'type': 'snapshot',
+        'room': chat_group.group_name,
+        'member_count': Membership.objects.using(using).filter(chatgroup=chat_group).count(),
+        'online_count': len(users),
+        'online': users,
+    }
@@ -0,0 +1,79 @@
+"""
+Denormalized "last message" of each room, for the recency-sorted inbox.
+
+ChatGroup carries a pointer to its newest message, a short preview and
+``last_activity``. The inbox is then a single scan of the
+(-last_activity, -id) index, with no per-room subquery. The fields only
+ever move forward: a message older than the room's current last message
+never replaces it. Live messages update their room with one conditional
+UPDATE. Batched writes (seeding, imports) update each touched room once
+per batch.
+"""
+from django.db.models import Exists, OuterRef, Q
+
+from .models import ChatGroup
+
+PREVIEW_LENGTH = 100
+UsersOnline = ChatGroup.users_online.through
+
+
+def preview_for(message):
+    if message.is_deleted:
+        return 'Message deleted'
+    body = ' '.join(message.body.split())
+    return body if len(body) <= PREVIEW_LENGTH else body[:PREVIEW_LENGTH - 1] + '…'
+
+
+def record_last_message(message):
+    """Make ``message`` its room's last message unless the room has a newer one"""
+    return ChatGroup.objects.filter(
+        Q(last_message__isnull=True) | Q(last_activity__lte=message.created),
+        pk=message.group_id,
+    ).update(
+        last_message=message,
+        last_message_preview=preview_for(message),
+        last_activity=message.created,
+    )
+
+
+def record_last_messages(messages):
+    """record_last_message for a batch of saved messages: two queries per batch"""
+    newest = {}
+    for message in messages:
+        current = newest.get(message.group_id)
+        if current is None or (message.created, message.pk or 0) > (current.created, current.pk or 0):
+            newest[message.group_id] = message
+    if not newest:
+        return 0
+
+    rooms = ChatGroup.objects.filter(pk__in=newest).only('pk', 'last_message', 'last_activity')
+    changed = []
+    for room in rooms:
+        message = newest[room.pk]
+        if room.last_message_id is None or message.created >= room.last_activity:
+            room.last_message_id = message.pk
+            room.last_message_preview = preview_for(message)
+            room.last_activity = message.created
+            changed.append(room)
+    ChatGroup.objects.bulk_update(changed, ['last_message', 'last_message_preview', 'last_activity'])
+    return len(changed)
+
+
+def refresh_preview(message):
+    """Re-render the preview after an edit or delete, if it is the room's last message"""
+    return ChatGroup.objects.filter(pk=message.group_id, last_message=message).update(
+        last_message_preview=preview_for(message)
+    )
+
+
+def inbox(user, is_private, using=None):
+    """A user's DMs or groups, most recently active first, flagging rooms where someone else is online"""
+    return (
+        ChatGroup.objects.using(using)
+        .filter(members=user, is_private=is_private)
+        .select_related('last_message__author')
+        .annotate(has_online=Exists(
+            UsersOnline.objects.filter(chatgroup=OuterRef('pk')).exclude(user=user)
+        ))
+        .order_by('-last_activity', '-id')
+    )
@@ -0,0 +1,292 @@
+"""
+Channel layer for several worker processes on one host, without a broker.
+
+Every process listens on its own Unix socket in ``socket_dir``. Channel
+names carry the owning worker's id (``specific.<worker>!<random>``), so a
+send() goes straight to that worker. Group membership is held by the worker
+that owns the member channel: group_send() delivers to local members and
+forwards one frame to each peer worker, which delivers to its own members.
+
+Per-channel capacity, message expiry and group expiry behave like
+InMemoryChannelLayer, which is what ChatConsumer is written against.
+"""
+import asyncio
+import os
+import random
+import string
+import struct
+import time
+from copy import deepcopy
+
+import msgpack
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+FRAME_HEADER = struct.Struct('!I')
+
+
+def _random_suffix(length=12):
+    return ''.join(random.choice(string.ascii_letters) for _ in range(length))
+
+
+class UnixSocketChannelLayer(BaseChannelLayer):
+
+    extensions = ['groups', 'flush']
+
+    def __init__(
+        self,
+        socket_dir='/tmp/chat-ipc',
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        peer_refresh=1.0,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(channel_capacity or {})
+        self.group_expiry = group_expiry
+        self.socket_dir = socket_dir
+        self.peer_refresh = peer_refresh
+        self.worker_id = f'w{os.getpid()}x{_random_suffix(6)}'
+        self.socket_path = os.path.join(socket_dir, f'{self.worker_id}.sock')
+
+        self.channels = {}
+        self.groups = {}
+        self.server = None
+        self.loop = None
+        self.writers = {}
+        self.peer_ids = []
+        self.peers_checked = 0
+        self.last_sweep = 0
+
+    # Channel layer API
+
+    async def new_channel(self, prefix='specific'):
+        """Returns a new channel name owned by this worker"""
+        await self._ensure_server()
+        return f'{prefix}.{self.worker_id}!{_random_suffix()}'
+
+    async def send(self, channel, message):
+        """Send a message onto a channel, wherever its worker lives"""
+        assert isinstance(message, dict), 'message is not a dict'
+        self.require_valid_channel_name(channel)
+        owner = self._route(channel)
+        if owner is None:
+            self._deliver(channel, message)
+        else:
+            await self._forward(owner, {'op': 'send', 'channel': channel, 'message': message})
+
+    async def receive(self, channel):
+        """Receive the first unexpired message that arrives on the channel"""
+        self.require_valid_channel_name(channel)
+        self._sweep()
+
+        while True:
+            queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+            try:
+                expires, message = await queue.get()
+            finally:
+                if queue.empty():
+                    self.channels.pop(channel, None)
+            if expires >= time.time():
+                return message
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        owner = self._route(channel)
+        if owner is None:
+            await self._ensure_server()
+            self.groups.setdefault(group, {})[channel] = time.time()
+        else:
+            await self._forward(owner, {'op': 'group_add', 'group': group, 'channel': channel})
+
+    async def group_discard(self, group, channel):
+        self.require_valid_group_name(group)
+        self.require_valid_channel_name(channel)
+        owner = self._route(channel)
+        if owner is None:
+            self._discard(group, channel)
+        else:
+            await self._forward(owner, {'op': 'group_discard', 'group': group, 'channel': channel})
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), 'Message is not a dict'
+        self.require_valid_group_name(group)
+        self._sweep()
+
+        frame = {'op': 'group_send', 'group': group, 'message': message}
+        peers = [peer for peer in self._peers() if peer != self.worker_id]
+        if self._in_own_loop():
+            self._group_deliver(group, message)
+        elif self.server is not None:
+            # Called from another event loop (async_to_sync in a plain thread):
+            # our queues belong to the server loop, so go through our own socket
+            peers.append(self.worker_id)
+        await asyncio.gather(*(self._forward(peer, frame) for peer in peers))
+
+    # Flush extension
+
+    async def flush(self):
+        self.channels = {}
+        self.groups = {}
+
+    async def close(self):
+        for writer in self.writers.values():
+            writer.close()
+        self.writers = {}
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    # Local delivery
+
+    def _route(self, channel):
+        """
+        Worker to forward a channel operation to, or None to handle it here.
+        Channels without a worker id (no "!") always live in this process.
+        """
+        if '!' in channel:
+            owner = self.non_local_name(channel)[:-1].rsplit('.', 1)[-1]
+        else:
+            owner = self.worker_id
+        if owner != self.worker_id:
+            return owner
+        if self._in_own_loop() or self.server is None:
+            return None
+        # Our queues belong to the server loop, so go through our own socket
+        return owner
+
+    def _in_own_loop(self):
+        return self.loop is None or asyncio.get_running_loop() is self.loop
+
+    def _deliver(self, channel, message):
+        queue = self.channels.setdefault(channel, asyncio.Queue(maxsize=self.get_capacity(channel)))
+        try:
+            queue.put_nowait((time.time() + self.expiry, deepcopy(message)))
+        except asyncio.QueueFull:
+            raise ChannelFull(channel)
+
+    def _group_deliver(self, group, message):
+        for channel in list(self.groups.get(group, {})):
+            try:
+                self._deliver(channel, message)
+            except ChannelFull:
+                pass
+
+    def _discard(self, group, channel):
+        members = self.groups.get(group)
+        if members:
+            members.pop(channel, None)
+            if not members:
+                self.groups.pop(group, None)
+
+    def _sweep(self):
+        """Drop expired messages and memberships, at most once a second"""
+        now = time.time()
+        if now - self.last_sweep < 1:
+            return
+        self.last_sweep = now
+
+        for channel, queue in list(self.channels.items()):
+            expired = False
+            while not queue.empty() and queue._queue[0][0] < now:
+                queue.get_nowait()
+                expired = True
+            if expired:
+                # An expired message means nobody is reading: leave all groups
+                for group in list(self.groups):
+                    self._discard(group, channel)
+                if queue.empty():
+                    self.channels.pop(channel, None)
+
+        cutoff = now - self.group_expiry
+        for group, members in list(self.groups.items()):
+            for channel, joined in list(members.items()):
+                if joined < cutoff:
+                    self._discard(group, channel)
+
+    # Peer transport
+
+    async def _ensure_server(self):
+        if self.server is not None:
+            return
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.loop = asyncio.get_running_loop()
+        self.server = await asyncio.start_unix_server(self._serve_peer, path=self.socket_path)
+        print(f"[IPC] Worker '{self.worker_id}' listening on {self.socket_path}")
+
+    async def _serve_peer(self, reader, writer):
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+                frame = msgpack.unpackb(await reader.readexactly(length), raw=False)
+                self._apply(frame)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
+
+    def _apply(self, frame):
+        op = frame['op']
+        if op == 'send':
+            try:
+                self._deliver(frame['channel'], frame['message'])
+            except ChannelFull:
+                pass
+        elif op == 'group_send':
+            self._group_deliver(frame['group'], frame['message'])
+        elif op == 'group_add':
+            self.groups.setdefault(frame['group'], {})[frame['channel']] = time.time()
+        elif op == 'group_discard':
+            self._discard(frame['group'], frame['channel'])
+
+    def _peers(self):
+        """Worker ids with a socket in socket_dir, refreshed every peer_refresh seconds"""
+        now = time.monotonic()
+        if now - self.peers_checked >= self.peer_refresh:
+            self.peers_checked = now
+            try:
+                names = os.listdir(self.socket_dir)
+            except FileNotFoundError:
+                names = []
+            self.peer_ids = [name[:-5] for name in names if name.endswith('.sock')]
+        return self.peer_ids
+
+    async def _forward(self, worker_id, frame):
+        payload = msgpack.packb(frame, use_bin_type=True)
+        data = FRAME_HEADER.pack(len(payload)) + payload
+        path = os.path.join(self.socket_dir, f'{worker_id}.sock')
+        # Connections are cached only on the loop that owns this layer
+        cache = self._in_own_loop() and self.loop is not None
+        writer = self.writers.get(worker_id) if cache else None
+
+        try:
+            if writer is None or writer.is_closing():
+                _, writer = await asyncio.open_unix_connection(path)
+                if cache:
+                    self.writers[worker_id] = writer
+            writer.write(data)
+            await writer.drain()
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The worker is gone; a refused socket file is left over from a crash
+            self.writers.pop(worker_id, None)
+            if os.path.exists(path) and worker_id != self.worker_id:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            self.peers_checked = 0
+        except OSError as e:
+            self.writers.pop(worker_id, None)
+            print(f"[IPC] Forward to '{worker_id}' failed: {e}")
+        finally:
+            if not cache and writer is not None:
+                writer.close()
@@ -0,0 +1,84 @@
+"""Shared helpers for the bench_* management commands"""
+import contextlib
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from django.db import connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+@contextlib.contextmanager
+def scratch_database(keepdb=False):
+    """Run the block against a throwaway test database, never the real one"""
+    setup_test_environment()
+    connection = connections['default']
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=keepdb)
+    try:
+        yield connection
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=keepdb)
+        teardown_test_environment()
+
+
+class BenchChannelLayer(InMemoryChannelLayer):
+    """
+    InMemoryChannelLayer that sweeps expired messages at most once a second.
+    The stock layer walks every channel on each receive(), which is O(sockets)
+    per event and would dominate any benchmark with thousands of sockets.
+    """
+
+    def __init__(self, sweep_interval=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.sweep_interval = sweep_interval
+        self.last_sweep = 0
+
+    def _clean_expired(self):
+        now = time.monotonic()
+        if now - self.last_sweep >= self.sweep_interval:
+            self.last_sweep = now
+            super()._clean_expired()
+
+
+@contextlib.contextmanager
+def bench_channel_layer(capacity):
+    """Swap the default channel layer for a BenchChannelLayer"""
+    layer = BenchChannelLayer(capacity=capacity)
+    old = channel_layers.set('default', layer)
+    try:
+        yield layer
+    finally:
+        if old is None:
+            channel_layers.backends.pop('default', None)
+        else:
+            channel_layers.set('default', old)
+
+
+def summarize(samples):
+    """Latency summary in milliseconds for a list of durations in seconds"""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+
+    def pct(p):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000, 2)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(sum(ordered) / len(ordered) * 1000, 2),
+        'p50_ms': pct(0.50),
+        'p95_ms': pct(0.95),
+        'p99_ms': pct(0.99),
+        'max_ms': round(ordered[-1] * 1000, 2),
+    }
+
+
+def write_report(stdout, report, output=None):
+    """Print a report and optionally save it as JSON"""
+    for section, values in report.items():
+        stdout.write(f'{section}: {json.dumps(values)}')
+    if output:
+        with open(output, 'w') as fh:
+            json.dump(report, fh, indent=2)
+        stdout.write(f'[BENCH] Report written to {output}')
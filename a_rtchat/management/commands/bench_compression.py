@@ -0,0 +1,109 @@
+import json
+import time
+import zlib
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from a_rtchat import compression
+from a_rtchat.history import history_frame, snapshot_frame
+from a_rtchat.models import ChatGroup
+from a_rtchat.seeding import seed
+from ._bench import scratch_database, summarize, write_report
+
+
+def timed(repeat, func, *args):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        times.append(time.perf_counter() - started)
+    return result, times
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure size, compression ratio and compress/inflate CPU of history pages, '
+        'replays and presence snapshots built from seeded GroupMessage history'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=20000)
+        parser.add_argument('--online', type=int, default=300,
+                            help='Members marked online in the benchmarked room')
+        parser.add_argument('--page-sizes', default='25,50,100,200')
+        parser.add_argument('--levels', default='1,6,9')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        page_sizes = [int(size) for size in options['page_sizes'].split(',')]
+        levels = [int(level) for level in options['levels'].split(',')]
+
+        with scratch_database():
+            seed(users=options['users'], groups=20, dms=0, messages=options['messages'],
+                 random_seed=options['seed'], log=self.stdout.write)
+            # The busiest public room, with a realistic share of its members online
+            room = (
+                ChatGroup.objects.filter(is_private=False)
+                .annotate(message_count=Count('chat_messages'))
+                .order_by('-message_count')
+                .first()
+            )
+            members = list(room.members.order_by('pk')[:max(options['online'], 1)])
+            room.users_online.add(*members[:options['online']])
+            viewer = members[0]
+
+            frames = {}
+            build_times = {}
+            for size in page_sizes:
+                frames[f'history_{size}'], build_times[f'history_{size}'] = timed(
+                    options['repeat'], history_frame, room, viewer, None, None, size
+                )
+            # A reconnect replay: the newest half-page the client missed
+            latest = frames[f'history_{page_sizes[0]}']['messages']
+            anchor = latest[len(latest) // 2]['id']
+            frames['replay'], build_times['replay'] = timed(
+                options['repeat'], history_frame, room, viewer, None, anchor, None
+            )
+            frames['snapshot'], build_times['snapshot'] = timed(options['repeat'], snapshot_frame, room)
+            # A live message for scale: what the threshold keeps uncompressed
+            frames['chat_message'] = {
+                'type': 'chat_message', 'room': room.group_name,
+                'message_html': latest[-1]['html'], 'message_id': latest[-1]['id'],
+                'username': viewer.username, 'author_id': viewer.id,
+            }
+
+            report = {}
+            for name, frame in frames.items():
+                report[name] = self.measure(frame, levels, options['repeat'])
+                if name in build_times:
+                    report[name]['build'] = summarize(build_times[name])
+
+        report['config'] = {
+            **{k: options[k] for k in ('users', 'messages', 'online', 'repeat')},
+            'room_messages': room.message_count,
+            'threshold_bytes': compression.min_bytes(),
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def measure(self, frame, levels, repeat):
+        """Raw size, then per level: compressed size, ratio, compress and inflate time"""
+        raw = json.dumps(frame).encode()
+        result = {
+            'items': len(frame.get('messages', frame.get('online', []))),
+            'raw_bytes': len(raw),
+            'compressed_by_default': len(raw) >= compression.min_bytes(),
+        }
+        for level in levels:
+            packed, compress_times = timed(repeat, zlib.compress, raw, level)
+            _, inflate_times = timed(repeat, zlib.decompress, packed)
+            result[f'level_{level}'] = {
+                'bytes': len(packed),
+                'ratio': round(len(raw) / len(packed), 2),
+                'compress': summarize(compress_times),
+                'inflate': summarize(inflate_times),
+            }
+        return result
@@ -0,0 +1,151 @@
+import asyncio
+import time
+import uuid
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from a_rtchat.models import ChatGroup
+from a_rtchat.routing import websocket_urlpatterns
+from a_users.models import Profile
+from ._bench import bench_channel_layer, scratch_database, summarize, write_report
+
+
+class BenchSocket:
+    """One simulated browser tab: a communicator plus a background reader"""
+
+    def __init__(self, application, user, room, arrivals):
+        self.user = user
+        self.arrivals = arrivals
+        self.online = asyncio.Event()
+        self.communicator = WebsocketCommunicator(application, f'/ws/chat/{room}/')
+        self.communicator.scope['user'] = user
+        self.reader = None
+
+    async def connect(self, timeout):
+        started = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout)
+        if not connected:
+            raise RuntimeError(f"Socket for '{self.user.username}' was rejected")
+        self.reader = asyncio.create_task(self.read())
+        # The consumer broadcasts our own online status once presence is stored
+        await asyncio.wait_for(self.online.wait(), timeout)
+        return time.perf_counter() - started
+
+    async def read(self):
+        while True:
+            data = await self.communicator.receive_json_from(timeout=3600)
+            if data['type'] == 'user_status' and data['user_id'] == self.user.id:
+                self.online.set()
+            elif data['type'] == 'chat_message':
+                token = data['message_html'].rsplit('bench:', 1)[-1][:32]
+                waiter = self.arrivals.get(token)
+                if waiter is not None:
+                    waiter.arrived()
+
+    async def disconnect(self, timeout):
+        started = time.perf_counter()
+        if self.reader:
+            self.reader.cancel()
+        await self.communicator.disconnect(timeout=timeout)
+        return time.perf_counter() - started
+
+
+class Delivery:
+    """Tracks one broadcast until every socket in the room has it"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.started = time.perf_counter()
+        self.first = None
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def arrived(self):
+        self.count += 1
+        if self.first is None:
+            self.first = time.perf_counter() - self.started
+        if self.count == self.expected:
+            self.last = time.perf_counter() - self.started
+            self.done.set()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark ChatConsumer connect and message latency with many concurrent sockets'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=1000)
+        parser.add_argument('--messages', type=int, default=50)
+        parser.add_argument('--connect-batch', type=int, default=100,
+                            help='Sockets connecting at the same time')
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--configured-layer', action='store_true',
+                            help='Use CHANNEL_LAYERS as configured instead of the bench layer')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        with scratch_database():
+            users = self.create_users(options['sockets'])
+            ChatGroup.objects.create(group_name='bench-room', groupchat_name='Bench Room')
+            if options['configured_layer']:
+                report = asyncio.run(self.run_bench(users, options))
+            else:
+                # Presence broadcasts put up to one event per socket in every
+                # channel, so size capacity to never drop the ones we wait on
+                with bench_channel_layer(capacity=options['sockets'] * 2):
+                    report = asyncio.run(self.run_bench(users, options))
+        report['config'] = {k: options[k] for k in ('sockets', 'messages', 'connect_batch')}
+        write_report(self.stdout, report, options['output'])
+
+    def create_users(self, count):
+        password = make_password('bench-password')
+        users = User.objects.bulk_create([
+            User(username=f'bench_{i}', password=password) for i in range(count)
+        ])
+        Profile.objects.bulk_create([Profile(user=user) for user in users])
+        return list(User.objects.filter(username__startswith='bench_').order_by('id'))
+
+    async def run_bench(self, users, options):
+        timeout = options['timeout']
+        application = URLRouter(websocket_urlpatterns)
+        arrivals = {}
+        sockets = [BenchSocket(application, user, 'bench-room', arrivals) for user in users]
+
+        self.stdout.write(f'[BENCH] Connecting {len(sockets)} sockets...')
+        connect_times = []
+        batch = options['connect_batch']
+        started = time.perf_counter()
+        for i in range(0, len(sockets), batch):
+            connect_times += await asyncio.gather(
+                *(s.connect(timeout) for s in sockets[i:i + batch])
+            )
+        connect_wall = time.perf_counter() - started
+
+        self.stdout.write(f"[BENCH] Sending {options['messages']} messages...")
+        first_times, last_times = [], []
+        for i in range(options['messages']):
+            token = uuid.uuid4().hex
+            delivery = arrivals[token] = Delivery(len(sockets))
+            sender = sockets[i % len(sockets)]
+            await sender.communicator.send_json_to({'message': f'bench:{token}'})
+            await asyncio.wait_for(delivery.done.wait(), timeout)
+            first_times.append(delivery.first)
+            last_times.append(delivery.last)
+            del arrivals[token]
+
+        self.stdout.write('[BENCH] Disconnecting...')
+        disconnect_times = []
+        for i in range(0, len(sockets), batch):
+            disconnect_times += await asyncio.gather(
+                *(s.disconnect(timeout) for s in sockets[i:i + batch])
+            )
+
+        return {
+            'connect': dict(summarize(connect_times), wall_s=round(connect_wall, 2)),
+            'message_first_delivery': summarize(first_times),
+            'message_full_fanout': summarize(last_times),
+            'disconnect': summarize(disconnect_times),
+        }
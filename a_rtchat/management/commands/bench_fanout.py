@@ -0,0 +1,119 @@
+import asyncio
+import time
+
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+
+from a_rtchat import fanout
+from ._bench import bench_channel_layer, summarize, write_report
+
+
+class Tally:
+    """Counts deliveries of the current broadcast"""
+
+    def __init__(self):
+        self.reset(0)
+
+    def reset(self, expected):
+        self.expected = expected
+        self.count = 0
+        self.done = asyncio.Event()
+
+    def hit(self):
+        self.count += 1
+        if self.count == self.expected:
+            self.done.set()
+
+
+class FakeConsumer:
+    """Stands in for a socket registered with a LocalRelay"""
+
+    def __init__(self, channel_layer, tally):
+        self.channel_layer = channel_layer
+        self.tally = tally
+
+    async def dispatch(self, event):
+        self.tally.hit()
+
+
+class Command(BaseCommand):
+    help = 'Benchmark plain, sharded and relayed room fan-out on the channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=20)
+        parser.add_argument('--shards', type=int, default=16)
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Simulated worker processes for relay mode')
+        parser.add_argument('--configured-layer', action='store_true',
+                            help='Use CHANNEL_LAYERS as configured instead of the bench layer')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['configured_layer']:
+            report = asyncio.run(self.run_bench(get_channel_layer(), options))
+        else:
+            with bench_channel_layer(capacity=options['messages'] + 10) as layer:
+                report = asyncio.run(self.run_bench(layer, options))
+        report['config'] = {k: options[k] for k in ('sockets', 'messages', 'shards', 'workers')}
+        write_report(self.stdout, report, options['output'])
+
+    async def run_bench(self, layer, options):
+        report = {}
+        for mode, shards in (('plain', 0), ('sharded', options['shards'])):
+            report[mode] = await self.bench_groups(layer, mode, shards, options)
+        report['sharded_relay'] = await self.bench_relay(layer, options)
+        return report
+
+    async def bench_groups(self, layer, mode, shards, options):
+        room = f'bench-{mode}'
+        tally = Tally()
+        channels = []
+        for _ in range(options['sockets']):
+            channel = await layer.new_channel()
+            await layer.group_add(fanout.member_group(room, shards, channel), channel)
+            channels.append(channel)
+
+        async def drain(channel):
+            while True:
+                await layer.receive(channel)
+                tally.hit()
+
+        readers = [asyncio.create_task(drain(channel)) for channel in channels]
+        try:
+            return await self.measure(layer, room, shards, tally, options)
+        finally:
+            for reader in readers:
+                reader.cancel()
+            for channel in channels:
+                await layer.group_discard(fanout.member_group(room, shards, channel), channel)
+
+    async def bench_relay(self, layer, options):
+        room = 'bench-relay'
+        shards = options['shards']
+        tally = Tally()
+        relays = [fanout.LocalRelay(layer, room, shards) for _ in range(options['workers'])]
+        consumers = []
+        for i in range(options['sockets']):
+            consumer = FakeConsumer(layer, tally)
+            await relays[i % len(relays)].add(consumer)
+            consumers.append((relays[i % len(relays)], consumer))
+        try:
+            return await self.measure(layer, room, shards, tally, options)
+        finally:
+            for relay, consumer in consumers:
+                await relay.remove(consumer)
+
+    async def measure(self, layer, room, shards, tally, options):
+        send_times, delivery_times = [], []
+        for i in range(options['messages']):
+            tally.reset(options['sockets'])
+            started = time.perf_counter()
+            await fanout.broadcast(layer, room, shards, {'type': 'chat_message', 'seq': i})
+            send_times.append(time.perf_counter() - started)
+            await asyncio.wait_for(tally.done.wait(), 120)
+            delivery_times.append(time.perf_counter() - started)
+        return {
+            'group_send': summarize(send_times),
+            'full_delivery': summarize(delivery_times),
+        }
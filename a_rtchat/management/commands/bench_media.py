@@ -0,0 +1,80 @@
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import RequestFactory, override_settings
+from django.views.static import serve
+
+from a_core.media import serve_media
+from ._bench import summarize, write_report
+
+
+def consume(response):
+    """Read the whole body like a server would; returns bytes sent"""
+    sent = 0
+    if response.streaming:
+        for chunk in response.streaming_content:
+            sent += len(chunk)
+    else:
+        sent = len(response.content)
+    response.close()
+    return sent
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the media view against django.views.static.serve'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--size-kb', type=int, default=200,
+                            help='Size of the served file')
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as media_root, override_settings(MEDIA_ROOT=media_root):
+            name = 'avatar.0123456789abcdef.png'
+            with open(os.path.join(media_root, name), 'wb') as f:
+                f.write(os.urandom(options['size_kb'] * 1024))
+            report = self.run_bench(media_root, name, options['requests'])
+        report['config'] = {k: options[k] for k in ('requests', 'size_kb')}
+        write_report(self.stdout, report, options['output'])
+
+    def run_bench(self, media_root, name, count):
+        factory = RequestFactory()
+        views = {
+            'static_serve': lambda request: serve(request, name, document_root=media_root),
+            'serve_media': lambda request: serve_media(request, name),
+        }
+        first = views['serve_media'](factory.get('/'))
+        etag, last_modified = first['ETag'], first['Last-Modified']
+        consume(first)
+
+        scenarios = {
+            # A browser's first load of an avatar
+            'full': {},
+            # Every later page view while the cached copy is fresh enough to revalidate
+            'revalidate_etag': {'HTTP_IF_NONE_MATCH': etag},
+            'revalidate_date': {'HTTP_IF_MODIFIED_SINCE': last_modified},
+            # Resumed download or media seek
+            'range_64k': {'HTTP_RANGE': 'bytes=0-65535'},
+        }
+
+        report = {}
+        for view_name, view in views.items():
+            for scenario, headers in scenarios.items():
+                times, sent, statuses = [], 0, set()
+                for _ in range(count):
+                    request = factory.get(f'/media/{name}', **headers)
+                    started = time.perf_counter()
+                    response = view(request)
+                    sent += consume(response)
+                    times.append(time.perf_counter() - started)
+                    statuses.add(response.status_code)
+                report[f'{view_name}.{scenario}'] = {
+                    **summarize(times),
+                    'status': sorted(statuses),
+                    'kb_per_request': round(sent / count / 1024, 1),
+                    'cache_control': response.get('Cache-Control'),
+                }
+        return report
@@ -0,0 +1,114 @@
+import os
+import random
+import re
+import string
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from a_rtchat import moderation
+from a_rtchat.seeding import random_body
+from ._bench import summarize, write_report
+
+
+def random_term(rng):
+    word = lambda: ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+    return word() if rng.random() < 0.8 else f'{word()} {word()}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Benchmark the moderation automaton against a loop of substring checks and a '
+        'regex alternation, with a large term list'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--patterns', type=int, default=10000)
+        parser.add_argument('--messages', type=int, default=5000)
+        parser.add_argument('--hit-rate', type=float, default=0.05,
+                            help='Share of messages containing a term')
+        parser.add_argument('--baseline-messages', type=int, default=500,
+                            help='Messages run through the slower baselines')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        terms = list({random_term(rng) for _ in range(options['patterns'])})
+        actions = rng.choices(moderation.ACTIONS, weights=[70, 20, 10], k=len(terms))
+        bodies = []
+        for _ in range(options['messages']):
+            body = random_body(rng)
+            if rng.random() < options['hit_rate']:
+                words = body.split()
+                words.insert(rng.randrange(len(words) + 1), rng.choice(terms))
+                body = ' '.join(words)[:300]
+            bodies.append(body)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'terms.txt')
+            with open(path, 'w', encoding='utf-8') as f:
+                f.writelines(f'{action} {term}\n' for term, action in zip(terms, actions))
+            with override_settings(CHAT_MODERATION_TERMS_FILE=path):
+                report = self.run_bench(path, terms, bodies, options['baseline_messages'])
+
+        report['config'] = {
+            'patterns': len(terms),
+            'messages': len(bodies),
+            'hit_rate': options['hit_rate'],
+            'mean_body_chars': round(sum(map(len, bodies)) / len(bodies), 1),
+        }
+        write_report(self.stdout, report, options['output'])
+
+    def run_bench(self, path, terms, bodies, baseline_count):
+        report = {}
+
+        started = time.perf_counter()
+        moderation.reload(force=True)
+        report['compile_ms'] = round((time.perf_counter() - started) * 1000, 1)
+        report['automaton_states'] = len(moderation.current().goto)
+
+        times, actions = [], {}
+        for body in bodies:
+            started = time.perf_counter()
+            action, _ = moderation.screen(body)
+            times.append(time.perf_counter() - started)
+            actions[action] = actions.get(action, 0) + 1
+        report['automaton'] = {**summarize(times), 'actions': {str(k): v for k, v in actions.items()}}
+
+        # What screening used to look like: one substring search per term
+        lowered_terms = [moderation.normalize(term) for term in terms]
+        times, hits = [], 0
+        for body in bodies[:baseline_count]:
+            started = time.perf_counter()
+            lowered = body.lower()
+            hits += any(term in lowered for term in lowered_terms)
+            times.append(time.perf_counter() - started)
+        report['substring_loop'] = {**summarize(times), 'messages_hit': hits}
+
+        started = time.perf_counter()
+        pattern = re.compile(
+            r'\b(?:' + '|'.join(map(re.escape, sorted(lowered_terms, key=len, reverse=True))) + r')\b'
+        )
+        compile_ms = round((time.perf_counter() - started) * 1000, 1)
+        times, hits = [], 0
+        for body in bodies[:baseline_count]:
+            started = time.perf_counter()
+            hits += pattern.search(body.lower()) is not None
+            times.append(time.perf_counter() - started)
+        report['regex_alternation'] = {**summarize(times), 'messages_hit': hits, 'compile_ms': compile_ms}
+
+        # A live reload: the file changes and the next check recompiles it
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write('block freshly added term\n')
+        os.utime(path, ns=(time.time_ns(), time.time_ns() + 1))
+        started = time.perf_counter()
+        reloaded = moderation.reload()
+        report['reload'] = {
+            'reloaded': reloaded,
+            'ms': round((time.perf_counter() - started) * 1000, 1),
+            'blocks_new_term': moderation.screen('a freshly added term here')[0] == 'block',
+        }
+        return report
@@ -0,0 +1,176 @@
+import asyncio
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.routing import URLRouter
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import AsyncClient
+from django.urls import reverse
+
+from a_core.db_pool import pool_stats
+from a_rtchat.models import ChatGroup
+from a_rtchat.routing import websocket_urlpatterns
+from a_rtchat.seeding import create_users
+from ._bench import bench_channel_layer, scratch_database, summarize, write_report
+from .bench_consumer import BenchSocket, Delivery
+
+
+@database_sync_to_async
+def server_connections():
+    """Backends connected to this database, not counting the one asking"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT count(*) FROM pg_stat_activity '
+            'WHERE datname = current_database() AND pid <> pg_backend_pid()'
+        )
+        return cursor.fetchone()[0]
+
+
+class Sampler:
+    """Polls the server's connection count in the background, per phase"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.phase = 'idle'
+        self.samples = {}
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def run(self):
+        while True:
+            self.samples.setdefault(self.phase, []).append(await server_connections())
+            await asyncio.sleep(self.interval)
+
+    async def stop(self):
+        self.task.cancel()
+        self.samples.setdefault(self.phase, []).append(await server_connections())
+
+    def report(self):
+        return {
+            phase: {'min': min(counts), 'max': max(counts), 'samples': len(counts)}
+            for phase, counts in self.samples.items()
+        }
+
+
+# UNVERIFIED: this benchmark has not been run against PostgreSQL yet, so there
+# are no recorded numbers showing the pool keeps the server's connection count
+# flat at 5k sockets. Only the SQLite refusal and the settings wiring have been
+# checked.
+class Command(BaseCommand):
+    help = (
+        'Hold thousands of sockets open, send message bursts and concurrent page loads, '
+        'and sample how many connections the database server sees (PostgreSQL only; '
+        'not yet run against a real server, so treat its first results as unreviewed)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sockets', type=int, default=5000)
+        parser.add_argument('--messages', type=int, default=200)
+        parser.add_argument('--burst', type=int, default=50,
+                            help='Messages sent at the same time')
+        parser.add_argument('--http-requests', type=int, default=500)
+        parser.add_argument('--http-concurrency', type=int, default=100)
+        parser.add_argument('--connect-batch', type=int, default=200)
+        parser.add_argument('--sample-interval', type=float, default=0.25)
+        parser.add_argument('--timeout', type=float, default=120)
+        parser.add_argument('--output', help='Write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('bench_pool needs PostgreSQL: set DATABASE_URL (and DATABASE_POOL=True for the pool)')
+
+        with scratch_database():
+            ids = create_users([f'bench_{i}' for i in range(options['sockets'])], password='bench-password')
+            users = list(User.objects.filter(pk__in=ids.values()).order_by('pk'))
+            room = ChatGroup.objects.create(group_name='bench-room', groupchat_name='Bench Room')
+            room.members.add(*users)
+            # Let the sampler and the pool start from a clean slate
+            connection.close()
+            with bench_channel_layer(capacity=options['sockets'] * 2):
+                report = asyncio.run(self.run_bench(users, options))
+            report['pool'] = pool_stats('default')
+        report['config'] = {
+            k: options[k] for k in ('sockets', 'messages', 'burst', 'http_requests', 'http_concurrency')
+        }
+        write_report(self.stdout, report, options['output'])
+
+    async def run_bench(self, users, options):
+        timeout = options['timeout']
+        sampler = Sampler(options['sample_interval'])
+        sampler.start()
+        await asyncio.sleep(options['sample_interval'] * 4)
+
+        application = URLRouter(websocket_urlpatterns)
+        arrivals = {}
+        sockets = [BenchSocket(application, user, 'bench-room', arrivals) for user in users]
+
+        sampler.phase = 'connect'
+        self.stdout.write(f'[BENCH] Connecting {len(sockets)} sockets...')
+        batch = options['connect_batch']
+        started = time.perf_counter()
+        for i in range(0, len(sockets), batch):
+            await asyncio.gather(*(s.connect(timeout) for s in sockets[i:i + batch]))
+        connect_wall = time.perf_counter() - started
+
+        sampler.phase = 'messages'
+        self.stdout.write(f"[BENCH] Sending {options['messages']} messages in bursts of {options['burst']}...")
+        fanout_times = []
+        for i in range(0, options['messages'], options['burst']):
+            deliveries = []
+            for j in range(i, min(i + options['burst'], options['messages'])):
+                token = uuid.uuid4().hex
+                delivery = arrivals[token] = Delivery(len(sockets))
+                deliveries.append((token, delivery))
+                await sockets[(j * 7919) % len(sockets)].communicator.send_json_to({'message': f'bench:{token}'})
+            await asyncio.wait_for(asyncio.gather(*(d.done.wait() for _, d in deliveries)), timeout)
+            for token, delivery in deliveries:
+                fanout_times.append(delivery.last)
+                del arrivals[token]
+
+        sampler.phase = 'http'
+        self.stdout.write(f"[BENCH] {options['http_requests']} page loads, {options['http_concurrency']} at a time...")
+        page_times = await self.load_pages(users, options)
+
+        sampler.phase = 'disconnect'
+        self.stdout.write('[BENCH] Disconnecting...')
+        for i in range(0, len(sockets), batch):
+            await asyncio.gather(*(s.disconnect(timeout) for s in sockets[i:i + batch]))
+
+        sampler.phase = 'after'
+        await asyncio.sleep(options['sample_interval'] * 4)
+        await sampler.stop()
+
+        return {
+            'server_connections': sampler.report(),
+            'connect_wall_s': round(connect_wall, 2),
+            'message_full_fanout': summarize(fanout_times),
+            'page_load': summarize(page_times),
+        }
+
+    async def load_pages(self, users, options):
+        url = reverse('online-tracker-users')
+        clients = []
+        for user in users[:options['http_concurrency']]:
+            client = AsyncClient()
+            await client.aforce_login(user)
+            clients.append(client)
+
+        # Every client runs a request at a time, each in its own view thread
+        times = []
+        remaining = iter(range(options['http_requests']))
+
+        async def worker(client):
+            for _ in remaining:
+                started = time.perf_counter()
+                response = await client.get(url)
+                if response.status_code != 200:
+                    raise CommandError(f'{url} answered {response.status_code}')
+                times.append(time.perf_counter() - started)
+
+        await asyncio.gather(*(worker(client) for client in clients))
+        return times
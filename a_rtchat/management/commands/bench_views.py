@@ -0,0 +1,233 @@
+import json
+import platform
+import random
+import statistics
+import time
+import tracemalloc
+
+import django
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from a_rtchat.models import ChatGroup, UserOnlineStatus
+from a_rtchat.seeding import chunked, seed
+from ._bench import scratch_database, summarize, write_report
+
+Membership = ChatGroup.members.through
+UsersOnline = ChatGroup.users_online.through
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed datasets at several scales and measure latency, query count and peak memory '
+        'of the main pages through the test client; optionally compare with an earlier report'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1000,10000,100000',
+                            help='Comma-separated user counts, one seeded dataset each')
+        parser.add_argument('--groups-per-1k', type=float, default=10,
+                            help='Group chats per 1000 users')
+        parser.add_argument('--dms-per-user', type=float, default=0.5)
+        parser.add_argument('--messages-per-user', type=float, default=5)
+        parser.add_argument('--online', type=float, default=0.05,
+                            help='Share of users online, spread over the rooms')
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--requests', type=int, default=30, help='Timed requests per page')
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--profiled', type=int, default=3,
+                            help='Extra requests per page that count queries and trace memory')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the report to this JSON file')
+        parser.add_argument('--compare', help='Earlier report to compare against')
+        parser.add_argument('--max-regression', type=float,
+                            help='Fail if a p50 grows by more than this percent, or a query count grows at all')
+
+    def handle(self, *args, **options):
+        try:
+            scales = [int(scale) for scale in options['scales'].split(',')]
+        except ValueError:
+            raise CommandError('--scales takes comma-separated user counts')
+        if options['max_regression'] is not None and not options['compare']:
+            raise CommandError('--max-regression needs a --compare report to measure against')
+        baseline = None
+        if options['compare']:
+            with open(options['compare']) as fh:
+                baseline = json.load(fh)
+
+        report = {
+            'config': {key: options[key] for key in (
+                'groups_per_1k', 'dms_per_user', 'messages_per_user', 'online', 'days',
+                'requests', 'warmup', 'profiled', 'seed',
+            )},
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'database': connection.vendor,
+                'platform': platform.platform(),
+            },
+        }
+        for users in scales:
+            # A fresh database per scale, so every scale starts from the same state
+            with scratch_database(), override_settings(DEBUG=False):
+                report[f'users_{users}'] = self.run_scale(users, options)
+
+        if baseline is not None:
+            report['comparison'] = compare(baseline, report)
+        write_report(self.stdout, report, options['output'])
+
+        if baseline is not None and options['max_regression'] is not None:
+            regressions = [
+                f'{scale} {page}: {change}'
+                for scale, pages in report['comparison'].items()
+                for page, change in pages.items()
+                if change.get('p50_change_pct', 0) > options['max_regression'] or change.get('queries_change', 0) > 0
+            ]
+            if regressions:
+                raise CommandError('Regressions:\n' + '\n'.join(regressions))
+
+    def run_scale(self, users, options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        counts = seed(
+            users=users,
+            groups=max(1, round(users * options['groups_per_1k'] / 1000)),
+            dms=round(users * options['dms_per_user']),
+            messages=round(users * options['messages_per_user']),
+            days=options['days'],
+            random_seed=options['seed'],
+            log=lambda line: None,
+        )
+        counts['online'] = seed_presence(rng, options['online'])
+        result = {'dataset': counts, 'seed_seconds': round(time.perf_counter() - started, 1), 'pages': {}}
+        self.stdout.write(f'[BENCH] {users} users seeded in {result["seed_seconds"]} s: {json.dumps(counts)}')
+
+        for page, (user, url) in self.pages(rng, options['warmup'] + options['requests'] + options['profiled']):
+            result['pages'][page] = self.measure(user, url, options)
+            self.stdout.write(f'[BENCH] {users} users, {page}: {json.dumps(result["pages"][page])}')
+        return result
+
+    def pages(self, rng, new_dms):
+        """(name, (user, url or list of urls)) for every page measured, for typical and worst-case users"""
+        by_rooms = list(
+            Membership.objects.values('user_id').annotate(rooms=Count('id')).order_by('-rooms', 'user_id')
+        )
+        heavy = User.objects.get(pk=by_rooms[0]['user_id'])
+        typical = User.objects.get(pk=by_rooms[len(by_rooms) // 2]['user_id'])
+
+        biggest_group = (
+            ChatGroup.objects.filter(is_private=False, admin__isnull=False).exclude(group_name='public-chat')
+            .annotate(size=Count('members')).order_by('-size').first()
+        )
+        dm = ChatGroup.objects.filter(is_private=True, members=heavy).first()
+        dm_partner = dm.members.exclude(pk=heavy.pk).first() if dm else None
+        # start_dm creates a DM each time it meets someone new, so each request gets its own stranger
+        strangers = list(
+            User.objects.exclude(pk=heavy.pk).exclude(
+                pk__in=Membership.objects.filter(chatgroup__is_private=True, chatgroup__members=heavy).values('user_id')
+            ).values_list('username', flat=True)[:new_dms]
+        )
+
+        yield 'home_view/heavy', (heavy, reverse('home'))
+        yield 'home_view/typical', (typical, reverse('home'))
+        yield 'chat_view/public', (typical, reverse('chatroom', args=['public-chat']))
+        if biggest_group is not None:
+            yield 'chat_view/biggest_group', (biggest_group.admin, reverse('chatroom', args=[biggest_group.group_name]))
+        if dm is not None:
+            yield 'chat_view/dm', (heavy, reverse('chatroom', args=[dm.group_name]))
+        yield 'online_tracker', (typical, reverse('online-tracker'))
+        if biggest_group is not None:
+            yield 'add_members/page', (biggest_group.admin, reverse('add-members', args=[biggest_group.group_name]))
+            yield 'add_members/search', (
+                biggest_group.admin,
+                reverse('add-members-search', args=[biggest_group.group_name]) + f'?q={rng.choice("aeinorst")}',
+            )
+        if dm_partner is not None:
+            yield 'start_dm/existing', (heavy, reverse('start-dm', args=[dm_partner.username]))
+        if len(strangers) >= new_dms:
+            yield 'start_dm/new', (heavy, [reverse('start-dm', args=[name]) for name in strangers])
+        else:
+            self.stdout.write(f'[BENCH] Skipping start_dm/new: {len(strangers)} strangers, {new_dms} requests needed')
+
+    def measure(self, user, url, options):
+        """Latency from plain requests, then queries and peak memory from a few traced ones"""
+        urls = iter(url) if isinstance(url, list) else None
+        next_url = (lambda: next(urls)) if urls is not None else (lambda: url)
+        client = Client()
+        client.force_login(user)
+
+        statuses = {}
+        for _ in range(options['warmup']):
+            client.get(next_url())
+        times = []
+        for _ in range(options['requests']):
+            started = time.perf_counter()
+            response = client.get(next_url())
+            times.append(time.perf_counter() - started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        queries, peaks = [], []
+        tracemalloc.start()
+        try:
+            for _ in range(options['profiled']):
+                tracemalloc.reset_peak()
+                with CaptureQueriesContext(connection) as captured:
+                    client.get(next_url())
+                peaks.append(tracemalloc.get_traced_memory()[1])
+                queries.append(len(captured))
+        finally:
+            tracemalloc.stop()
+
+        result = {**summarize(times), 'statuses': {str(code): n for code, n in statuses.items()}}
+        if queries:
+            result['queries'] = max(queries)
+            result['peak_kb'] = round(statistics.median(peaks) / 1024, 1)
+        return result
+
+
+def seed_presence(rng, share):
+    """Put a share of the users online, each in one of the public rooms. Returns how many."""
+    user_ids = list(User.objects.values_list('pk', flat=True))
+    online = rng.sample(user_ids, int(len(user_ids) * share))
+    room_ids = list(ChatGroup.objects.filter(is_private=False).values_list('pk', flat=True))
+    for chunk in chunked(online, 5000):
+        rooms = {user_id: rng.choice(room_ids) for user_id in chunk}
+        UserOnlineStatus.objects.bulk_create(
+            [UserOnlineStatus(user_id=user_id, current_chatroom_id=room_id, is_online=True)
+             for user_id, room_id in rooms.items()],
+            ignore_conflicts=True,
+        )
+        UsersOnline.objects.bulk_create(
+            [UsersOnline(user_id=user_id, chatgroup_id=room_id) for user_id, room_id in rooms.items()],
+            ignore_conflicts=True,
+        )
+    return len(online)
+
+
+def compare(baseline, report):
+    """Per scale and page: how p50 latency, query count and peak memory moved since the baseline"""
+    changes = {}
+    for scale, result in report.items():
+        if not scale.startswith('users_') or scale not in baseline:
+            continue
+        for page, now in result['pages'].items():
+            before = baseline[scale]['pages'].get(page)
+            if not before or not before.get('count') or not now.get('count'):
+                continue
+            change = {
+                'p50_ms': [before['p50_ms'], now['p50_ms']],
+                'p50_change_pct': round((now['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100, 1)
+                if before['p50_ms'] else 0,
+            }
+            if 'queries' in before and 'queries' in now:
+                change['queries'] = [before['queries'], now['queries']]
+                change['queries_change'] = now['queries'] - before['queries']
+            if 'peak_kb' in before and 'peak_kb' in now:
+                change['peak_kb'] = [before['peak_kb'], now['peak_kb']]
+            changes.setdefault(scale, {})[page] = change
+    return changes
@@ -0,0 +1,24 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from a_rtchat.analytics import compact
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold minute RoomStat rows past CHAT_ANALYTICS_MINUTE_RETENTION_HOURS into hour rows, '
+        'and hour rows past CHAT_ANALYTICS_HOUR_RETENTION_DAYS into day rows. Safe to interrupt '
+        'and re-run; meant for cron.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows folded per transaction')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        report = {'folded': compact(chunk_size=options['chunk_size'])}
+        report['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(f'[ANALYTICS] Compacted: {json.dumps(report)}')
@@ -0,0 +1,34 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from a_rtchat.export import FORMATS, export_stream
+from a_rtchat.models import ChatGroup
+
+
+class Command(BaseCommand):
+    help = "Stream a room's message history to a file or stdout as NDJSON or CSV"
+
+    def add_arguments(self, parser):
+        parser.add_argument('room', help='group_name of the room')
+        parser.add_argument('--format', choices=sorted(FORMATS), default='ndjson')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('-o', '--output', help='Output file (default: stdout)')
+
+    def handle(self, *args, **options):
+        try:
+            group = ChatGroup.objects.get(group_name=options['room'])
+        except ChatGroup.DoesNotExist:
+            raise CommandError(f"No room named '{options['room']}'")
+
+        blocks = export_stream(group, options['format'], options['gzip'], options['chunk_size'])
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in blocks:
+                out.write(block)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
@@ -0,0 +1,61 @@
+import json
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from a_rtchat.fanout import update_room_fanout
+from a_rtchat.seeding import import_messages
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay message history from a JSONL file, one {"room", "author", "body", '
+        '"created"} object per line, in bulk chunks'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--create-users', action='store_true',
+                            help='Create unknown authors (with unusable passwords)')
+        parser.add_argument('--create-rooms', action='store_true',
+                            help='Create unknown rooms as public groups')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        totals = {'imported': 0, 'skipped': 0}
+        touched = {}
+
+        try:
+            with open(options['path'], encoding='utf-8') as f:
+                records = self.read_records(f)
+                while chunk := list(islice(records, options['chunk_size'])):
+                    imported, skipped, rooms = import_messages(
+                        chunk,
+                        create_users_missing=options['create_users'],
+                        create_rooms_missing=options['create_rooms'],
+                        chunk_size=options['chunk_size'],
+                    )
+                    totals['imported'] += imported
+                    totals['skipped'] += skipped
+                    touched.update(rooms)
+                    self.stdout.write(f"[IMPORT] {totals['imported']} messages imported")
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+
+        for room in touched.values():
+            update_room_fanout(room)
+
+        totals['rooms'] = len(touched)
+        totals['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(f'[IMPORT] Done: {json.dumps(totals)}')
+
+    def read_records(self, f):
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise CommandError(f'Line {line_number} is not valid JSON')
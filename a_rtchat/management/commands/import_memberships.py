@@ -0,0 +1,128 @@
+import csv
+import json
+import time
+from itertools import islice
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, transaction
+
+from a_rtchat.fanout import update_room_fanout
+from a_rtchat.memberships import add_memberships
+from a_rtchat.models import ChatGroup
+
+
+class Command(BaseCommand):
+    help = (
+        'Import groups and memberships from a CSV or JSONL file. Each record has '
+        'a "group" (group_name) and a "username" or "user_id"; "groupchat_name" '
+        'and "is_private" are used when the group has to be created.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--format', choices=('csv', 'jsonl'),
+                            help='Defaults to the file extension')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--no-create', action='store_true',
+                            help='Skip records for groups that do not exist instead of creating them')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or ('csv' if options['path'].endswith('.csv') else 'jsonl')
+        started = time.perf_counter()
+        totals = {'records': 0, 'added': 0, 'skipped': 0, 'groups_created': 0}
+        touched = {}
+
+        try:
+            with open(options['path'], newline='', encoding='utf-8') as f:
+                records = self.read_records(f, file_format)
+                while chunk := list(islice(records, options['chunk_size'])):
+                    self.import_chunk(chunk, options, totals, touched)
+                    self.stdout.write(
+                        f"[IMPORT] {totals['records']} records, {totals['added']} memberships added"
+                    )
+        except OSError as e:
+            raise CommandError(f"Cannot read {options['path']}: {e}")
+
+        # Rooms that grew past the shard threshold switch fan-out mode once, at the end
+        for group in touched.values():
+            update_room_fanout(group)
+
+        totals['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(f'[IMPORT] Done: {json.dumps(totals)}')
+
+    def read_records(self, f, file_format):
+        if file_format == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise CommandError(f'Line {line_number} is not valid JSON')
+
+    def import_chunk(self, chunk, options, totals, touched):
+        totals['records'] += len(chunk)
+        groups = self.resolve_groups(chunk, options, totals)
+
+        usernames = {str(r['username']).lower() for r in chunk if r.get('username')}
+        user_ids = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+
+        pairs = []
+        for record in chunk:
+            group = groups.get(record.get('group'))
+            if record.get('user_id'):
+                user_id = record['user_id']
+            else:
+                user_id = user_ids.get(str(record.get('username', '')).lower())
+            try:
+                user_id = int(user_id)
+            except (TypeError, ValueError):
+                user_id = None
+            if group is None or user_id is None:
+                totals['skipped'] += 1
+                continue
+            pairs.append((group, user_id))
+
+        added, unknown = add_memberships(pairs)
+        totals['skipped'] += sum(1 for _, user_id in pairs if user_id in unknown)
+        by_pk = {group.pk: group for group in groups.values()}
+        for group_pk, new_ids in added.items():
+            totals['added'] += len(new_ids)
+            touched[group_pk] = by_pk[group_pk]
+
+    def resolve_groups(self, chunk, options, totals):
+        """group_name -> ChatGroup for the chunk, creating missing groups in one insert when nobody races us"""
+        names = {r['group'] for r in chunk if r.get('group')}
+        groups = {g.group_name: g for g in ChatGroup.objects.filter(group_name__in=names)}
+        missing = names - groups.keys()
+        if missing and not options['no_create']:
+            first = {}
+            for record in chunk:
+                if record.get('group') in missing:
+                    first.setdefault(record['group'], record)
+            new_groups = [
+                ChatGroup(
+                    group_name=name,
+                    groupchat_name=record.get('groupchat_name') or None,
+                    is_private=str(record.get('is_private', '')).lower() in ('1', 'true', 'yes'),
+                )
+                for name, record in first.items()
+            ]
+            try:
+                # Usually nobody else is creating these groups: one insert, all ours
+                with transaction.atomic():
+                    ChatGroup.objects.bulk_create(new_groups)
+                totals['groups_created'] += len(new_groups)
+            except IntegrityError:
+                # Another writer created some of them first; count only our own
+                for group in new_groups:
+                    _, created = ChatGroup.objects.get_or_create(
+                        group_name=group.group_name,
+                        defaults={'groupchat_name': group.groupchat_name, 'is_private': group.is_private},
+                    )
+                    totals['groups_created'] += created
+            groups.update(ChatGroup.objects.in_bulk(missing, field_name='group_name'))
+        return groups
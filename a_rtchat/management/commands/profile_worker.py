@@ -0,0 +1,86 @@
+import collections
+import json
+import os
+import signal
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from a_core import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Take a sampling profile of a running worker: it samples its own stacks for a while '
+        'and writes them as collapsed stacks (flamegraph.pl / speedscope input)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('pid', type=int, nargs='?',
+                            help='Worker to profile; may be left out when only one is running')
+        parser.add_argument('--list', action='store_true', help='List the workers that can be profiled')
+        parser.add_argument('--seconds', type=float, default=10)
+        parser.add_argument('--interval-ms', type=float, default=5, help='Time between samples')
+        parser.add_argument('--output', help='Collapsed-stack file to write (default: under PROFILING_DIR)')
+        parser.add_argument('--top', type=int, default=15, help='Hottest functions to print')
+
+    def handle(self, *args, **options):
+        if not hasattr(signal, 'SIGUSR2'):
+            raise CommandError('Sampling profiles need SIGUSR2, which this platform lacks')
+
+        workers = profiling.registered_workers()
+        if options['list']:
+            if not workers:
+                self.stdout.write(f'No workers registered under {profiling.profiling_dir()}')
+            for pid, info in sorted(workers.items()):
+                self.stdout.write(f"{pid}  started {info['started']}  {' '.join(info['argv'])}")
+            return
+
+        pid = options['pid']
+        if pid is None:
+            if len(workers) != 1:
+                raise CommandError(f'{len(workers)} workers registered; pass a pid (see --list)')
+            pid = next(iter(workers))
+        elif pid not in workers:
+            raise CommandError(f'Worker {pid} is not running or was started with PROFILING_SAMPLING off')
+
+        output = os.path.abspath(options['output'] or os.path.join(
+            profiling.profiling_dir(), f"profile-{pid}-{time.strftime('%Y%m%d-%H%M%S')}.txt"
+        ))
+        request = {'seconds': options['seconds'], 'interval': options['interval_ms'] / 1000, 'output': output}
+        with open(profiling.request_file(pid), 'w', encoding='utf-8') as f:
+            json.dump(request, f)
+        os.kill(pid, signal.SIGUSR2)
+        self.stdout.write(f'Sampling worker {pid} for {options["seconds"]} s...')
+
+        # Allow for a busy worker handling the signal late and writing the file
+        deadline = time.monotonic() + options['seconds'] + 30
+        while not os.path.exists(output):
+            if time.monotonic() > deadline:
+                raise CommandError(f'Worker {pid} wrote no profile; see its output')
+            time.sleep(0.2)
+
+        self.report(output, options['top'])
+
+    def report(self, output, top):
+        # Samples each function was on top of the stack (self) and anywhere in it (total)
+        own, total = collections.Counter(), collections.Counter()
+        samples = 0
+        with open(output, encoding='utf-8') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                count = int(count)
+                frames = stack.split(';')[1:]
+                samples += count
+                if frames:
+                    own[frames[-1]] += count
+                for frame in set(frames):
+                    total[frame] += count
+
+        if not samples:
+            self.stdout.write(f'No samples in {output}')
+            return
+        self.stdout.write(f'{samples} thread samples written to {output}\n')
+        self.stdout.write(f"{'self %':>7} {'total %':>8}  function")
+        for frame, count in own.most_common(top):
+            self.stdout.write(f'{count / samples:7.1%} {total[frame] / samples:8.1%}  {frame}')
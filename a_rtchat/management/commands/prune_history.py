@@ -0,0 +1,58 @@
+import json
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+
+from a_rtchat.models import ChatGroup
+from a_rtchat.retention import prune_messages, prune_presence, prune_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete messages past each room's retention_days, clean up stale presence "
+        "rows and abandoned uploads, in small chunks. Safe to interrupt and re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room', action='append', dest='rooms',
+                            help='Only prune this group_name (repeatable)')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--pause', type=float, default=0.1,
+                            help='Seconds to sleep between chunks')
+        parser.add_argument('--stale-hours', type=float,
+                            help='Also mark users offline whose presence has not changed for this long')
+        parser.add_argument('--skip-presence', action='store_true')
+        parser.add_argument('--upload-hours', type=float, default=24,
+                            help='Delete unfinished attachment uploads older than this')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only count what would be deleted')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        groups = ChatGroup.objects.filter(retention_days__isnull=False)
+        if options['rooms']:
+            groups = groups.filter(group_name__in=options['rooms'])
+            if not ChatGroup.objects.filter(group_name__in=options['rooms']).exists():
+                raise CommandError('No such room')
+
+        chunking = {
+            'chunk_size': options['chunk_size'],
+            'pause': options['pause'],
+            'dry_run': options['dry_run'],
+        }
+        messages = prune_messages(groups, **chunking)
+        report = {
+            'messages': sum(messages.values()),
+            'rooms': messages,
+        }
+
+        if not options['skip_presence']:
+            stale_after = timedelta(hours=options['stale_hours']) if options['stale_hours'] else None
+            report.update(prune_presence(stale_after, **chunking))
+
+        report['uploads'] = prune_uploads(timedelta(hours=options['upload_hours']), **chunking)
+
+        report['dry_run'] = options['dry_run']
+        report['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(f'[RETENTION] Done: {json.dumps(report)}')
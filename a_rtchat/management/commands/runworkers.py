@@ -0,0 +1,114 @@
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Run several daphne workers on one port, linked by the Unix socket channel layer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+        parser.add_argument('-b', '--bind', default='0.0.0.0')
+        parser.add_argument('-p', '--port', type=int, default=int(os.environ.get('PORT', 8000)))
+        parser.add_argument('--socket-dir', help='Directory for the workers\' IPC sockets')
+        parser.add_argument('--backlog', type=int, default=1024)
+        parser.add_argument('--no-restart', action='store_true',
+                            help='Exit when a worker dies instead of restarting it')
+        parser.add_argument('daphne_args', nargs='*',
+                            help='Extra daphne arguments, after a "--"')
+
+    def handle(self, *args, **options):
+        socket_dir = options['socket_dir'] or tempfile.mkdtemp(prefix='chat-ipc-')
+        os.makedirs(socket_dir, exist_ok=True)
+
+        env = dict(os.environ, CHANNEL_LAYER_BACKEND='ipc', CHAT_IPC_DIR=socket_dir)
+        self.listeners = self.open_listeners(options)
+        self.workers = {}
+        self.stopping = False
+
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGTERM, self.stop)
+
+        for index in range(options['workers']):
+            self.spawn(index, env, options)
+        print(f"[WORKERS] {options['workers']} workers on {options['bind']}:{options['port']}, IPC in {socket_dir}")
+
+        try:
+            self.supervise(env, options)
+        finally:
+            for listener in set(self.listeners):
+                listener.close()
+            if not options['socket_dir']:
+                shutil.rmtree(socket_dir, ignore_errors=True)
+
+    def open_listeners(self, options):
+        """
+        One SO_REUSEPORT socket per worker so the kernel balances accepts;
+        without SO_REUSEPORT every worker shares a single inherited socket.
+        """
+        count = options['workers']
+        reuseport = hasattr(socket, 'SO_REUSEPORT')
+        listeners = []
+        for _ in range(count if reuseport else 1):
+            listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if reuseport:
+                listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            try:
+                listener.bind((options['bind'], options['port']))
+            except OSError as e:
+                raise CommandError(f"Cannot bind {options['bind']}:{options['port']}: {e}")
+            listener.listen(options['backlog'])
+            listener.set_inheritable(True)
+            listeners.append(listener)
+        return listeners * count if not reuseport else listeners
+
+    def spawn(self, index, env, options):
+        fd = self.listeners[index].fileno()
+        command = [
+            sys.executable, '-m', 'daphne',
+            '--fd', str(fd),
+            *options['daphne_args'],
+            'a_core.asgi:application',
+        ]
+        process = subprocess.Popen(command, env=env, pass_fds=(fd,))
+        self.workers[process.pid] = (index, process)
+        print(f"[WORKERS] Worker {index} started (pid {process.pid})")
+
+    def supervise(self, env, options):
+        while self.workers and not self.stopping:
+            time.sleep(0.5)
+            for pid, (index, process) in list(self.workers.items()):
+                code = process.poll()
+                if code is None:
+                    continue
+                del self.workers[pid]
+                print(f"[WORKERS] Worker {index} (pid {pid}) exited with {code}")
+                if self.stopping:
+                    continue
+                if options['no_restart']:
+                    self.stop()
+                else:
+                    self.spawn(index, env, options)
+        self.terminate()
+
+    def stop(self, *args):
+        self.stopping = True
+
+    def terminate(self, timeout=10):
+        for _, process in self.workers.values():
+            process.terminate()
+        deadline = time.monotonic() + timeout
+        for _, process in self.workers.values():
+            try:
+                process.wait(max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.workers = {}
@@ -0,0 +1,38 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+
+from a_rtchat.seeding import seed
+
+
+class Command(BaseCommand):
+    help = 'Generate synthetic users, groups, DMs and message history with bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--groups', type=int, default=50)
+        parser.add_argument('--dms', type=int, default=500)
+        parser.add_argument('--messages', type=int, default=50000)
+        parser.add_argument('--days', type=int, default=30,
+                            help='Spread message timestamps over this many days')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed',
+                            help='Username prefix; use a new one to add to existing data')
+        parser.add_argument('--seed', type=int, help='Random seed for a reproducible dataset')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        counts = seed(
+            users=options['users'],
+            groups=options['groups'],
+            dms=options['dms'],
+            messages=options['messages'],
+            days=max(1, options['days']),
+            chunk_size=options['chunk_size'],
+            prefix=options['prefix'],
+            random_seed=options['seed'],
+            log=self.stdout.write,
+        )
+        counts['seconds'] = round(time.perf_counter() - started, 2)
+        self.stdout.write(f'[SEED] Done: {json.dumps(counts)}')
@@ -0,0 +1,100 @@
+"""
+Bulk group membership.
+
+Memberships are inserted straight into the members through table: one query
+validates the user ids, one finds the memberships that already exist and one
+bulk insert adds the rest, however many users are added. m2m_changed is sent
+per group exactly as ``members.add()`` would, so signal receivers still see
+every new member.
+"""
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed
+
+from .models import ChatGroup
+
+Membership = ChatGroup.members.through
+
+
+def parse_ids(values):
+    """Split raw ids into ints and the values that are not ids at all"""
+    ids, invalid = [], []
+    for value in values:
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            invalid.append(value)
+    return ids, invalid
+
+
+def add_members(group, user_ids):
+    """
+    Add users to one group by id. Returns (added_ids, invalid_ids), where
+    invalid ids are the ones that are malformed or match no user.
+    """
+    ids, invalid = parse_ids(user_ids)
+    added, unknown = add_memberships([(group, user_id) for user_id in ids])
+    return added.get(group.pk, []), invalid + sorted(unknown)
+
+
+def add_memberships(pairs, batch_size=1000):
+    """
+    Add (group, user_id) pairs across any number of groups in three queries.
+    Returns ({group_pk: [newly added user ids]}, unknown user ids).
+    """
+    groups = {}
+    wanted = {}
+    for group, user_id in pairs:
+        groups[group.pk] = group
+        wanted.setdefault(group.pk, set()).add(user_id)
+    if not wanted:
+        return {}, set()
+
+    all_ids = set().union(*wanted.values())
+    valid = set(User.objects.filter(id__in=all_ids).values_list('id', flat=True))
+
+    existing = set(
+        Membership.objects.filter(chatgroup_id__in=wanted, user_id__in=valid)
+        .values_list('chatgroup_id', 'user_id')
+    )
+
+    new = {}
+    for group_pk, user_ids in wanted.items():
+        new_ids = sorted(
+            user_id for user_id in user_ids
+            if user_id in valid and (group_pk, user_id) not in existing
+        )
+        if new_ids:
+            new[group_pk] = new_ids
+    unknown = all_ids - valid
+    if not new:
+        return {}, unknown
+
+    with transaction.atomic():
+        for group_pk, new_ids in new.items():
+            _send_changed('pre_add', groups[group_pk], new_ids)
+        Membership.objects.bulk_create(
+            [
+                Membership(chatgroup_id=group_pk, user_id=user_id)
+                for group_pk, new_ids in new.items()
+                for user_id in new_ids
+            ],
+            batch_size=batch_size,
+            ignore_conflicts=True,
+        )
+        for group_pk, new_ids in new.items():
+            _send_changed('post_add', groups[group_pk], new_ids)
+
+    return new, unknown
+
+
+def _send_changed(action, group, user_ids):
+    m2m_changed.send(
+        sender=Membership,
+        action=action,
+        instance=group,
+        reverse=False,
+        model=User,
+        pk_set=set(user_ids),
+        using=Membership.objects.db,
+    )
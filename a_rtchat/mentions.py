@@ -0,0 +1,252 @@
+"""
+@mentions, resolved against an in-memory trie of each room's members.
+
+Each worker keeps a trie of member usernames for every room that has a
+socket open on it. Usernames are lowercase, as a_users stores them.
+Finding the mentions in a message is one walk over its characters, with no
+query on the send path. The longest username wins, so "@ann.lee" is not
+read as "@ann". A room's trie is loaded when its first socket on the worker
+opens it and dropped with the last one; sockets that open the room while
+it loads wait for that same load.
+
+Tries stay current through m2m_changed. Every membership change is
+broadcast to the room as a ``members_changed`` event, and each worker with
+the room open applies it to its own trie. A renamed user's rooms get a
+``reload`` event, so the new name is matched and the old one is not.
+
+A mention is sent to the mentioned users' own groups
+(notifications.user_group), so only their sockets receive it, whatever room
+or page they have open.
+"""
+import asyncio
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, pre_save
+from django.dispatch import receiver
+
+from . import fanout
+from .models import ChatGroup
+from .notifications import user_group
+
+Membership = ChatGroup.members.through
+# Key of the user id in a trie node; never a character
+END = ''
+
+
+def max_mentions():
+    return getattr(settings, 'CHAT_MAX_MENTIONS', 20)
+
+
+def is_name_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class MemberTrie:
+    """Usernames of one room's members, for longest-match lookups"""
+
+    def __init__(self):
+        self.root = {}
+        self.sessions = set()
+        self.loading = None
+        self.reloading = None
+
+    def add(self, user_id, username):
+        node = self.root
+        for ch in username.lower():
+            node = node.setdefault(ch, {})
+        node[END] = user_id
+
+    def remove(self, user_id, username):
+        path = []
+        node = self.root
+        for ch in username.lower():
+            if ch not in node:
+                return
+            path.append((node, ch))
+            node = node[ch]
+        if node.get(END) != user_id:
+            return
+        del node[END]
+        # Prune the branch back to the last node something else still uses
+        for parent, ch in reversed(path):
+            if parent[ch]:
+                break
+            del parent[ch]
+
+    def match(self, text, start):
+        """(user_id, end) of the longest username at text[start:] that ends a word, or None"""
+        node = self.root
+        found = None
+        for i in range(start, len(text)):
+            node = node.get(text[i])
+            if node is None:
+                break
+            if END in node and (i + 1 == len(text) or not is_name_char(text[i + 1])):
+                found = (node[END], i + 1)
+        return found
+
+
+# room id -> MemberTrie, for rooms with a socket open on this worker
+_rooms = {}
+
+
+def find_mentions(room_id, body):
+    """Ids of the room members ``body`` mentions, in order, at most CHAT_MAX_MENTIONS"""
+    trie = _rooms.get(room_id)
+    if trie is None:
+        return []
+    text = body.lower()
+    found = []
+    at = text.find('@')
+    while at != -1 and len(found) < max_mentions():
+        # "me@example" is an address, not a mention
+        if at == 0 or not is_name_char(text[at - 1]):
+            hit = trie.match(text, at + 1)
+            if hit is not None:
+                if hit[0] not in found:
+                    found.append(hit[0])
+                at = text.find('@', hit[1])
+                continue
+        at = text.find('@', at + 1)
+    return found
+
+
+async def open_room(session):
+    room_id = session.chat_group.id
+    trie = _rooms.get(room_id)
+    if trie is None:
+        trie = _rooms[room_id] = MemberTrie()
+        trie.loading = asyncio.ensure_future(load(room_id, trie))
+    trie.sessions.add(session)
+    # Shielded: one socket giving up must not cancel the load the others wait for
+    await asyncio.shield(trie.loading)
+
+
+async def load(room_id, trie):
+    try:
+        for user_id, username in await room_members(room_id):
+            trie.add(user_id, username)
+    except Exception as e:
+        print(f"[ERROR] Loading members of room {room_id} failed: {e}")
+
+
+def close_room(session):
+    trie = _rooms.get(session.chat_group.id)
+    if trie is None:
+        return
+    trie.sessions.discard(session)
+    if not trie.sessions:
+        del _rooms[session.chat_group.id]
+
+
+def apply(room_id, event):
+    """Apply a members_changed event to this worker's trie of the room"""
+    trie = _rooms.get(room_id)
+    if trie is None:
+        return
+    if event['op'] == 'add':
+        for user_id, username in event['users']:
+            trie.add(user_id, username)
+    elif event['op'] == 'remove':
+        for user_id, username in event['users']:
+            trie.remove(user_id, username)
+    elif trie.reloading is None:
+        # Every socket in the room gets the event; one reload is enough
+        trie.reloading = asyncio.create_task(reload(room_id, trie))
+
+
+async def reload(room_id, trie):
+    try:
+        members = await room_members(room_id)
+        trie.root = {}
+        for user_id, username in members:
+            trie.add(user_id, username)
+    except Exception as e:
+        print(f"[ERROR] Reloading members of room {room_id} failed: {e}")
+    finally:
+        trie.reloading = None
+
+
+@database_sync_to_async
+def room_members(room_id):
+    return list(
+        Membership.objects.filter(chatgroup_id=room_id).values_list('user_id', 'user__username')
+    )
+
+
+async def deliver(session, message, user_ids):
+    """Send a mention to each mentioned user's own sockets"""
+    event = {
+        'type': 'mention',
+        'room': session.chatroom_name,
+        'title': session.chat_group.groupchat_name or '',
+        'is_private': session.chat_group.is_private,
+        'message_id': message.id,
+        'author': session.user.username,
+        'preview': message.body[:100],
+    }
+    await asyncio.gather(
+        *(session.channel_layer.group_send(user_group(user_id), event) for user_id in user_ids),
+        return_exceptions=True,
+    )
+    print(f"[MENTION] '{session.user.username}' mentioned {len(user_ids)} users in '{session.chatroom_name}'")
+
+
+@receiver(m2m_changed, sender=Membership)
+def members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    """Tell every worker with the room open to update its trie"""
+    if action == 'pre_clear' and reverse:
+        # user.chat_groups.clear(): after it there is no telling which rooms it left
+        instance._cleared_rooms = list(instance.chat_groups.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    if action == 'post_clear':
+        op, users = 'reload', []
+        room_ids = getattr(instance, '_cleared_rooms', []) if reverse else [instance.pk]
+    else:
+        op = 'add' if action == 'post_add' else 'remove'
+        user_ids = [instance.pk] if reverse else pk_set
+        users = [list(row) for row in User.objects.filter(pk__in=user_ids).values_list('id', 'username')]
+        room_ids = pk_set if reverse else [instance.pk]
+
+    if reverse:
+        rooms = list(ChatGroup.objects.filter(pk__in=room_ids).values_list('group_name', 'fanout_shards'))
+    else:
+        rooms = [(instance.group_name, instance.fanout_shards)]
+    event = {'type': 'members_changed', 'op': op, 'users': users}
+    transaction.on_commit(lambda: async_to_sync(announce)(rooms, event))
+
+
+@receiver(pre_save, sender=User)
+def remember_username(sender, instance, update_fields=None, **kwargs):
+    if instance.pk is None or (update_fields is not None and 'username' not in update_fields):
+        return
+    instance._previous_username = User.objects.filter(pk=instance.pk).values_list('username', flat=True).first()
+
+
+@receiver(post_save, sender=User)
+def username_changed(sender, instance, created, **kwargs):
+    """Reload the tries of a renamed user's rooms, which still hold the old name"""
+    previous = instance.__dict__.pop('_previous_username', None)
+    if created or previous is None or previous == instance.username:
+        return
+    rooms = list(instance.chat_groups.values_list('group_name', 'fanout_shards'))
+    if not rooms:
+        return
+    event = {'type': 'members_changed', 'op': 'reload', 'users': []}
+    transaction.on_commit(lambda: async_to_sync(announce)(rooms, event))
+
+
+async def announce(rooms, event):
+    channel_layer = get_channel_layer()
+    await asyncio.gather(
+        *(fanout.broadcast(channel_layer, room_name, shards, event) for room_name, shards in rooms),
+        return_exceptions=True,
+    )
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0007_alter_chatgroup_group_name_useronlinestatus'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatgroup',
+            name='fanout_shards',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+    ]
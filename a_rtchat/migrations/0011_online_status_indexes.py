@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0010_groupmessage_edit_delete'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='useronlinestatus',
+            index=models.Index(condition=models.Q(('is_online', True)), fields=['current_chatroom', 'user'], name='online_status_room_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='useronlinestatus',
+            index=models.Index(fields=['-is_online', '-last_activity', '-id'], name='online_status_recent_idx'),
+        ),
+    ]
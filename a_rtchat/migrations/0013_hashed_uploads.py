@@ -0,0 +1,19 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:17
+
+import a_core.media
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0012_retention'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='chatgroup',
+            name='group_icon',
+            field=models.ImageField(blank=True, null=True, upload_to=a_core.media.HashedUploadTo('group_icons', 'group_icon')),
+        ),
+    ]
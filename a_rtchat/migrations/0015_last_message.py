@@ -0,0 +1,55 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:24
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_last_messages(apps, schema_editor):
+    from a_rtchat.inbox import preview_for
+
+    ChatGroup = apps.get_model('a_rtchat', 'ChatGroup')
+    GroupMessage = apps.get_model('a_rtchat', 'GroupMessage')
+    for room in ChatGroup.objects.only('pk', 'created_at').iterator(chunk_size=2000):
+        message = GroupMessage.objects.filter(group_id=room.pk).order_by('-created', '-pk').first()
+        if message is not None:
+            room.last_message = message
+            room.last_message_preview = preview_for(message)
+            room.last_activity = message.created
+        elif room.created_at:
+            room.last_activity = room.created_at
+        else:
+            continue
+        room.save(update_fields=['last_message', 'last_message_preview', 'last_activity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0014_attachment'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatgroup',
+            name='last_activity',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='last_message',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='a_rtchat.groupmessage'),
+        ),
+        migrations.AddField(
+            model_name='chatgroup',
+            name='last_message_preview',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='chatgroup',
+            index=models.Index(fields=['-last_activity', '-id'], name='chatgroup_activity_idx'),
+        ),
+        migrations.RunPython(backfill_last_messages, migrations.RunPython.noop),
+    ]
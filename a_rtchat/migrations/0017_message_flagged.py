@@ -0,0 +1,24 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:36
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0016_client_id'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='groupmessage',
+            name='flagged',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddIndex(
+            model_name='groupmessage',
+            index=models.Index(condition=models.Q(('flagged', True)), fields=['created'], name='message_flagged_idx'),
+        ),
+    ]
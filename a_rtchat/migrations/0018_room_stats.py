@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_rtchat', '0017_message_flagged'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomStat',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resolution', models.CharField(choices=[('minute', 'Minute'), ('hour', 'Hour'), ('day', 'Day')], max_length=6)),
+                ('start', models.DateTimeField()),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('active_users', models.PositiveIntegerField(default=0)),
+                ('active_sketch', models.BinaryField(default=bytes)),
+                ('peak_online', models.PositiveIntegerField(default=0)),
+                ('group', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='a_rtchat.chatgroup')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['resolution', 'start'], name='roomstat_resolution_start_idx')],
+                'constraints': [models.UniqueConstraint(fields=('group', 'resolution', 'start'), name='unique_room_stat')],
+            },
+        ),
+    ]
@@ -3,17 +3,34 @@ from django.contrib.auth.models import User
 from django.utils import timezone
 from PIL import Image
 import shortuuid
+from django_cleanup import cleanup
+from a_core.media import HashedUploadTo
 
 class ChatGroup(models.Model):
     group_name = models.CharField(max_length=128, unique=True, default=shortuuid.uuid)
     groupchat_name = models.CharField(max_length=128, null=True, blank=True)
     description = models.TextField(max_length=500, null=True, blank=True)
-    group_icon = models.ImageField(upload_to='group_icons/', null=True, blank=True)
+    group_icon = models.ImageField(upload_to=HashedUploadTo('group_icons', 'group_icon'), null=True, blank=True)
     admin = models.ForeignKey(User, related_name='groupchats', blank=True, null=True, on_delete=models.SET_NULL)
     users_online = models.ManyToManyField(User, related_name='online_in_groups', blank=True)
     members = models.ManyToManyField(User, related_name='chat_groups', blank=True)
     is_private = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True, null=True, blank=True)
+    # Number of channel-layer sub-groups broadcasts are split across (0 = one group)
+    fanout_shards = models.PositiveSmallIntegerField(default=0, editable=False)
+    # Messages older than this many days are removed by prune_history (empty = keep forever)
+    retention_days = models.PositiveIntegerField(null=True, blank=True)
+    # Denormalized newest message for the inbox, kept up to date by a_rtchat.inbox;
+    # last_activity is its time, or when the room was created if it has none
+    last_message = models.ForeignKey('GroupMessage', null=True, blank=True, on_delete=models.SET_NULL,
+                                     related_name='+', editable=False)
+    last_message_preview = models.CharField(max_length=100, blank=True, editable=False)
+    last_activity = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-last_activity', '-id'], name='chatgroup_activity_idx'),
+        ]
 
     def __str__(self):
         return self.groupchat_name or self.group_name
@@ -51,12 +68,101 @@ class GroupMessage(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE)
     body = models.CharField(max_length=300)
     created = models.DateTimeField(auto_now_add=True)
+    edited_at = models.DateTimeField(null=True, blank=True)
+    is_deleted = models.BooleanField(default=False)
+    # Bumped on every edit/delete so clients can drop stale patches
+    version = models.PositiveIntegerField(default=1)
+    # Id the sending client generated, so a resent message is stored once (see a_rtchat.dedup)
+    client_id = models.CharField(max_length=64, null=True, blank=True, editable=False)
+    # Matched a "flag" moderation term; waiting for a moderator
+    flagged = models.BooleanField(default=False)
 
     def __str__(self):
         return f'{self.author.username} : {self.body}'
 
+    def can_edit(self, user):
+        return not self.is_deleted and self.author_id == user.id
+
+    def can_delete(self, user):
+        return not self.is_deleted and (self.author_id == user.id or self.group.admin_id == user.id)
+
     class Meta:
         ordering = ['-created']
+        indexes = [
+            models.Index(fields=['group', 'created'], name='message_group_created_idx'),
+            # The moderation queue: only flagged rows are indexed
+            models.Index(fields=['created'], condition=models.Q(flagged=True), name='message_flagged_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['author', 'client_id'],
+                condition=models.Q(client_id__isnull=False),
+                name='unique_client_message',
+            ),
+        ]
+
+
+# Identical uploads share one stored file, so django_cleanup must not delete
+# it with the first of them; attachments.release_file does it with the last
+@cleanup.ignore
+class Attachment(models.Model):
+    """A file uploaded over the chat socket; becomes a message once complete"""
+    upload_id = models.CharField(max_length=32, unique=True, default=shortuuid.uuid)
+    uploader = models.ForeignKey(User, on_delete=models.CASCADE, related_name='attachments')
+    group = models.ForeignKey(ChatGroup, on_delete=models.CASCADE, related_name='attachments')
+    message = models.OneToOneField(GroupMessage, on_delete=models.CASCADE, null=True, blank=True, related_name='attachment')
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=100, blank=True)
+    size = models.BigIntegerField()
+    file = models.FileField(upload_to='attachments/', blank=True)
+    sha256 = models.CharField(max_length=64, blank=True)
+    is_complete = models.BooleanField(default=False)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.filename} ({self.size} bytes) by {self.uploader.username}'
+
+
+class ReadMarker(models.Model):
+    """Latest message a user has seen in a group, flushed in batches"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='read_markers')
+    group = models.ForeignKey(ChatGroup, on_delete=models.CASCADE, related_name='read_markers')
+    last_read_message = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'group'], name='unique_read_marker'),
+        ]
+
+    def __str__(self):
+        return f'{self.user.username} read {self.group} up to {self.last_read_message}'
+
+
+class RoomStat(models.Model):
+    """A room's activity over one minute, hour or day, rolled up by a_rtchat.analytics"""
+    MINUTE, HOUR, DAY = 'minute', 'hour', 'day'
+    RESOLUTIONS = [(MINUTE, 'Minute'), (HOUR, 'Hour'), (DAY, 'Day')]
+
+    group = models.ForeignKey(ChatGroup, on_delete=models.CASCADE, related_name='stats')
+    resolution = models.CharField(max_length=6, choices=RESOLUTIONS)
+    start = models.DateTimeField()
+    messages = models.PositiveIntegerField(default=0)
+    # Distinct authors: estimated from the sketch, which is what merges
+    active_users = models.PositiveIntegerField(default=0)
+    active_sketch = models.BinaryField(default=bytes)
+    peak_online = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['group', 'resolution', 'start'], name='unique_room_stat'),
+        ]
+        indexes = [
+            models.Index(fields=['resolution', 'start'], name='roomstat_resolution_start_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.group} {self.resolution} {self.start:%Y-%m-%d %H:%M}'
 
 
 class UserOnlineStatus(models.Model):
@@ -70,6 +176,17 @@ class UserOnlineStatus(models.Model):
     class Meta:
         verbose_name = "User Online Status"
         verbose_name_plural = "User Online Statuses"
+        indexes = [
+            # Only online rows are indexed, so per-room counts and room drill-downs
+            # stay proportional to who is online rather than to all users
+            models.Index(
+                fields=['current_chatroom', 'user'],
+                condition=models.Q(is_online=True),
+                name='online_status_room_idx',
+            ),
+            # Keyset order for the tracker's all-users list
+            models.Index(fields=['-is_online', '-last_activity', '-id'], name='online_status_recent_idx'),
+        ]
     
     def __str__(self):
         return f"{self.user.username} - {'Online' if self.is_online else 'Offline'}"
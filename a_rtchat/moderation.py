@@ -0,0 +1,218 @@
+"""
+Moderation of message bodies against a term list.
+
+CHAT_MODERATION_TERMS_FILE holds one term per line, after its action:
+
+    block some phrase
+    mask darn
+    flag buy now
+
+``block`` refuses the message, ``mask`` stars the term out, and ``flag``
+stores the message with ``flagged`` set for moderators to review. Blank
+lines and lines starting with # are ignored. Terms match case-insensitively
+and only as whole words.
+
+The list is compiled once into an Aho-Corasick automaton. A body is then
+scanned in a single pass however many terms there are, rather than one
+substring search per term. The file's mtime is checked at most every
+CHAT_MODERATION_RELOAD_SECONDS, and a changed list is recompiled in a
+thread and swapped in without a restart.
+"""
+import asyncio
+import os
+import re
+import time
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+# Weakest first: a message gets the strongest action any of its terms calls for
+ACTIONS = ('mask', 'flag', 'block')
+# Whitespace other than single spaces, which "some  phrase" could hide behind
+UNUSUAL_SPACE = re.compile(r'\s{2,}|[^\S ]')
+
+
+def terms_file():
+    return str(getattr(settings, 'CHAT_MODERATION_TERMS_FILE', ''))
+
+
+def reload_seconds():
+    return getattr(settings, 'CHAT_MODERATION_RELOAD_SECONDS', 5)
+
+
+def normalize(term):
+    return ' '.join(term.lower().split())
+
+
+def lowercase(text):
+    """text.lower(), but never changing the length, so offsets still point into text"""
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+def collapse_spaces(text):
+    """text with every whitespace run as one space, and where each character came from"""
+    chars, positions = [], []
+    in_space = False
+    for i, ch in enumerate(text):
+        if ch.isspace():
+            if in_space:
+                continue
+            ch, in_space = ' ', True
+        else:
+            in_space = False
+        chars.append(ch)
+        positions.append(i)
+    return ''.join(chars), positions
+
+
+def is_word_boundary(text, start, end):
+    return (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum())
+
+
+class Matcher:
+    """Aho-Corasick automaton over (term, action) pairs"""
+
+    def __init__(self, terms):
+        # Per state: transitions, failure link, and (length, action) of every
+        # term ending there, including those reached through failure links
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        self.size = 0
+
+        for term, action in terms:
+            term = normalize(term)
+            if not term:
+                continue
+            state = 0
+            for ch in term:
+                next_state = self.goto[state].get(ch)
+                if next_state is None:
+                    next_state = self.goto[state][ch] = len(self.goto)
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                state = next_state
+            self.out[state] += ((len(term), action),)
+            self.size += 1
+
+        # Failure links, breadth first so shorter suffixes are done first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and ch not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[next_state] = self.goto[fallback].get(ch, 0)
+                self.out[next_state] += self.out[self.fail[next_state]]
+
+    def find(self, text):
+        """(start, end, action) of every whole-word term in text"""
+        goto, fail, out = self.goto, self.fail, self.out
+        lowered = lowercase(text)
+        positions = None
+        if UNUSUAL_SPACE.search(lowered):
+            lowered, positions = collapse_spaces(lowered)
+        state = 0
+        for i, ch in enumerate(lowered):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, action in out[state]:
+                start = i + 1 - length
+                if not is_word_boundary(lowered, start, i + 1):
+                    continue
+                if positions is None:
+                    yield start, i + 1, action
+                else:
+                    yield positions[start], positions[i] + 1, action
+
+
+def load_terms(path):
+    """(term, action) pairs from a terms file"""
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            action, _, term = line.partition(' ')
+            if action not in ACTIONS or not term.strip():
+                print(f"[WARNING] {path}:{number}: expected '<{'|'.join(ACTIONS)}> <term>'")
+                continue
+            yield term, action
+
+
+_matcher = None
+_loaded_mtime = None
+_checked_at = 0
+_reload_task = None
+
+
+def reload(force=False):
+    """Recompile the term list if its file changed since it was loaded. Returns whether it did."""
+    global _matcher, _loaded_mtime
+    path = terms_file()
+    try:
+        mtime = os.stat(path).st_mtime_ns if path else None
+    except OSError:
+        mtime = None
+    if _matcher is not None and mtime == _loaded_mtime and not force:
+        return False
+
+    started = time.perf_counter()
+    matcher = Matcher(load_terms(path) if mtime is not None else ())
+    # Swapping the reference is atomic; scans in flight finish on the old automaton
+    _matcher, _loaded_mtime = matcher, mtime
+    print(f"[MODERATION] {matcher.size} terms compiled in {(time.perf_counter() - started) * 1000:.0f} ms")
+    return True
+
+
+def current():
+    if _matcher is None:
+        reload()
+    return _matcher
+
+
+def screen(body):
+    """(action, body): the strongest action the body's terms call for (None if clean) and the body to store"""
+    hits = list(current().find(body))
+    if not hits:
+        return None, body
+
+    action = max((hit[2] for hit in hits), key=ACTIONS.index)
+    if action == 'block':
+        return action, body
+    chars = list(body)
+    for start, end, hit_action in hits:
+        if hit_action == 'mask':
+            chars[start:end] = '*' * (end - start)
+    return action, ''.join(chars)
+
+
+async def ascreen(body):
+    """screen() for the consumer: the file is rechecked in the background now and then"""
+    global _checked_at, _reload_task
+    if _matcher is None:
+        # Nothing may pass unscreened, so the first load is waited for
+        await sync_to_async(reload, thread_sensitive=False)()
+        _checked_at = time.monotonic()
+    elif time.monotonic() - _checked_at >= reload_seconds() and _reload_task is None:
+        _checked_at = time.monotonic()
+        _reload_task = asyncio.create_task(_reload_in_background())
+    return screen(body)
+
+
+async def _reload_in_background():
+    global _reload_task
+    try:
+        await sync_to_async(reload, thread_sensitive=False)()
+    except Exception as e:
+        print(f"[ERROR] Reloading moderation terms failed: {e}")
+    finally:
+        _reload_task = None
@@ -0,0 +1,117 @@
+"""
+Cross-room notifications over per-user groups.
+
+Every authenticated socket, whether a chat room or the lightweight
+notification socket on other pages, also joins ``user_<id>``. When a
+message is persisted, its room is marked pending. At most once per
+CHAT_NOTIFY_INTERVAL per room, one small ``notify`` event (room, count of
+new messages, latest preview) goes to the members who are not currently in
+that room. Nobody subscribes to rooms they are not looking at, and a burst
+of messages costs one event per recipient, not one per message. Rooms with
+more than CHAT_NOTIFY_MAX_RECIPIENTS such members (big public rooms) are
+not notified.
+"""
+import asyncio
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .models import ChatGroup
+
+Membership = ChatGroup.members.through
+UsersOnline = ChatGroup.users_online.through
+
+
+def notify_interval():
+    return getattr(settings, 'CHAT_NOTIFY_INTERVAL', 1.0)
+
+
+def max_recipients():
+    return getattr(settings, 'CHAT_NOTIFY_MAX_RECIPIENTS', 500)
+
+
+def user_group(user_id):
+    return f'user_{user_id}'
+
+
+async def join(consumer):
+    await consumer.channel_layer.group_add(user_group(consumer.user.id), consumer.channel_name)
+
+
+async def leave(consumer):
+    await consumer.channel_layer.group_discard(user_group(consumer.user.id), consumer.channel_name)
+
+
+class PendingRoom:
+    """New messages in one room waiting for the next notification"""
+
+    def __init__(self, chat_group, channel_layer):
+        self.room_id = chat_group.id
+        self.room_name = chat_group.group_name
+        self.title = chat_group.groupchat_name or ''
+        self.is_private = chat_group.is_private
+        self.channel_layer = channel_layer
+        self.count = 0
+        self.authors = set()
+        self.last = None
+
+    def add(self, message, username):
+        self.count += 1
+        self.authors.add(message.author_id)
+        self.last = {'message_id': message.id, 'author': username, 'preview': message.body[:100]}
+
+    async def flush(self):
+        await asyncio.sleep(notify_interval())
+        _pending.pop(self.room_id, None)
+        try:
+            recipients = await recipients_for(self.room_id, self.authors)
+        except Exception as e:
+            print(f"[ERROR] Notification lookup failed for '{self.room_name}': {e}")
+            return
+        if recipients is None:
+            return
+
+        event = {
+            'type': 'notify',
+            'room': self.room_name,
+            'title': self.title,
+            'is_private': self.is_private,
+            'count': self.count,
+            **self.last,
+        }
+        await asyncio.gather(
+            *(self.channel_layer.group_send(user_group(user_id), event) for user_id in recipients),
+            return_exceptions=True,
+        )
+        print(f"[NOTIFY] {self.count} new in '{self.room_name}' -> {len(recipients)} users")
+
+
+_pending = {}
+# The event loop holds tasks weakly; keep flushes alive until they finish
+_flush_tasks = set()
+
+
+def message_posted(consumer, message):
+    """Count a persisted message towards its room's next notification"""
+    pending = _pending.get(consumer.chat_group.id)
+    if pending is None:
+        pending = _pending[consumer.chat_group.id] = PendingRoom(consumer.chat_group, consumer.channel_layer)
+        task = asyncio.create_task(pending.flush())
+        _flush_tasks.add(task)
+        task.add_done_callback(_flush_tasks.discard)
+    pending.add(message, consumer.user.username)
+
+
+@database_sync_to_async
+def recipients_for(room_id, authors):
+    """Members not in the room right now (nor the authors), or None if there are too many"""
+    limit = max_recipients()
+    user_ids = list(
+        Membership.objects.filter(chatgroup_id=room_id)
+        .exclude(user_id__in=UsersOnline.objects.filter(chatgroup_id=room_id).values('user_id'))
+        .exclude(user_id__in=authors)
+        .values_list('user_id', flat=True)[:limit + 1]
+    )
+    if len(user_ids) > limit:
+        return None
+    return user_ids
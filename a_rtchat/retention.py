@@ -0,0 +1,114 @@
+"""
+Message retention and presence cleanup.
+
+Everything is deleted in chunks of at most ``chunk_size`` primary keys, each
+in its own short transaction, with a pause in between so other writers get
+the table back. There is no progress state to lose: an interrupted run has
+simply deleted fewer rows, and the next run picks up whatever is still
+past the cutoff.
+"""
+import os
+import time
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .attachments import partial_path
+from .models import Attachment, ChatGroup, GroupMessage, UserOnlineStatus
+
+UsersOnline = ChatGroup.users_online.through
+
+
+def delete_in_chunks(queryset, chunk_size=1000, pause=0.1, dry_run=False):
+    """Delete the rows of a queryset a chunk of primary keys at a time. Returns the row count."""
+    if dry_run:
+        return queryset.count()
+
+    model = queryset.model
+    total = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:chunk_size])
+        if not pks:
+            return total
+        model.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+        if len(pks) < chunk_size:
+            return total
+        time.sleep(pause)
+
+
+def expired_messages(group, now=None):
+    """Messages of a group that are past its retention period, oldest first"""
+    cutoff = (now or timezone.now()) - timedelta(days=group.retention_days)
+    # Walks the (group, created) index from the oldest row
+    return GroupMessage.objects.filter(group=group, created__lt=cutoff).order_by('created', 'pk')
+
+
+def prune_messages(groups=None, chunk_size=1000, pause=0.1, dry_run=False):
+    """Apply every room's retention policy. Returns {group_name: messages deleted}."""
+    if groups is None:
+        groups = ChatGroup.objects.filter(retention_days__isnull=False)
+    now = timezone.now()
+    reclaimed = {}
+    for group in groups:
+        if not group.retention_days:
+            continue
+        count = delete_in_chunks(expired_messages(group, now), chunk_size, pause, dry_run)
+        if count:
+            reclaimed[group.group_name] = count
+            print(f"[RETENTION] {'Would delete' if dry_run else 'Deleted'} {count} messages from '{group.group_name}'")
+    return reclaimed
+
+
+def prune_presence(stale_after=None, chunk_size=1000, pause=0.1, dry_run=False):
+    """
+    Mark users offline whose status has not moved for ``stale_after`` (a
+    timedelta, skipped when None), then drop users_online rows for users who
+    are not online at all. Returns the row counts.
+    """
+    reclaimed = {'stale_statuses': 0, 'users_online': 0}
+
+    if stale_after is not None:
+        stale = UserOnlineStatus.objects.filter(
+            is_online=True, last_activity__lt=timezone.now() - stale_after
+        )
+        if dry_run:
+            reclaimed['stale_statuses'] = stale.count()
+        else:
+            while pks := list(stale.values_list('pk', flat=True)[:chunk_size]):
+                reclaimed['stale_statuses'] += UserOnlineStatus.objects.filter(pk__in=pks).update(
+                    is_online=False, current_chatroom=None
+                )
+                if len(pks) < chunk_size:
+                    break
+                time.sleep(pause)
+
+    # Left behind when a worker died before its sockets could disconnect
+    orphans = UsersOnline.objects.exclude(user__online_status__is_online=True).order_by('pk')
+    reclaimed['users_online'] = delete_in_chunks(orphans, chunk_size, pause, dry_run)
+    return reclaimed
+
+
+def prune_uploads(abandoned_after, chunk_size=1000, pause=0.1, dry_run=False):
+    """
+    Delete attachment uploads that were never finished and have not been
+    started for ``abandoned_after`` (a timedelta), with their partial files,
+    so they stop counting against their uploader's quota. Returns the row count.
+    """
+    abandoned = Attachment.objects.filter(is_complete=False, created__lt=timezone.now() - abandoned_after)
+    if dry_run:
+        return abandoned.count()
+
+    total = 0
+    while rows := list(abandoned.values_list('pk', 'upload_id')[:chunk_size]):
+        for _, upload_id in rows:
+            try:
+                os.remove(partial_path(upload_id))
+            except OSError:
+                pass
+        Attachment.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+        total += len(rows)
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause)
+    return total
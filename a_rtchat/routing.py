@@ -2,5 +2,7 @@ from django.urls import path
 from . import consumers
 
 websocket_urlpatterns = [
+    path('ws/notifications/', consumers.NotificationConsumer.as_asgi()),
+    path('ws/chat/', consumers.MultiplexChatConsumer.as_asgi()),
     path('ws/chat/<str:chatroom_name>/', consumers.ChatConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,284 @@
+"""
+Synthetic data and bulk history loading.
+
+Everything goes through bulk_create in chunks, which skips the User
+post_save signal in a_users, so the Profile and DirectoryEntry rows that
+signal would have made are created here in bulk too. Sizes and activity
+follow a power law: a few rooms and users are huge or chatty, most are
+small and quiet. Timestamps are spread over a window with a daily rhythm,
+and messages are inserted in time order so primary keys follow
+``created`` as they do in production.
+"""
+import random
+from contextlib import contextmanager
+from datetime import timedelta, timezone as dt_timezone
+from itertools import accumulate, islice
+
+import shortuuid
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from a_users.directory import terms_for
+from a_users.models import DirectoryEntry, Profile
+
+from .fanout import update_room_fanout
+from .inbox import record_last_messages
+from .memberships import add_memberships
+from .models import ChatGroup, GroupMessage
+
+FIRST_NAMES = [
+    'Alex', 'Sam', 'Priya', 'Chen', 'Maria', 'Omar', 'Lena', 'Yuki', 'Tom', 'Aisha',
+    'Jonas', 'Zoë', 'Ravi', 'Nina', 'Pedro', 'Hana', 'Luca', 'Sara', 'Kofi', 'Ines',
+]
+LAST_NAMES = [
+    'Smith', 'Kumar', 'Wang', 'García', 'Haddad', 'Müller', 'Tanaka', 'Okafor', 'Rossi', 'Novak',
+]
+WORDS = (
+    'ok sure thanks lol yes no maybe tomorrow today meeting deploy build fixed broken '
+    'coffee lunch later great nice agreed check this link issue merged review ping '
+    'when where why how what again sorry done wip blocked shipping release weekend'
+).split()
+# Relative traffic per hour of day (UTC), quiet at night, busy in working hours
+HOURLY_WEIGHTS = [1, 1, 1, 1, 1, 2, 3, 5, 8, 10, 10, 9, 8, 9, 10, 10, 9, 8, 7, 6, 5, 4, 3, 2]
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def skewed_index(rng, n, power=3):
+    """Index in range(n) drawn from a power law: low indexes are far more likely"""
+    return int(n * rng.random() ** power)
+
+
+@contextmanager
+def explicit_timestamps(model, *field_names):
+    """Let bulk_create keep the values set on auto_now(_add) fields"""
+    fields = [model._meta.get_field(name) for name in field_names]
+    saved = [(field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, (auto_now, auto_now_add) in zip(fields, saved):
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+def create_users(usernames, displaynames=None, chunk_size=5000, password='seed-password'):
+    """
+    Bulk-create users with their Profile and directory rows. Usernames must
+    already be lowercase (the lowercasing pre_save signal doesn't run here).
+    Returns {username: id}.
+    """
+    # None gives imported users an unusable password
+    password = make_password(password)
+    displaynames = displaynames or {}
+    ids = {}
+    for chunk in chunked(usernames, chunk_size):
+        with transaction.atomic():
+            users = User.objects.bulk_create([User(username=name, password=password) for name in chunk])
+            if users and users[0].pk is None:
+                # Backends without RETURNING on bulk insert
+                users = list(User.objects.filter(username__in=chunk))
+            Profile.objects.bulk_create([
+                Profile(user_id=user.pk, displayname=displaynames.get(user.username)) for user in users
+            ])
+            DirectoryEntry.objects.bulk_create([
+                DirectoryEntry(user_id=user.pk, term=term)
+                for user in users
+                for term in terms_for(user.username, displaynames.get(user.username))
+            ])
+        ids.update((user.username, user.pk) for user in users)
+    return ids
+
+
+def random_timestamp(rng, now, day):
+    """A time ``day`` days ago, following HOURLY_WEIGHTS"""
+    hour = rng.choices(range(24), HOURLY_WEIGHTS)[0]
+    stamp = (now - timedelta(days=day)).replace(hour=hour, minute=0, second=0, microsecond=0)
+    stamp += timedelta(seconds=rng.randrange(3600))
+    if stamp > now:
+        # Later today: anywhere between midnight and now instead
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        stamp = midnight + (now - midnight) * rng.random()
+    return stamp
+
+
+def random_body(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(skewed_index(rng, 40) + 1))[:300]
+
+
+def seed(users=1000, groups=50, dms=500, messages=50000, days=30, chunk_size=5000,
+         prefix='seed', random_seed=None, log=print):
+    """
+    Generate users, public groups, DMs and message history. Returns a dict
+    of row counts. Usernames are ``<prefix>_<n>``; rerun with another prefix
+    to add more data next to an existing set.
+    """
+    rng = random.Random(random_seed)
+    now = timezone.now()
+
+    # Users
+    usernames = [f'{prefix}_{i}' for i in range(users)]
+    displaynames = {
+        name: f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+        for name in usernames if rng.random() < 0.7
+    }
+    user_ids = list(create_users(usernames, displaynames, chunk_size).values())
+    # Activity rank: user_ids[0] is the chattiest user, user_ids[-1] the quietest
+    rng.shuffle(user_ids)
+    log(f'[SEED] {len(user_ids)} users')
+
+    # Rooms: one public chat everybody is in, groups with power-law sizes, DMs
+    public_chat, _ = ChatGroup.objects.get_or_create(
+        group_name='public-chat', defaults={'groupchat_name': 'Public Chat', 'is_private': False}
+    )
+    with explicit_timestamps(ChatGroup, 'created_at'):
+        rooms = ChatGroup.objects.bulk_create(
+            [
+                ChatGroup(
+                    group_name=f'group_{shortuuid.uuid()}',
+                    groupchat_name=f'{rng.choice(WORDS).title()} {rng.choice(WORDS)} {i}',
+                    admin_id=user_ids[i % len(user_ids)],
+                    created_at=now - timedelta(days=days),
+                    last_activity=now - timedelta(days=days),
+                )
+                for i in range(groups)
+            ]
+            + [
+                ChatGroup(
+                    group_name=shortuuid.uuid(),
+                    is_private=True,
+                    created_at=now - timedelta(days=days),
+                    last_activity=now - timedelta(days=days),
+                )
+                for _ in range(dms)
+            ],
+            batch_size=chunk_size,
+        )
+    if rooms and rooms[0].pk is None:
+        saved = ChatGroup.objects.in_bulk([room.group_name for room in rooms], field_name='group_name')
+        rooms = [saved[room.group_name] for room in rooms]
+    group_rooms, dm_rooms = rooms[:groups], rooms[groups:]
+
+    members = {public_chat.pk: list(user_ids)}
+    for position, room in enumerate(group_rooms):
+        size = min(len(user_ids), max(3, int(len(user_ids) * 0.5 / (position + 1) ** 0.9)))
+        members[room.pk] = rng.sample(user_ids, size)
+        if room.admin_id not in members[room.pk]:
+            members[room.pk].append(room.admin_id)
+    for room in dm_rooms:
+        # Chatty users have more DMs
+        a = user_ids[skewed_index(rng, len(user_ids))]
+        b = rng.choice(user_ids)
+        while b == a and len(user_ids) > 1:
+            b = rng.choice(user_ids)
+        members[room.pk] = [a, b]
+
+    by_pk = {room.pk: room for room in rooms}
+    by_pk[public_chat.pk] = public_chat
+    pairs = ((by_pk[pk], user_id) for pk, ids in members.items() for user_id in ids)
+    membership_count = 0
+    for chunk in chunked(pairs, chunk_size):
+        added, _ = add_memberships(chunk)
+        membership_count += sum(len(ids) for ids in added.values())
+    log(f'[SEED] {len(rooms) + 1} rooms, {membership_count} memberships')
+
+    # Messages: rooms get traffic by size, authors by activity rank. One day
+    # is generated at a time, oldest first, so inserts stay in time order
+    # without holding the whole history in memory
+    room_pks = list(members)
+    cum_weights = list(accumulate(len(members[pk]) ** 0.8 for pk in room_pks))
+    rank = {user_id: i for i, user_id in enumerate(user_ids)}
+    member_rank = {pk: sorted(ids, key=rank.__getitem__) for pk, ids in members.items()}
+    message_count = 0
+    for day in range(days - 1, -1, -1):
+        day_count = messages // days + (1 if day < messages % days else 0)
+        pending = []
+        for pk in rng.choices(room_pks, cum_weights=cum_weights, k=day_count):
+            authors = member_rank[pk]
+            pending.append(GroupMessage(
+                group_id=pk,
+                author_id=authors[skewed_index(rng, len(authors))],
+                body=random_body(rng),
+                created=random_timestamp(rng, now, day),
+            ))
+        pending.sort(key=lambda message: message.created)
+        message_count += bulk_create_messages(pending, chunk_size)
+    log(f'[SEED] {message_count} messages')
+
+    for room in [public_chat, *group_rooms]:
+        update_room_fanout(room)
+
+    return {
+        'users': len(user_ids),
+        'rooms': len(rooms) + 1,
+        'memberships': membership_count,
+        'messages': message_count,
+    }
+
+
+def bulk_create_messages(messages, chunk_size=5000):
+    """
+    Insert messages keeping their ``created`` values, moving each room's
+    last message forward once per chunk. Returns the count.
+    """
+    count = 0
+    with explicit_timestamps(GroupMessage, 'created'):
+        for chunk in chunked(messages, chunk_size):
+            with transaction.atomic():
+                GroupMessage.objects.bulk_create(chunk)
+                record_last_messages(chunk)
+            count += len(chunk)
+    return count
+
+
+def import_messages(records, create_users_missing=False, create_rooms_missing=False, chunk_size=5000):
+    """
+    Load one chunk of history records ({"room", "author", "body", "created"})
+    into GroupMessage, adding authors to their rooms as needed. Records for
+    unknown rooms or authors are skipped unless the create flags are set.
+    Returns (imported, skipped, touched rooms).
+    """
+    room_names = {r.get('room') for r in records if r.get('room')}
+    rooms = ChatGroup.objects.in_bulk(room_names, field_name='group_name')
+    missing_rooms = room_names - rooms.keys()
+    if missing_rooms and create_rooms_missing:
+        ChatGroup.objects.bulk_create(
+            [ChatGroup(group_name=name, groupchat_name=name) for name in missing_rooms],
+            ignore_conflicts=True,
+        )
+        rooms.update(ChatGroup.objects.in_bulk(missing_rooms, field_name='group_name'))
+
+    usernames = {str(r.get('author', '')).lower() for r in records if r.get('author')}
+    authors = dict(User.objects.filter(username__in=usernames).values_list('username', 'id'))
+    missing_users = usernames - authors.keys()
+    if missing_users and create_users_missing:
+        authors.update(create_users(sorted(missing_users), chunk_size=chunk_size, password=None))
+
+    now = timezone.now()
+    messages, pairs, skipped = [], set(), 0
+    for record in records:
+        room = rooms.get(record.get('room'))
+        author_id = authors.get(str(record.get('author', '')).lower())
+        body = str(record.get('body') or '').strip()[:300]
+        if room is None or author_id is None or not body:
+            skipped += 1
+            continue
+        created = parse_datetime(str(record.get('created') or '')) or now
+        if timezone.is_naive(created):
+            created = timezone.make_aware(created, dt_timezone.utc)
+        messages.append(GroupMessage(group_id=room.pk, author_id=author_id, body=body, created=created))
+        pairs.add((room, author_id))
+
+    add_memberships(pairs)
+    messages.sort(key=lambda message: message.created)
+    imported = bulk_create_messages(messages, chunk_size)
+    touched = {room.pk: room for room, _ in pairs}
+    return imported, skipped, touched
@@ -14,10 +14,17 @@ urlpatterns = [
     # Group Management
     path('create-group/', create_group, name='create-group'),
     path('group/<str:group_name>/add-members/', add_members, name='add-members'),
+    path('group/<str:group_name>/add-members/search/', add_members_search, name='add-members-search'),
     path('group/<str:group_name>/settings/', group_settings, name='group-settings'),
     path('group/<str:group_name>/leave/', leave_group, name='leave-group'),
+    path('chat/<str:chatroom_name>/export/', export_history, name='export-history'),
     
     # Online Tracker
     path('online-tracker/', online_tracker, name='online-tracker'),
     path('online-tracker/widget/', online_tracker_widget, name='online-tracker-widget'),
+    path('online-tracker/users/', online_tracker_users, name='online-tracker-users'),
+    path('online-tracker/room/<str:chatroom_name>/', online_tracker_room, name='online-tracker-room'),
+
+    # Room analytics (staff)
+    path('analytics/', analytics_dashboard, name='analytics'),
 ]
\ No newline at end of file
@@ -1,10 +1,20 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
-from django.http import HttpResponse, JsonResponse
+from django.http import HttpResponse, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
 from django.contrib import messages
+from django.db.models import Count, Q
+from datetime import datetime
 from .models import ChatGroup, GroupMessage, UserOnlineStatus
 from .forms import ChatmessageCreateForm, GroupChatCreateForm, GroupChatEditForm
+from .fanout import update_room_fanout
+from .inbox import inbox
+from . import analytics
+from .memberships import add_members as add_group_members
+from .export import FORMATS as EXPORT_FORMATS, export_stream
+from a_users.directory import search as search_directory
+from a_core.db_routers import pin_to_primary, read_alias
+from a_core.streaming import stream_body
 import shortuuid
 
 @login_required
@@ -15,27 +25,21 @@ def home_view(request):
         defaults={'groupchat_name': 'Public Chat', 'is_private': False}
     )
     
-    if request.user not in public_chat.members.all():
+    if not public_chat.members.filter(pk=request.user.pk).exists():
         public_chat.members.add(request.user)
+        update_room_fanout(public_chat)
     
-    # Get all users except current user
-    all_users = User.objects.exclude(id=request.user.id)
-    
-    # Get user's DMs
-    user_dms = ChatGroup.objects.filter(
-        members=request.user,
-        is_private=True
-    )
+    # Listings tolerate replica lag; the user is pinned to the primary after joining anything
+    alias = read_alias(request.user)
+
+    # Get user's DMs, most recent first
+    user_dms = inbox(request.user, is_private=True, using=alias).prefetch_related('members__profile')
     
-    # Get user's group chats (not DMs, not public)
-    user_groups = ChatGroup.objects.filter(
-        members=request.user,
-        is_private=False
-    ).exclude(group_name='public-chat')
+    # Get user's group chats (not DMs, not public), most recent first
+    user_groups = inbox(request.user, is_private=False, using=alias).exclude(group_name='public-chat')
     
     context = {
         'public_chat': public_chat,
-        'all_users': all_users,
         'user_dms': user_dms,
         'user_groups': user_groups,
     }
@@ -77,25 +81,46 @@ def add_members(request, group_name):
         return redirect('home')
     
     if request.method == 'POST':
-        selected_users = request.POST.getlist('members')
-        for user_id in selected_users:
-            user = User.objects.get(id=user_id)
-            group.members.add(user)
+        added, invalid = add_group_members(group, request.POST.getlist('members'))
+        if added:
+            update_room_fanout(group)
         
-        messages.success(request, f"{len(selected_users)} members added!")
+        messages.success(request, f"{len(added)} members added!")
+        if invalid:
+            messages.warning(request, f"{len(invalid)} selected users no longer exist and were skipped.")
         return redirect('chatroom', chatroom_name=group.group_name)
     
-    # Get users not in group
-    available_users = User.objects.exclude(id__in=group.members.all()).exclude(id=request.user.id)
-    
+    # Candidates are searched through the user directory, a page at a time
     context = {
         'group': group,
-        'available_users': available_users,
     }
     
     return render(request, 'a_rtchat/add_members.html', context)
 
 
+@login_required
+def add_members_search(request, group_name):
+    """HTMX endpoint: one page of users matching the query who are not members yet"""
+    group = get_object_or_404(ChatGroup, group_name=group_name)
+    if group.admin != request.user:
+        return HttpResponse(status=403)
+    
+    query = request.GET.get('q', '')
+    after = request.GET.get('after', '')
+    users, next_after = search_directory(
+        query,
+        after=int(after) if after.isdigit() else None,
+        exclude=group.members.values('id'),
+    )
+    
+    return render(request, 'a_rtchat/partials/member_search_results.html', {
+        'group': group,
+        'users': users,
+        'next_after': next_after,
+        'query': query,
+    })
+
+
 @login_required
 def group_settings(request, group_name):
     """Edit group settings"""
@@ -135,6 +160,8 @@ def chat_view(request, chatroom_name='public-chat'):
             return redirect('home')
         else:
             chat_group.members.add(request.user)
+            update_room_fanout(chat_group)
+            pin_to_primary(request.user.id)
     
     # Remove from online first (avoid duplicates)
     if request.user in chat_group.users_online.all():
@@ -143,8 +170,8 @@ def chat_view(request, chatroom_name='public-chat'):
     # Add user to online list
     chat_group.users_online.add(request.user)
     
-    # Get messages
-    chat_messages = chat_group.chat_messages.all()[:50]
+    # Get messages (from the replica unless this user just posted)
+    chat_messages = chat_group.chat_messages.using(read_alias(request.user)).select_related('attachment')[:50]
     
     # Get members sorted by online status
     all_members = chat_group.members.all()
@@ -178,6 +205,30 @@ def chat_view(request, chatroom_name='public-chat'):
     return render(request, 'a_rtchat/chat.html', context)
 
 
+@login_required
+def export_history(request, chatroom_name):
+    """Stream a room's full history as NDJSON or CSV, optionally gzipped"""
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    
+    if chat_group.admin != request.user and not request.user.is_staff:
+        messages.error(request, "Only the group admin can export the history!")
+        return redirect('chatroom', chatroom_name=chatroom_name)
+    
+    file_format = request.GET.get('format', 'ndjson')
+    if file_format not in EXPORT_FORMATS:
+        return HttpResponse(status=400)
+    gzip = request.GET.get('gzip') == '1'
+    
+    filename = f'{chatroom_name}.{file_format}'
+    response = StreamingHttpResponse(
+        stream_body(request, export_stream(chat_group, file_format, gzip=gzip, using=read_alias(request.user))),
+        content_type='application/gzip' if gzip else EXPORT_FORMATS[file_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="{filename}{".gz" if gzip else ""}"'
+    print(f"[EXPORT] User '{request.user.username}' exporting '{chatroom_name}' as {filename}")
+    return response
+
+
 @login_required
 def start_dm(request, username):
     """Start or get existing DM with a user"""
@@ -251,37 +302,107 @@ def leave_group(request, group_name):
         return redirect('chatroom', chatroom_name=group_name)
     
     group.members.remove(request.user)
+    update_room_fanout(group)
     messages.success(request, f"You left '{group.groupchat_name}'")
     return redirect('home')
 
+TRACKER_PAGE_SIZE = 50
+
+
 @login_required
 def online_tracker(request):
-    """Show all online users and their current chatrooms"""
-    # Get all online users
-    online_statuses = UserOnlineStatus.objects.filter(is_online=True).select_related('user', 'current_chatroom')
-    
-    # Get all users (for showing offline too)
-    all_statuses = UserOnlineStatus.objects.all().select_related('user', 'current_chatroom').order_by('-is_online', '-last_activity')
-    
-    # Group by chatroom
-    chatroom_users = {}
-    for status in online_statuses:
-        if status.current_chatroom:
-            room_name = status.current_chatroom.groupchat_name or status.current_chatroom.group_name
-            if room_name not in chatroom_users:
-                chatroom_users[room_name] = []
-            chatroom_users[room_name].append(status.user)
+    """Show per-room online counts; user lists are loaded page by page"""
+    # One aggregate over the partial is_online index instead of loading every status row
+    room_counts = list(
+        UserOnlineStatus.objects.using(read_alias(request.user)).filter(is_online=True)
+        .values('current_chatroom', 'current_chatroom__group_name', 'current_chatroom__groupchat_name')
+        .annotate(online=Count('id'))
+        .order_by('-online')
+    )
+    chatrooms = [
+        {
+            'group_name': row['current_chatroom__group_name'],
+            'name': row['current_chatroom__groupchat_name'] or row['current_chatroom__group_name'],
+            'online': row['online'],
+        }
+        for row in room_counts if row['current_chatroom'] is not None
+    ]
     
     context = {
-        'online_statuses': online_statuses,
-        'all_statuses': all_statuses,
-        'chatroom_users': chatroom_users,
-        'total_online': online_statuses.count(),
+        'chatrooms': chatrooms,
+        'total_online': sum(row['online'] for row in room_counts),
     }
     
     return render(request, 'a_rtchat/online_tracker.html', context)
 
 
+@login_required
+def online_tracker_room(request, chatroom_name):
+    """HTMX endpoint: one page of a room's online users, keyed by user id"""
+    chat_group = get_object_or_404(ChatGroup, group_name=chatroom_name)
+    statuses = (
+        UserOnlineStatus.objects.using(read_alias(request.user))
+        .filter(is_online=True, current_chatroom=chat_group)
+        .select_related('user__profile')
+        .order_by('user_id')
+    )
+    after = request.GET.get('after', '')
+    if after.isdigit():
+        statuses = statuses.filter(user_id__gt=int(after))
+    
+    page = list(statuses[:TRACKER_PAGE_SIZE + 1])
+    has_more = len(page) > TRACKER_PAGE_SIZE
+    page = page[:TRACKER_PAGE_SIZE]
+    
+    return render(request, 'a_rtchat/partials/online_tracker_room.html', {
+        'chat_group': chat_group,
+        'statuses': page,
+        'next_after': page[-1].user_id if has_more else None,
+    })
+
+
+@login_required
+def online_tracker_users(request):
+    """HTMX endpoint: one page of all users, online first, then most recently active"""
+    statuses = (
+        UserOnlineStatus.objects.using(read_alias(request.user))
+        .select_related('user__profile', 'current_chatroom')
+        .order_by('-is_online', '-last_activity', '-id')
+    )
+    cursor = parse_tracker_cursor(request.GET.get('cursor', ''))
+    if cursor:
+        is_online, last_activity, pk = cursor
+        # Rows after (is_online, last_activity, id) in the descending ordering above
+        after = Q(is_online=is_online, last_activity__lt=last_activity) | Q(
+            is_online=is_online, last_activity=last_activity, id__lt=pk
+        )
+        if is_online:
+            after |= Q(is_online=False)
+        statuses = statuses.filter(after)
+    
+    page = list(statuses[:TRACKER_PAGE_SIZE + 1])
+    has_more = len(page) > TRACKER_PAGE_SIZE
+    page = page[:TRACKER_PAGE_SIZE]
+    
+    next_cursor = None
+    if has_more:
+        last = page[-1]
+        next_cursor = f'{int(last.is_online)}|{last.last_activity.isoformat()}|{last.id}'
+    
+    return render(request, 'a_rtchat/partials/online_tracker_users.html', {
+        'statuses': page,
+        'next_cursor': next_cursor,
+    })
+
+
+def parse_tracker_cursor(cursor):
+    try:
+        is_online, last_activity, pk = cursor.split('|')
+        return is_online == '1', datetime.fromisoformat(last_activity), int(pk)
+    except ValueError:
+        return None
+
+
 @login_required
 def online_tracker_widget(request):
     """HTMX widget showing online users"""
@@ -289,4 +410,32 @@ def online_tracker_widget(request):
     
     return render(request, 'a_rtchat/partials/online_tracker_widget.html', {
         'online_statuses': online_statuses,
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+def analytics_dashboard(request):
+    """Staff-only room activity from the RoomStat rollups; ?format=json for the raw numbers"""
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    window = request.GET.get('window', '24h')
+    if window not in analytics.WINDOWS:
+        return HttpResponse(status=400)
+    chat_group = None
+    if request.GET.get('room'):
+        chat_group = get_object_or_404(ChatGroup, group_name=request.GET['room'])
+
+    data = analytics.dashboard(window, chat_group, using=read_alias(request.user))
+    if request.GET.get('format') == 'json':
+        return JsonResponse(data)
+
+    if data['room'] is not None:
+        busiest = max((period['messages'] for period in data['room']['periods']), default=0) or 1
+        for period in data['room']['periods']:
+            period['bar'] = round(period['messages'] * 100 / busiest)
+    return render(request, 'a_rtchat/analytics.html', {
+        **data,
+        'chat_group': chat_group,
+        'windows': list(analytics.WINDOWS),
+    })
@@ -0,0 +1,107 @@
+"""
+User directory: prefix search over usernames and display names.
+
+Every user has a few DirectoryEntry rows holding normalized terms
+(case-folded, accents stripped): the username, the display name and each
+word of the display name. A prefix lookup is an index scan over the
+matching terms only, and never touches users that don't match. How it is
+written depends on the backend's ordering:
+
+- PostgreSQL sorts text by its collation (en_US.UTF-8, ICU...), where a
+  range like ``prefix <= term < ...`` does not hold exactly the terms
+  starting with the prefix. So it uses LIKE 'prefix%' (startswith), which
+  the varchar_pattern_ops index serves under any collation.
+- SQLite compares text byte by byte, which is code point order for UTF-8.
+  There, ``prefix <= term < successor(prefix)`` is exact, and unlike its
+  case-insensitive LIKE it can use the index.
+
+Results are paginated by user id so each page is a bounded query.
+"""
+import unicodedata
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.db.models import Q
+
+from .models import DirectoryEntry
+
+PAGE_SIZE = 20
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return ' '.join(text.casefold().split())
+
+
+def terms_for(username, displayname=None):
+    terms = {normalize(username)}
+    name = normalize(displayname)
+    if name:
+        terms.add(name)
+        terms.update(name.split())
+    terms.discard('')
+    return {term[:150] for term in terms}
+
+
+def reindex_users(users):
+    """Replace the directory entries of these users (with profiles loaded)"""
+    users = list(users)
+    entries = []
+    for user in users:
+        profile = getattr(user, 'profile', None)
+        displayname = profile.displayname if profile else None
+        entries += [DirectoryEntry(user_id=user.id, term=term) for term in terms_for(user.username, displayname)]
+    DirectoryEntry.objects.filter(user__in=[user.id for user in users]).delete()
+    DirectoryEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+def successor(prefix):
+    """Smallest string after every string starting with prefix, in code point order (None if there is none)"""
+    last = ord(prefix[-1]) + 1
+    if 0xD800 <= last <= 0xDFFF:
+        # Surrogates can't be stored; the next real character is past them
+        last = 0xE000
+    if last > 0x10FFFF:
+        return None
+    return prefix[:-1] + chr(last)
+
+
+def prefix_filter(prefix):
+    upper = successor(prefix)
+    if connection.vendor == 'sqlite' and upper is not None:
+        return Q(term__gte=prefix, term__lt=upper)
+    return Q(term__startswith=prefix)
+
+
+def search(query, after=None, exclude=None, limit=PAGE_SIZE):
+    """
+    One page of users matching a prefix, ordered by id. ``exclude`` is any
+    iterable or queryset of user ids. Returns (users, next_after).
+    """
+    prefix = normalize(query)
+    if prefix:
+        ids = (
+            DirectoryEntry.objects.filter(prefix_filter(prefix))
+            .values_list('user_id', flat=True)
+            .distinct()
+            .order_by('user_id')
+        )
+        if after:
+            ids = ids.filter(user_id__gt=after)
+        if exclude is not None:
+            ids = ids.exclude(user_id__in=exclude)
+        ids = list(ids[:limit + 1])
+        users = User.objects.filter(id__in=ids[:limit])
+    else:
+        users = User.objects.all()
+        if after:
+            users = users.filter(id__gt=after)
+        if exclude is not None:
+            users = users.exclude(id__in=exclude)
+        ids = list(users.order_by('id').values_list('id', flat=True)[:limit + 1])
+        users = User.objects.filter(id__in=ids[:limit])
+
+    users = list(users.select_related('profile', 'online_status').order_by('id'))
+    next_after = ids[limit - 1] if len(ids) > limit else None
+    return users, next_after
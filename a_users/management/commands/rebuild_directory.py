@@ -0,0 +1,27 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from a_users.directory import reindex_users
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the user directory search terms for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        last_id = 0
+        total = 0
+        while True:
+            users = list(
+                User.objects.filter(id__gt=last_id)
+                .select_related('profile')
+                .order_by('id')[:options['chunk_size']]
+            )
+            if not users:
+                break
+            reindex_users(users)
+            last_id = users[-1].id
+            total += len(users)
+            self.stdout.write(f'[DIRECTORY] {total} users indexed')
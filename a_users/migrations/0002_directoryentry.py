@@ -0,0 +1,43 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def index_existing_users(apps, schema_editor):
+    from a_users.directory import terms_for
+
+    User = apps.get_model('auth', 'User')
+    DirectoryEntry = apps.get_model('a_users', 'DirectoryEntry')
+    entries = []
+    for user in User.objects.select_related('profile').iterator(chunk_size=2000):
+        displayname = user.profile.displayname if hasattr(user, 'profile') else None
+        entries += [DirectoryEntry(user_id=user.id, term=term) for term in terms_for(user.username, displayname)]
+        if len(entries) >= 5000:
+            DirectoryEntry.objects.bulk_create(entries)
+            entries = []
+    DirectoryEntry.objects.bulk_create(entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_users', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirectoryEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=150)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='directory_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'user'], name='directory_term_idx')],
+            },
+        ),
+        migrations.RunPython(index_existing_users, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.4 on 2026-10-19 00:59
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('a_users', '0003_hashed_uploads'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='directoryentry',
+            name='directory_term_idx',
+        ),
+        migrations.AddIndex(
+            model_name='directoryentry',
+            index=models.Index(fields=['term', 'user'], name='directory_term_pattern_idx', opclasses=['varchar_pattern_ops', '']),
+        ),
+    ]
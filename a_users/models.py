@@ -1,10 +1,11 @@
 from django.db import models
 from django.contrib.auth.models import User
 from django.conf import settings
+from a_core.media import HashedUploadTo
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
-    image = models.ImageField(upload_to='avatars/', null=True, blank=True)
+    image = models.ImageField(upload_to=HashedUploadTo('avatars', 'image'), null=True, blank=True)
     displayname = models.CharField(max_length=20, null=True, blank=True)
     info = models.TextField(null=True, blank=True) 
     
@@ -22,3 +23,21 @@ class Profile(models.Model):
         if self.image:
             return self.image.url
         return f'{settings.STATIC_URL}images/avatar.svg'
+
+
+class DirectoryEntry(models.Model):
+    """One normalized search term (username, display name or one of its words) for a user"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='directory_entries')
+    term = models.CharField(max_length=150)
+
+    class Meta:
+        indexes = [
+            # Prefix search scans term; user makes the index covering. On PostgreSQL
+            # varchar_pattern_ops lets LIKE 'prefix%' use it under any collation
+            # (other backends ignore opclasses)
+            models.Index(fields=['term', 'user'], opclasses=['varchar_pattern_ops', ''],
+                         name='directory_term_pattern_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.term} -> {self.user_id}'
@@ -3,9 +3,13 @@ from django.db.models.signals import post_save, pre_save
 from allauth.account.models import EmailAddress
 from django.contrib.auth.models import User
 from .models import Profile
+from .directory import reindex_users
+
+# User fields the directory and the allauth email address are built from
+INDEXED_FIELDS = {'username', 'first_name', 'last_name', 'email'}
 
 @receiver(post_save, sender=User)       
-def user_postsave(sender, instance, created, **kwargs):
+def user_postsave(sender, instance, created, update_fields=None, **kwargs):
     user = instance
     
     # add profile if user is created
@@ -13,7 +17,13 @@ def user_postsave(sender, instance, created, **kwargs):
         Profile.objects.create(
             user = user,
         )
+    elif update_fields is not None and not INDEXED_FIELDS & set(update_fields):
+        # e.g. the last_login update on every login: nothing to reindex
+        return
     else:
+        # username may have changed
+        reindex_users([user])
+
         # update allauth emailaddress if exists 
         try:
             email_address = EmailAddress.objects.get_primary(user)
@@ -34,4 +44,10 @@ def user_postsave(sender, instance, created, **kwargs):
 @receiver(pre_save, sender=User)
 def user_presave(sender, instance, **kwargs):
     if instance.username:
-        instance.username = instance.username.lower()
\ No newline at end of file
+        instance.username = instance.username.lower()
+
+
+@receiver(post_save, sender=Profile)
+def profile_postsave(sender, instance, **kwargs):
+    # keep the user directory in step with the display name
+    reindex_users([instance.user])
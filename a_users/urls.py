@@ -2,6 +2,7 @@ from django.urls import path
 from a_users.views import *
 
 urlpatterns = [
+    path('search/', user_search, name="user-search"),
     path("<str:username>/", profile_view, name="profile"),
     path('<username>/edit/', profile_edit_view, name="profile-edit"),
     path('<username>/onboarding/', profile_edit_view, name="profile-onboarding"),
@@ -7,9 +7,28 @@ from django.contrib.auth.models import User
 from django.contrib.auth.views import redirect_to_login
 from django.contrib import messages
 from .forms import *
+from .directory import search as search_directory
 from django.http import Http404
 
 
+@login_required
+def user_search(request):
+    """HTMX endpoint: one page of users whose name starts with the query"""
+    query = request.GET.get('q', '')
+    after = request.GET.get('after', '')
+    users, next_after = search_directory(
+        query,
+        after=int(after) if after.isdigit() else None,
+        exclude=[request.user.id],
+    )
+
+    return render(request, 'a_users/partials/user_search_results.html', {
+        'users': users,
+        'next_after': next_after,
+        'query': query,
+    })
+
+
 @login_required
 def profile_view(request, username):
     # Fetch profile owner